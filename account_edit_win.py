@@ -194,13 +194,7 @@ class AccountEditWin:
         self.tracking_end_date = parent.get_tracking_end_date()
 
         self.data_source_orig = data_source  # reference to official
-        self.data_source = []  # make a copy of the data
-        #############################################################
-        # Add an ID for ease of record tracking and perform the copy
-        #############################################################
-        for id_, item in enumerate(self.data_source_orig):
-            item['id'] = id_
-            self.data_source.append(item.copy())
+        self.data_source = copy_data_source(data_source)  # make a copy of the data
         self.next_id = len(self.data_source)
 
         self.instrument_type = instrument_type
@@ -739,42 +733,55 @@ class AccountEditWin:
                         "Each Account Name must be unique!")
                     return
 
-        # look for records which have changed. All new records are at the end.
-        # The initial scan is performed based on the number of records in the
-        # original data source
-
-        # mod_rec_data is a list of tuples defining (key,data) for each change
-        mod_rec_data = []
-        for rec_num, rec in enumerate(self.data_source_orig):
-            if 'deleteKey' in self.data_source[rec_num]:
-                if self.instrument_type == 'account':
-                    pass
-                    # inform the parent to delete the all associated records
-                    self.parent.account_delete(rec['rec_id'])
-                self.parent.delete_db_rec(self.instrument_type, rec['rec_id'])
-            else:
-                mod_rec_data.clear()
-                for key in rec.keys():
-                    if self.data_source[rec_num][key] != rec[key]:
-                        if self.instrument_type == 'account' and key == 'account_name':
-                            self.parent.account_name_changed(rec[key],  # old name
-                                                             self.data_source[rec_num][key])  # new name
-                        mod_rec_data.append((key, self.data_source[rec_num][key]))
-                if mod_rec_data:
-                    self.parent.write_to_db(self.instrument_type,
-                                            self.data_source[rec_num]['rec_id'],
-                                            mod_rec_data)
-        # look for new records
-        if len(self.data_source) > len(self.data_source_orig):
-            # print("We have new records")
-            for i in range(len(self.data_source_orig), len(self.data_source)):
-                # if its new and flagged for delete, ignore it
-                if 'deleteKey' not in self.data_source[i]:
-                    self.clean_data_rec(self.data_source[i])
+        # All the changes are written to the DB as a single batch.
+        self.parent.begin_batch()
+        try:
+            # look for records which have changed. All new records are at the end.
+            # The initial scan is performed based on the number of records in the
+            # original data source
+
+            # mod_rec_data is a list of tuples defining (key,data) for each change
+            mod_rec_data = []
+            for rec_num, rec in enumerate(self.data_source_orig):
+                if 'deleteKey' in self.data_source[rec_num]:
                     if self.instrument_type == 'account':
-                        self.parent.account_create(self.data_source[i])
-                    else:
-                        self.parent.new_db_rec(self.instrument_type, self.data_source[i])
+                        pass
+                        # inform the parent to delete the all associated records
+                        self.parent.account_delete(rec['rec_id'])
+                    self.parent.delete_db_rec(self.instrument_type, rec['rec_id'])
+                else:
+                    mod_rec_data.clear()
+                    for key in rec.keys():
+                        if self.data_source[rec_num][key] != rec[key]:
+                            if self.instrument_type == 'account' and key == 'account_name':
+                                self.parent.account_name_changed(rec[key],  # old name
+                                                                 self.data_source[rec_num][key])  # new name
+                            mod_rec_data.append((key, self.data_source[rec_num][key]))
+                    if mod_rec_data:
+                        self.parent.write_to_db(self.instrument_type,
+                                                self.data_source[rec_num]['rec_id'],
+                                                mod_rec_data)
+            # look for new records
+            if len(self.data_source) > len(self.data_source_orig):
+                # print("We have new records")
+                for i in range(len(self.data_source_orig), len(self.data_source)):
+                    # if its new and flagged for delete, ignore it
+                    if 'deleteKey' not in self.data_source[i]:
+                        self.clean_data_rec(self.data_source[i])
+                        if self.instrument_type == 'account':
+                            self.parent.account_create(self.data_source[i])
+                        else:
+                            self.parent.new_db_rec(self.instrument_type, self.data_source[i])
+
+            self.parent.commit_batch()
+        except RuntimeError as e:
+            self.parent.rollback_batch()
+            messagebox.showerror("Update Error", "The changes were not saved: {}".format(e))
+            return
+        finally:
+            # never leave the batch open, eg after an unexpected error.
+            # Once committed, there's nothing to roll back.
+            self.parent.rollback_batch()
 
         # restart to accommodate all the changes
         self.parent.restart()
@@ -1256,9 +1263,44 @@ class ActionsOnInstrument:
         self.close_actions_win()
 
     def analysis(self):
-        # fix me - need to finish this
+        """The user has requested the yield analysis of an instrument
+        (eg a bond)
+        """
+        if self.instrument_type == 'bond':
+            self.display_bond_analysis()
+
         self.close_actions_win()
 
+    def display_bond_analysis(self):
+        """Display the yields of a bond at its purchase price and at its
+        most recent price. The yields of all bonds in the window are
+        computed (and cached) together.
+        """
+        rec = self.data_source[self.id]
+        at_cost = self.parent.get_bond_yields(self.data_source)[self.id]
+        at_market = self.parent.get_bond_yields(self.data_source, at_market=True)[self.id]
+
+        def percent(value):
+            return "--" if value is None else "{:.3f}%".format(value)
+
+        text = "CUSIP: {}\n\n".format(rec['cusip'])
+        text += "{:20} {:>12} {:>12}\n".format("", "At Cost", "At Market")
+        text += "{:20} {:>12} {:>12}\n".format("Price", rec['bond_price'],
+                                                rec['most_recent_price'])
+        text += "{:20} {:>12} {:>12}\n".format("Settlement", rec['purchase_date'],
+                                                self.parent.format_date(
+                                                    self.parent.get_start_date()))
+        for label, field in (("Yield to Maturity", 'ytm'), ("Yield to Call", 'ytc'),
+                             ("Yield to Worst", 'ytw')):
+            text += "{:20} {:>12} {:>12}\n".format(label, percent(getattr(at_cost, field)),
+                                                    percent(getattr(at_market, field)))
+        call_date = at_cost.call_date or at_market.call_date
+        text += "\n{:20} {}\n".format("Call Date", "--" if call_date is None else
+                                       self.parent.format_date(call_date))
+        text += "{:20} {}\n".format("Estimated Yield", rec['est_yield'])
+
+        ScrollableWin("Bond Analysis", text, self.parent_win)
+
     def cf_details(self):
         """The user has requested cash flow details of an instrument
         (eg a bond or CD)
@@ -1809,6 +1851,17 @@ class NewInstrument:
 
 # ===========Support functions used by multiple classes ========================
 
+def copy_data_source(data_source):
+    """Add an ID to each record for ease of record tracking and return a
+    list with a copy of each record."""
+
+    copy = []
+    for id_, item in enumerate(data_source):
+        item['id'] = id_
+        copy.append(item.copy())
+    return copy
+
+
 def add_heading_widgets(parent, column_descriptor):
     """Create a row of heading widgets given a column description."""
 
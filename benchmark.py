@@ -0,0 +1,357 @@
+#
+# Author: Greg Glezman
+#
+# Copyright (c) 2018-2022 G.Glezman.  All Rights Reserved.
+#
+# This file contains the benchmark of the cash flow engine.
+#
+# Developers Notes
+# 1. generate_portfolio() writes a database file with a synthetic
+#    portfolio: accounts, bonds (some called), CDs, loans, a fund and
+#    transfers of mixed regularities. The same seed always produces the
+#    same database so results can be compared across commits.
+# 2. run_benchmark() times, for one database
+#       restart          - a full rebuild of the ledger (ledger cache cleared)
+#       restart_cached   - a full restart served from the ledger cache
+#       process_transfers, apply_interest - the stages on their own
+#       get_account_data - monthly balances of every account
+#       edit_win_prep    - the data prep of the AccountEditWin windows
+#    Each is run 'repeat' times, the min and median are reported. The per
+#    stage profile of the last full rebuild is reported too (see profiling.py).
+# 3. The results are written as JSON. Use --compare to show the change
+#    against the results of an earlier run, eg
+#         python benchmark.py --output new.json --compare old.json
+# 4. The analysis start date is fixed (START_DATE) so the work done doesn't
+#    depend on the day the benchmark is run.
+
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from operator import itemgetter
+
+import cf_calendar
+from cf import CfAnalysis, Logger
+from file_manager import FileManager
+
+RESULTS_VERSION = 1
+
+START_DATE = datetime(2024, 1, 15)
+
+# Portfolio size at each scale
+SCALES = {
+    'small': dict(accounts=5, bonds=20, cds=10, loans=3, transfers=10),
+    'medium': dict(accounts=20, bonds=200, cds=50, loans=10, transfers=50),
+    'large': dict(accounts=50, bonds=1000, cds=200, loans=30, transfers=200),
+}
+
+TIMINGS = ('restart', 'restart_cached', 'process_transfers', 'apply_interest',
+           'get_account_data', 'edit_win_prep')
+
+# One occurrence spec per transfer regularity, used in turn
+TRANSFER_SPECS = ('2021-06-01;None;monthly;1',
+                  '2022-01-03;None;weekly;2',
+                  '2021-05-05;10;quarterly',
+                  '2021-01-15;2040-01-01;twice-a-month;28',
+                  '2025-03-03;2025-03-03;once',
+                  '2021-02-02;None;bi-weekly',
+                  '2021-04-01;None;annually',
+                  '2021-07-01;5;semi-annually')
+
+FREQUENCIES = ('monthly', 'quarterly', 'semi-annual', 'annual')
+
+# table -> sort keys of its AccountEditWin (see cf_gui.MyMenuBar.edit_*)
+EDIT_WIN_SORT_KEYS = {
+    'account': ('account_name', 'account_number'),
+    'ca': ('account_name', 'balance'),
+    'cd': ('account_name', 'maturity_date'),
+    'loan': ('account_name', 'payoff_date'),
+    'bond': ('account_name', 'maturity_date'),
+    'fund': ('account_name', 'date'),
+    'transfer': ('from_account_name', 'to_account_name'),
+}
+
+
+def date_str(dt):
+    return dt.strftime("%Y-%m-%d")
+
+
+def open_analysis(filename=None):
+    """Return a CfAnalysis (with the database file open if one is given)"""
+
+    logger = Logger(logging.WARNING)
+    fm = FileManager(logger)
+    cfa = CfAnalysis(fm, logger)
+    fm.set_cfa(cfa)
+    if filename:
+        fm.open_database(filename)
+    cfa.start_date = START_DATE
+
+    return cfa
+
+
+def generate_portfolio(filename, accounts, bonds, cds, loans, transfers, seed=1):
+    """Write a database file holding a synthetic portfolio (see Developers Notes)"""
+
+    if os.path.exists(filename):
+        os.remove(filename)
+    rand = random.Random(seed)
+
+    cfa = open_analysis()
+    cfa.fm.create_db(filename)
+
+    names = ["acc{:03}".format(i) for i in range(accounts)]
+    for i, name in enumerate(names):
+        cfa.account_create(dict(account_name=name, account_number=str(1000 + i),
+                                opening_date="2021-{:02}-{:02}".format(1 + i % 12, 1 + i % 28),
+                                account_type="Brokerage", update_method="Manual", note=""))
+
+    cfa.begin_batch()
+    try:
+        for i, rec in enumerate(cfa.get_real_accounts('ca')):
+            cfa.write_to_db('ca', rec['rec_id'], [('balance', 10000.0 * (1 + i % 10)),
+                                                  ('rate', 0.5 + i % 4),
+                                                  ('frequency', FREQUENCIES[i % 4]),
+                                                  ('interest_date', "2021-01-{:02}".format(1 + i % 28))])
+
+        for i in range(bonds):
+            purchase_date = datetime(2021 + i % 5, 1 + i % 12, 1 + i % 28)
+            maturity_date = datetime(2026 + i % 25, 1 + (i * 7) % 12, 1 + (i * 3) % 28)
+            called = i % 4 == 0
+            call_date = datetime(maturity_date.year - 1, maturity_date.month, 1)
+            cfa.new_db_rec('bond', dict(
+                account_name=rand.choice(names), bond_price=round(95 + rand.random() * 10, 3),
+                quantity=rand.randint(1, 20), coupon=round(rand.random() * 6, 3), fee=1.0,
+                purchase_date=date_str(purchase_date), maturity_date=date_str(maturity_date),
+                frequency=rand.choice(FREQUENCIES), issuer="Issuer {}".format(i % 17),
+                cusip="B{:07}".format(i), call_date=date_str(call_date) if called else "None",
+                call_price=101.0 if called else 0.0, most_recent_price=100.0,
+                moodys_rating="", product_type="", snp_rating="", most_recent_value=0.0,
+                next_call_date="None", est_yield=0.0))
+
+        for i in range(cds):
+            purchase_date = datetime(2021 + i % 4, 1 + i % 12, 1 + i % 28)
+            maturity_date = datetime(purchase_date.year + 1 + i % 5, 1 + (i * 5) % 12, 1 + (i * 2) % 28)
+            cfa.new_db_rec('cd', dict(
+                account_name=rand.choice(names), purchase_price=1000.0, quantity=rand.randint(1, 10),
+                rate=round(1 + rand.random() * 4, 2), purchase_date=date_str(purchase_date),
+                maturity_date=date_str(maturity_date), frequency=rand.choice(FREQUENCIES + ('once',)),
+                cusip="C{:07}".format(i)))
+
+        for i in range(loans):
+            cfa.new_db_rec('loan', dict(
+                account_name=rand.choice(names), balance=5000.0 + 1000 * (i % 10),
+                rate=round(2 + rand.random() * 5, 2), orig_date="2022-02-16",
+                payoff_date="{}-08-15".format(2026 + i % 15), frequency=rand.choice(('monthly', 'annual')),
+                note="Loan {}".format(i)))
+
+        cfa.new_db_rec('fund', dict(account_name=names[0], symbol="FUND", date="2025-03-03",
+                                    balance=1234.5, est_roi=0.0))
+
+        for i in range(transfers):
+            from_name = rand.choice(names + ['income'])
+            to_name = rand.choice([name for name in names + ['expenses'] if name != from_name])
+            cfa.new_db_rec('transfer', dict(
+                from_account_name=from_name, to_account_name=to_name, amount=100.0 + i,
+                frequency=TRANSFER_SPECS[i % len(TRANSFER_SPECS)], inflation=float(i % 3),
+                note="Transfer {}".format(i)))
+
+        cfa.commit_batch()
+    except Exception:
+        cfa.rollback_batch()
+        raise
+    finally:
+        cfa.end_batch()
+
+    cfa.fm.db_conn.close()
+
+
+def clear_ledger_cache(cfa):
+    cfa.dao.execute("DELETE FROM ledger_cache")
+    cfa.commit_db()
+    cfa.ledger_hash = None
+
+
+def time_call(func, repeat, setup=None):
+    """Return the run times of 'func', in seconds. 'setup' runs untimed before each call."""
+
+    times = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+
+    return times
+
+
+def run_benchmark(filename, months=360, repeat=3):
+    """Time the engine on the database file.
+
+    Return a dict of timing name -> run times and the RestartProfile of the
+    last full rebuild.
+    """
+
+    from account_edit_win import copy_data_source
+
+    cfa = open_analysis(filename)
+    timings = {}
+
+    def full_restart():
+        cfa.mark_all_dirty()
+        cfa.restart(months)
+
+    def cold_setup():
+        clear_ledger_cache(cfa)
+        cfa.mark_all_dirty()
+
+    timings['restart'] = time_call(lambda: cfa.restart(months), repeat, cold_setup)
+    profile = cfa.get_restart_profile()
+    timings['restart_cached'] = time_call(full_restart, repeat)
+
+    # The stages on their own, from the snapshot of the last restart
+    def transfers_setup():
+        cfa.ledger.clear()
+        cfa.account_set_up()
+        cfa.stage_transactions()
+
+    timings['process_transfers'] = time_call(cfa.process_transfers, repeat, transfers_setup)
+    cfa.commit_transactions()
+
+    def interest_setup():
+        cfa.ledger.clear()
+        cfa.build_ledger()
+
+    timings['apply_interest'] = time_call(cfa.apply_interest, repeat, interest_setup)
+
+    # leave a complete ledger behind
+    full_restart()
+    account_ids = sorted(cfa.ledger)
+    end_date = cf_calendar.add_months(START_DATE, months)
+
+    def get_account_data():
+        for account_rec_id in account_ids:
+            cfa.get_account_data(account_rec_id, 'Monthly', START_DATE, end_date)
+
+    timings['get_account_data'] = time_call(get_account_data, repeat)
+
+    def edit_win_prep():
+        for table, sort_keys in EDIT_WIN_SORT_KEYS.items():
+            if table in ('account', 'ca'):
+                data_source = cfa.get_real_accounts(table)
+            else:
+                data_source = cfa.get_from_db(table)
+            copy_data_source(data_source).sort(key=itemgetter(*sort_keys))
+
+    timings['edit_win_prep'] = time_call(edit_win_prep, repeat)
+
+    cfa.fm.db_conn.close()
+
+    return timings, profile
+
+
+def summarize(times):
+    return {'min': min(times), 'median': statistics.median(times), 'runs': times}
+
+
+def get_commit():
+    """Return the abbreviated hash of the current git commit or None"""
+
+    try:
+        result = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)))
+    except OSError:
+        return None
+    return result.stdout.strip() or None
+
+
+def run_scales(scales, months=360, repeat=3, work_dir=None, seed=1):
+    """Generate a portfolio at each scale, benchmark it and return the results dict"""
+
+    results = {
+        'version': RESULTS_VERSION,
+        'commit': get_commit(),
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'numpy': cf_calendar.np is not None,
+        'months': months,
+        'repeat': repeat,
+        'scales': {},
+    }
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for scale in scales:
+            portfolio = SCALES[scale]
+            filename = os.path.join(work_dir or tmp_dir, "bench_{}.db".format(scale))
+            generate_portfolio(filename, seed=seed, **portfolio)
+            timings, profile = run_benchmark(filename, months, repeat)
+            results['scales'][scale] = {
+                'portfolio': portfolio,
+                'timings': {name: summarize(times) for name, times in timings.items()},
+                'stages': profile.as_dict(),
+            }
+
+    return results
+
+
+def format_results(results, base=None):
+    """Return a report of the results as a list of lines.
+
+    If 'base' results are given, the change from them is shown too.
+    """
+    lines = ["commit {}  python {}  numpy {}  months {}  repeat {}".format(
+        results['commit'], results['python'], results['numpy'], results['months'], results['repeat'])]
+    if base:
+        lines.append("compared with commit {}".format(base['commit']))
+
+    for scale, scale_results in results['scales'].items():
+        lines.append("")
+        lines.append("{} {}".format(scale, scale_results['portfolio']))
+        base_timings = base['scales'].get(scale, {}).get('timings', {}) if base else {}
+        for name in TIMINGS:
+            timing = scale_results['timings'][name]
+            line = "  {:18} min {:9.4f}  median {:9.4f}".format(name, timing['min'], timing['median'])
+            if name in base_timings and base_timings[name]['min'] > 0:
+                line += "  x{:.2f}".format(timing['min'] / base_timings[name]['min'])
+            lines.append(line)
+
+    return lines
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the cash flow engine")
+    parser.add_argument("--scales", nargs="+", choices=list(SCALES), default=['small', 'medium'],
+                        help="portfolio sizes to run (default: small medium)")
+    parser.add_argument("--months", type=int, default=360, help="months of analysis (default: 360)")
+    parser.add_argument("--repeat", type=int, default=3, help="runs of each timing (default: 3)")
+    parser.add_argument("--seed", type=int, default=1, help="seed of the portfolio generator")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="JSON results of an earlier run to compare with")
+    parser.add_argument("--keep", metavar="DIR", help="keep the generated databases in DIR")
+    args = parser.parse_args(argv)
+
+    results = run_scales(args.scales, args.months, args.repeat, args.keep, args.seed)
+
+    if args.output:
+        with open(args.output, 'w') as file_obj:
+            json.dump(results, file_obj, indent=2)
+
+    base = None
+    if args.compare:
+        with open(args.compare) as file_obj:
+            base = json.load(file_obj)
+
+    print("\n".join(format_results(results, base)))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
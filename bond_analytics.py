@@ -0,0 +1,233 @@
+#
+# Author: Greg Glezman
+#
+# Copyright (c) 2018-2022 G.Glezman.  All Rights Reserved.
+#
+# This file contains the yield analytics of bonds: yield to maturity,
+# yield to call and yield to worst.
+#
+# Developers Notes
+# 1. A yield is the rate that discounts the cash flow of a bond bought at
+#    'price' on the settlement date to zero. The cash flow is the schedule
+#    of CfAnalysis.bond_cash_flow() for the bond with the settlement date as
+#    its purchase date and no fees: the price plus accrued interest paid
+#    out, the coupons and the redemption. The rate is compounded at the
+#    coupon frequency and time is counted in 30/360 years, the convention
+#    of the coupons (see day_count.py).
+# 2. The yield to maturity ignores any call. The yield to call uses the
+#    call of a called bond, or else the next call date (next_call_date) at
+#    par. The yield to worst is the lower of the two.
+# 3. The schedules of all bonds are built in one call (see bond_schedule.py)
+#    and the yields are solved together by Newton's method, kept inside a
+#    bracket that is halved whenever a Newton step leaves it, so each
+#    yield converges (see _solve()). Without NumPy the same method runs
+#    one schedule at a time.
+# 4. Results are cached by bond record, price and settlement date. An edit
+#    of the record or a new price gives a new key.
+
+from datetime import datetime
+from typing import NamedTuple, Optional
+
+import data_file_constants as dfc
+from bond_schedule import schedule_valid_bonds, FREQUENCIES
+from day_count import thirty_360_days
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional
+    np = None
+
+LOW_YIELD = -0.9  # bracket of the solver, as a rate
+HIGH_YIELD = 10.0
+TOLERANCE = 1e-12
+MAX_ITERATIONS = 100
+_DATE_FORMATS = (dfc.DATE_FORMAT, "%m/%d/%Y")  # the second as left by the Fidelity import
+
+
+class BondYields(NamedTuple):
+    """The yields of a bond, in percent. None when there's no such yield"""
+    ytm: Optional[float]
+    ytc: Optional[float]
+    ytw: Optional[float]
+    call_date: Optional[datetime]  # the call used for ytc
+
+
+class BondAnalytics:
+    """Compute and cache the yields of bonds (see Developers Notes).
+
+    Args:
+        cash_flow (function): schedule of a single bond, normally
+            CfAnalysis.bond_cash_flow()
+    """
+    MAX_CACHE = 4096
+
+    def __init__(self, cash_flow):
+        self.cash_flow = cash_flow
+        self._cache = {}
+
+    def yields(self, bonds, prices=None, settlement=None):
+        """Return a list with the BondYields of each of 'bonds'.
+
+        'prices' holds the price of each bond (percent of par). By default
+        it's the purchase price (bond_price). 'settlement' is the datetime
+        the bonds are bought. By default it's the purchase date of each bond.
+        """
+        if prices is None:
+            prices = [bond['bond_price'] for bond in bonds]
+
+        results = [None] * len(bonds)
+        pending = []  # (index, cache key, ytm entry, ytc entry, call date)
+        for index, (bond, price) in enumerate(zip(bonds, prices)):
+            settle = bond['purchase_date'] if settlement is None else \
+                settlement.strftime(dfc.DATE_FORMAT)
+            key = (tuple(sorted(bond.items())), price, settle)
+            results[index] = self._cache.get(key)
+            if results[index] is None:
+                pending.append((index, key) + self._scenarios(bond, price, settle))
+
+        entries = []  # the scenarios to solve, each at most once
+        for _, _, ytm_entry, ytc_entry, _ in pending:
+            entries.extend(entry for entry in (ytm_entry, ytc_entry) if entry is not None)
+        solved = dict(zip(map(id, entries), self._solve_entries(entries)))
+
+        if len(self._cache) + len(pending) > self.MAX_CACHE:
+            self._cache.clear()
+        for index, key, ytm_entry, ytc_entry, call_date in pending:
+            ytm = solved.get(id(ytm_entry))
+            ytc = solved.get(id(ytc_entry))
+            known = [y for y in (ytm, ytc) if y is not None]
+            results[index] = self._cache[key] = BondYields(
+                ytm, ytc, min(known) if known else None, call_date if ytc is not None else None)
+
+        return results
+
+    @staticmethod
+    def _scenarios(bond, price, settle):
+        """Return the bond entries of the maturity and call schedules of
+        'bond' bought at 'price' on 'settle' (None if there's no such
+        schedule) and the call date.
+        """
+        if bond['frequency'] not in FREQUENCIES or type(price) not in (float, int) or \
+                price <= 0 or not settle or not bond['maturity_date']:
+            return None, None, None
+
+        bought = dict(bond, purchase_date=settle, bond_price=price, fee=0.0)
+        ytm_entry = dict(bought, call_price=0.0) if settle < bond['maturity_date'] else None
+
+        if bond['call_price']:
+            call_date = _parse_date(bond['call_date'])
+            ytc_entry = bought
+        else:
+            call_date = _parse_date(bond['next_call_date'])
+            ytc_entry = None if call_date is None else \
+                dict(bought, call_price=100.0, call_date=call_date.strftime(dfc.DATE_FORMAT))
+        if ytc_entry is not None and not settle < ytc_entry['call_date'] < bond['maturity_date']:
+            ytc_entry = None
+
+        return ytm_entry, ytc_entry, call_date
+
+    def _solve_entries(self, entries):
+        """Return the yield in percent of each entry, None if it has none"""
+
+        if not entries:
+            return []
+        valid, schedule = schedule_valid_bonds(entries, self.cash_flow)
+        settle = [datetime.strptime(entry['purchase_date'], dfc.DATE_FORMAT).toordinal()
+                  for entry in valid]
+        factor = [FREQUENCIES[entry['frequency']][1] for entry in valid]
+        rates = dict(zip(map(id, valid), _solve(schedule, settle, factor)))
+
+        return [None if rates.get(id(entry)) is None else rates[id(entry)] * 100
+                for entry in entries]
+
+
+def _parse_date(text):
+    """Return 'text' as a datetime, None if it's not a date"""
+
+    for date_format in _DATE_FORMATS:
+        try:
+            return datetime.strptime(text, date_format)
+        except (TypeError, ValueError):
+            pass
+    return None
+
+
+def _solve(schedule, settle, factor):
+    """Return the rate of each bond of 'schedule' that discounts its rows
+    to zero, None if there's none in the bracket (see Developers Notes).
+
+    'settle' is the day number and 'factor' the coupons per year of each bond.
+    """
+    if np is None:
+        return [_solve_one(schedule, index, settle[index], factor[index])
+                for index in range(len(settle))]
+
+    count = len(settle)
+    bond = schedule.bond
+    times = thirty_360_days(np.asarray(settle)[bond], schedule.date)
+    amounts = schedule.amount
+    factor = np.asarray(factor, dtype=float)[bond]
+
+    def npv(rate):
+        base = 1 + rate[bond] / factor
+        discounted = amounts * base ** (-factor * times)
+        return (np.bincount(bond, weights=discounted, minlength=count),
+                np.bincount(bond, weights=-times * discounted / base, minlength=count))
+
+    low = np.full(count, LOW_YIELD)
+    high = np.full(count, HIGH_YIELD)
+    bracketed = (npv(low)[0] >= 0) & (npv(high)[0] <= 0)
+
+    rate = np.full(count, 0.05)
+    for _ in range(MAX_ITERATIONS):
+        value, slope = npv(rate)
+        above = value > 0
+        low = np.where(above, rate, low)
+        high = np.where(above, high, rate)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            step = rate - value / slope
+        inside = (step > low) & (step < high)
+        new_rate = np.where(inside, step, (low + high) / 2)
+        done = np.abs(new_rate - rate) < TOLERANCE
+        rate = new_rate
+        if done[bracketed].all():
+            break
+
+    return [r if ok else None for r, ok in zip(rate.tolist(), bracketed.tolist())]
+
+
+def _solve_one(schedule, index, settle, factor):
+    """_solve() of bond 'index' of 'schedule', without NumPy"""
+
+    first = schedule.start[index]
+    last = schedule.start[index + 1] if index + 1 < len(schedule.start) else len(schedule)
+    times = thirty_360_days([settle] * (last - first), schedule.date[first:last])
+    amounts = schedule.amount[first:last]
+
+    def npv(rate):
+        base = 1 + rate / factor
+        value = slope = 0.0
+        for time, amount in zip(times, amounts):
+            discounted = amount * base ** (-factor * time)
+            value += discounted
+            slope += -time * discounted / base
+        return value, slope
+
+    low, high = LOW_YIELD, HIGH_YIELD
+    if npv(low)[0] < 0 or npv(high)[0] > 0:
+        return None
+
+    rate = 0.05
+    for _ in range(MAX_ITERATIONS):
+        value, slope = npv(rate)
+        if value > 0:
+            low = rate
+        else:
+            high = rate
+        step = rate - value / slope if slope else low
+        new_rate = step if low < step < high else (low + high) / 2
+        if abs(new_rate - rate) < TOLERANCE:
+            return new_rate
+        rate = new_rate
+
+    return rate
@@ -0,0 +1,302 @@
+#
+# Author: Greg Glezman
+#
+# Copyright (c) 2018-2022 G.Glezman.  All Rights Reserved.
+#
+# This file contains the cash flow schedule of all the bonds of a portfolio.
+#
+# Developers Notes
+# 1. schedule_bonds() produces the same rows as CfAnalysis.bond_cash_flow()
+#    for each bond, in the same order: purchase, accrued interest and fees
+#    on the purchase date, the coupons and then the call interest and call
+#    or the sale at maturity. The rows of all bonds are held as columns
+#    (see BondSchedule) and the amounts are computed with the same
+#    operations in the same order, so they are identical to the floats of
+#    bond_cash_flow().
+# 2. If NumPy is installed the bonds are scheduled together on arrays.
+#    Dates are day numbers (date.toordinal()). The coupon dates of every
+#    bond are generated in one pass, counting back from maturity as
+#    get_periodic_dates() does.
+# 3. A bond that can't be scheduled on arrays (no NumPy, an unsupported
+#    frequency, a missing value or dates out of order) is scheduled by the
+#    'cash_flow' function passed in, normally CfAnalysis.bond_cash_flow(),
+#    so it gets the same rows or raises the same error.
+
+from datetime import datetime
+
+from day_count import thirty_360_days
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional
+    np = None
+
+# row kinds, in the order of the rows of a bond
+PURCHASE = 0
+ACCRUED_INTEREST = 1
+FEES = 2
+INTEREST = 3
+CALL_INTEREST = 4
+CALL = 5
+SALE = 6
+
+KIND_NOTES = ("Bond Purchase", "Bond Accrued Interest", "Bond Fees", "Bond Interest",
+              "Bond Interest (call)", "Bond Call", "Bond Sale")
+NOTE_KINDS = {note: kind for kind, note in enumerate(KIND_NOTES)}
+
+# frequency -> (months between coupons, coupons per year)
+FREQUENCIES = {'monthly': (1, 12), 'quarterly': (3, 4), 'semi-annual': (6, 2), 'annual': (12, 1)}
+
+_NUMBER_COLUMNS = ('bond_price', 'quantity', 'coupon', 'fee', 'call_price')
+_EPOCH_ORDINAL = 719163  # date(1970, 1, 1).toordinal(), day 0 of datetime64
+
+
+class BondSchedule:
+    """The cash flow rows of a list of bonds, stored as columns.
+
+    Row i is paid on day number date[i] (see date.toordinal()), in the
+    amount amount[i] (negative when paid out) and is of kind kind[i]
+    (see KIND_NOTES). bond[i] is the index of its bond in the list. The
+    rows of a bond are consecutive, starting at start[bond].
+    The columns are NumPy arrays or lists.
+    """
+
+    def __init__(self, bond, date, amount, kind, start):
+        self.bond = bond
+        self.date = date
+        self.amount = amount
+        self.kind = kind
+        self.start = start
+
+    def __len__(self):
+        return len(self.kind)
+
+    def rows(self):
+        """Iterate over the rows as (bond index, datetime, amount, kind) tuples"""
+
+        columns = (self.bond, self.date, self.amount, self.kind)
+        if np is not None and isinstance(self.kind, np.ndarray):
+            columns = [column.tolist() for column in columns]
+
+        date_cache = {}
+        for bond, day, amount, kind in zip(*columns):
+            dt = date_cache.get(day)
+            if dt is None:
+                dt = date_cache[day] = datetime.fromordinal(day)
+            yield bond, dt, amount, kind
+
+    def details(self, index):
+        """Return the rows of bond 'index' in the form of bond_cash_flow()"""
+
+        first = int(self.start[index])
+        last = int(self.start[index + 1]) if index + 1 < len(self.start) else len(self)
+
+        return [{'date': datetime.fromordinal(int(self.date[i])), 'amount': float(self.amount[i]),
+                 'note': KIND_NOTES[self.kind[i]]} for i in range(first, last)]
+
+
+def schedule_bonds(bonds, cash_flow):
+    """Return the BondSchedule of the bond records 'bonds'.
+
+    'cash_flow' returns the rows of a single bond in the form of
+    CfAnalysis.bond_cash_flow(). It is used for the bonds that are not
+    scheduled on arrays (see Developers Notes).
+    """
+    bonds = list(bonds)
+    if np is None or not bonds:
+        return _schedule_rows([cash_flow(entry) for entry in bonds])
+
+    vector = [i for i, entry in enumerate(bonds) if _vectorizable(entry)]
+    if vector:
+        purchase = _to_days([bonds[i]['purchase_date'] for i in vector])
+        maturity = _to_days([bonds[i]['maturity_date'] for i in vector])
+        called = np.array([bonds[i]['call_price'] != 0.0 for i in vector])
+        call = _to_days([bonds[i]['call_date'] if bonds[i]['call_price'] != 0.0
+                         else bonds[i]['maturity_date'] for i in vector])
+        ok = (purchase <= maturity) & (call >= purchase)
+        vector = [i for i, keep in zip(vector, ok.tolist()) if keep]
+
+    if len(vector) < len(bonds):
+        # rows of the bonds scheduled one at a time, by bond index
+        scalar = [[] for _ in bonds]
+        for i in sorted(set(range(len(bonds))) - set(vector)):
+            scalar[i] = cash_flow(bonds[i])
+        if not vector:
+            return _schedule_rows(scalar)
+        purchase, maturity, called, call = purchase[ok], maturity[ok], called[ok], call[ok]
+    else:
+        scalar = None
+
+    schedule = _schedule_arrays([bonds[i] for i in vector], purchase, maturity, called, call)
+    if scalar is None:
+        return schedule
+
+    return _merge(schedule, np.asarray(vector), _schedule_rows(scalar))
+
+
+def schedule_valid_bonds(bonds, cash_flow):
+    """Return the bonds of 'bonds' that 'cash_flow' accepts and their
+    BondSchedule. The bonds it rejects are left out.
+    """
+    try:
+        return bonds, schedule_bonds(bonds, cash_flow)
+    except (TypeError, ValueError):
+        valid = [entry for entry in bonds if _has_cash_flow(entry, cash_flow)]
+        return valid, schedule_bonds(valid, cash_flow)
+
+
+def _has_cash_flow(entry, cash_flow):
+    try:
+        cash_flow(entry)
+    except (TypeError, ValueError):
+        return False
+    return True
+
+
+def _vectorizable(entry):
+    """Return True if the bond record can be scheduled on arrays"""
+
+    if entry['frequency'] not in FREQUENCIES:
+        return False
+    for column in _NUMBER_COLUMNS:
+        if type(entry[column]) not in (float, int):
+            return False
+    dates = [entry['purchase_date'], entry['maturity_date']]
+    if entry['call_price'] != 0.0:
+        dates.append(entry['call_date'])
+
+    return all(type(dt) is str and len(dt) == 10 and dt[4] == dt[7] == '-' for dt in dates)
+
+
+def _to_days(dates):
+    """Return the 'YYYY-MM-DD' strings 'dates' as an array of day numbers"""
+
+    return np.array(dates, dtype='datetime64[D]').astype(np.int64) + _EPOCH_ORDINAL
+
+
+def _add_months(days, months):
+    """Return add_months() of the day numbers 'days' by 'months' (arrays)"""
+
+    dt = (days - _EPOCH_ORDINAL).astype('datetime64[D]')
+    month = dt.astype('datetime64[M]')
+    day = (dt - month).astype(np.int64)  # day of month - 1
+    new_month = month + months
+    month_days = ((new_month + 1).astype('datetime64[D]') -
+                  new_month.astype('datetime64[D]')).astype(np.int64)
+
+    return (new_month.astype('datetime64[D]').astype(np.int64) +
+            np.minimum(day, month_days - 1) + _EPOCH_ORDINAL)
+
+
+def _schedule_arrays(bonds, purchase, maturity, called, call):
+    """Return the BondSchedule of 'bonds' computed on arrays"""
+
+    count = len(bonds)
+    interval = np.array([FREQUENCIES[entry['frequency']][0] for entry in bonds], dtype=np.int64)
+    factor = np.array([FREQUENCIES[entry['frequency']][1] for entry in bonds], dtype=np.int64)
+    bond_price = np.array([entry['bond_price'] for entry in bonds], dtype=float)
+    quantity = np.array([entry['quantity'] for entry in bonds], dtype=float)
+    coupon = np.array([entry['coupon'] for entry in bonds], dtype=float)
+    fee = np.array([entry['fee'] for entry in bonds], dtype=float)
+    call_price = np.array([entry['call_price'] for entry in bonds], dtype=float)
+    index = np.arange(count)
+
+    # Coupon dates, counting back from maturity down to the purchase date
+    maturity_month = (maturity - _EPOCH_ORDINAL).astype('datetime64[D]').astype('datetime64[M]')
+    purchase_month = (purchase - _EPOCH_ORDINAL).astype('datetime64[D]').astype('datetime64[M]')
+    periods = (maturity_month - purchase_month).astype(np.int64) // interval + 1
+    coupon_bond = np.repeat(index, periods)
+    back = np.cumsum(periods)[coupon_bond] - 1 - np.arange(len(coupon_bond))  # ascending
+    coupon_date = _add_months(maturity[coupon_bond], -back * interval[coupon_bond])
+    keep = coupon_date >= purchase[coupon_bond]
+    coupon_bond, coupon_date = coupon_bond[keep], coupon_date[keep]
+
+    # Purchase price and accrued interest (see CfAnalysis.bond_purchase_price())
+    first_coupon = coupon_date[np.searchsorted(coupon_bond, index)]
+    previous_coupon = _add_months(first_coupon, -interval)
+    principal = 1000 * quantity
+    bond_cost = bond_price * 10 * quantity
+    accrued = thirty_360_days(previous_coupon, purchase) * coupon / 100 * principal
+
+    # Coupons up to the redemption (call or maturity) date
+    paid = coupon_date <= call[coupon_bond]
+    coupon_bond, coupon_date = coupon_bond[paid], coupon_date[paid]
+    interest = principal * (coupon / factor / 100)
+    coupons = np.bincount(coupon_bond, minlength=count)
+
+    # A called bond pays interest from the last coupon through the call date
+    since = purchase.copy()
+    paid_coupon = coupons > 0
+    since[paid_coupon] = coupon_date[np.cumsum(coupons)[paid_coupon] - 1]
+    call_interest = principal * (thirty_360_days(since, call) * coupon / 100)
+    redemption = np.where(called, call_price * 10 * quantity, principal)
+
+    # Lay out the rows of each bond (see Developers Notes)
+    rows = 3 + coupons + np.where(called, 2, 1)
+    start = np.concatenate(([0], np.cumsum(rows)[:-1]))
+    total = int(rows.sum())
+    bond = np.repeat(index, rows)
+    date = np.empty(total, dtype=np.int64)
+    amount = np.empty(total)
+    kind = np.empty(total, dtype=np.int64)
+
+    for offset, row_kind, row_amount in ((0, PURCHASE, -bond_cost),
+                                         (1, ACCRUED_INTEREST, -accrued),
+                                         (2, FEES, -fee)):
+        date[start + offset] = purchase
+        amount[start + offset] = row_amount
+        kind[start + offset] = row_kind
+
+    coupon_rows = start[coupon_bond] + 3 + (np.arange(len(coupon_bond)) -
+                                            np.searchsorted(coupon_bond, coupon_bond))
+    date[coupon_rows] = coupon_date
+    amount[coupon_rows] = interest[coupon_bond]
+    kind[coupon_rows] = INTEREST
+
+    last = start + rows - 1
+    date[last] = np.where(called, call, maturity)
+    amount[last] = redemption
+    kind[last] = np.where(called, CALL, SALE)
+
+    called_last = last[called]
+    date[called_last - 1] = call[called]
+    amount[called_last - 1] = call_interest[called]
+    kind[called_last - 1] = CALL_INTEREST
+
+    return BondSchedule(bond, date, amount, kind, start)
+
+
+def _schedule_rows(details):
+    """Return the BondSchedule of the rows of bond_cash_flow() of each bond"""
+
+    bond, date, amount, kind, start = [], [], [], [], []
+    for index, rows in enumerate(details):
+        start.append(len(kind))
+        for row in rows:
+            bond.append(index)
+            date.append(row['date'].toordinal())
+            amount.append(row['amount'])
+            kind.append(NOTE_KINDS[row['note']])
+
+    if np is None:
+        return BondSchedule(bond, date, amount, kind, start)
+
+    return BondSchedule(np.array(bond, dtype=np.int64), np.array(date, dtype=np.int64),
+                        np.array(amount, dtype=float), np.array(kind, dtype=np.int64),
+                        np.array(start, dtype=np.int64))
+
+
+def _merge(schedule, vector, scalar):
+    """Return the rows of 'schedule', whose bonds are at indexes 'vector',
+    and the rows of 'scalar', which holds all indexes, in bond order.
+    """
+    bond = np.concatenate((vector[schedule.bond], scalar.bond))
+    order = np.argsort(bond, kind='stable')
+    bond = bond[order]
+    start = np.searchsorted(bond, np.arange(len(scalar.start)))
+
+    return BondSchedule(bond,
+                        np.concatenate((schedule.date, scalar.date))[order],
+                        np.concatenate((schedule.amount, scalar.amount))[order],
+                        np.concatenate((schedule.kind, scalar.kind))[order],
+                        start)
@@ -8,11 +8,66 @@
 # 
 # Developers Notes
 # 1. The ledger is a dictionary indexed by account_rec_id. The entry
-#    in the dictionary is a list of transactions.  Each transaction is a
-#    tuple. Each tuple has the following keys:
+#    in the dictionary is a Register (see ledger.py). A register presents
+#    its transactions as tuples with the following components:
 #           { account__rec_id: [(date, amount, balance, comment), (,,,)...]
 #             account_rec_id: [(date, amount, balance, comment), (,,,)]   }
-# 2. The ledger is built on restart
+# 2. The ledger is built on restart from a snapshot of the database
+#    tables (see data_access.load_snapshot()). The process_*() stages only
+#    read the snapshot, never the database.
+# 2a. While the ledger is built, credit() and debit() do not touch the
+#    registers. They stage their transactions instead and the staged
+#    transactions are added to each register in one batch before interest
+#    is applied. (see stage_transactions() / commit_transactions())
+#    The comment of a transaction is its description text or the id of
+#    the text in the description registry (see ledger.py). The process_*()
+#    stages get the id of each description once per instrument and pass
+#    the id, so no text is built per transaction.
+# 2b. Edits through write_to_db(), new_db_rec() and delete_db_rec() mark
+#    the accounts fed by the edited rows as dirty. The next restart only
+#    rebuilds the registers of the dirty accounts (see in_scope()).
+#    Anything else, such as a new tracking period or an account being
+#    created, deleted or renamed, forces a full rebuild.
+#    A full rebuild loads the ledger from the ledger_cache table instead
+#    if it was computed from the same inputs (see get_ledger_input_hash()).
+#    The cache is only written after a full rebuild, not after an
+#    incremental one, and never by the headless reports (write_cache).
+# 2c. Edits can be grouped in a batch (see begin_batch()). While a batch
+#    is open, the writes are queued and account names are resolved from
+#    a cached map. commit_batch() writes the queue with executemany() and
+#    commits once. rollback_batch() discards the whole batch.
+# 2d. The GUI is only imported when it is run. With --db, the ledger is
+#    built and reported without tkinter (see main()), eg
+#         python -m cf --db file.db --months 360 --report balances
+#    When the GUI is run, the imports made to put up the main window are
+#    timed and logged in the layout of 'python -X importtime', followed
+#    by the time to first paint (see import_timer.py). Windows opened from
+#    the menus import their modules on first use.
+# 2e. Each stage of a restart is run through run_stage(), which records its
+#    wall time, transactions, DB queries and register inserts in the
+#    RestartProfile of the restart (see profiling.py). The profile of the
+#    last restart is returned by get_restart_profile(). profile_restart()
+#    also captures a cProfile of a full rebuild to a file.
+# 2f. Logger hands the log records to a queue. A background thread
+#    (QueueListener) writes them to a rotating log file so a log call never
+#    waits on the disk. Messages take lazy %-style arguments and are only
+#    formatted if their level is enabled. The logs made per transaction or
+#    per query are DEBUG records, behind an is_enabled() guard in the hot
+#    loops. They are off unless turned on with Logger.set_debug() (the
+#    Performance menu or --debug).
+# 2g. The types of the snapshot records are checked once per restart, at
+#    the boundary (see data_access.check_snapshot()). The per call
+#    argument checks of credit(), debit() and the date/register helpers
+#    only run when check_args is set (set_arg_checks(), the Performance
+#    menu or --check-args). test_cf.py always runs with them.
+# 2h. process_bonds() schedules all bonds in one call (see bond_schedule.py),
+#    on arrays when NumPy is installed. bond_cash_flow() remains the
+#    schedule of a single bond, used for the cash flow details window and
+#    for any bond the array code can't take.
+# 2i. cd_cash_flow() is the schedule of a single CD, used by process_cds()
+#    and by the ladder report. get_ladder_report() takes the bond schedule
+#    and the CD schedules of the snapshot and sums them by account and
+#    maturity bucket in one pass (see ladder.py).
 # 3. I used datetime internally rather than simply date. Its more overhead
 #    but deposits are established with times earlier in the day than
 #    debits, so they order properly (ie deposits first then withdrawals)
@@ -21,16 +76,32 @@
 # 
 # 
 # 
+import argparse
+import atexit
+import hashlib
 import logging
+import os
+import queue
+import sys
+import time
 from datetime import datetime, date, timedelta
-import itertools
+from itertools import groupby
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from operator import itemgetter
 # from tkinter import messagebox
-from calendar import monthrange
 import utilities as util
-from cf_gui import CfGui
+import bond_schedule
+from bond_analytics import BondAnalytics
+from ladder import ladder_report
+import cf_calendar
+import day_count
 import data_file_constants as dfc
-from occurrences import Occurrences
+from data_access import DataAccess, check_snapshot
+from occurrences import occurrence_dates
 from file_manager import FileManager
+from ledger import Register, descriptions, encode_ledger, decode_ledger
+from import_timer import ImportTimer
+from profiling import RestartProfile, StageStats, profile_to_file
 
 #######################################################################
 #  Constants used to set hour for transactions.  This forces transaction
@@ -43,12 +114,32 @@ SALE_TIME = 3
 WITHDRAWAL_TIME = 10
 LATEST_TIME = 11
 
+# Change whenever the way the ledger is computed or encoded changes. This keeps a ledger
+# cached by an older version of the code from being used.
+LEDGER_CACHE_VERSION = 2
+
 
 class CfAnalysis:
+    check_args = False  # per call argument checks (see Developers Notes 2g)
+
     def __init__(self, file_manager, logger):
         self.fm = file_manager
         self.logger = logger
+        self.dao = DataAccess(file_manager, logger)
         self.ledger = {}
+        self.staged = None  # list of staged transactions while building the ledger
+        self.dirty_accounts = None  # accounts to rebuild on restart, None for all
+        self.scope = None  # accounts being rebuilt by the current restart, None for all
+        self.snapshot = None  # the tables the ledger was built from
+        self.batch = None  # queued (statement, params) while a batch is open
+        self.batch_dirty = None  # (table, rec_id) to mark dirty once the batch is written
+        self.account_ids = None  # account_name -> rec_id while a batch is open
+        self.ledger_hash = None  # input hash of the ledger in the ledger cache
+        self.write_cache = True  # write the ledger cache after a full rebuild
+        self.transaction_count = 0  # credits and debits made (see run_stage())
+        self.profile = None  # RestartProfile of the restart in progress
+        self.restart_profile = None  # RestartProfile of the last restart
+        self.bond_analytics = BondAnalytics(self.bond_cash_flow)  # cached bond yields
 
         d = date.today()
         self.start_date = datetime(d.year, d.month, d.day)
@@ -56,39 +147,244 @@ class CfAnalysis:
 
     def init_storage(self):
         self.ledger.clear()
+        self.staged = None
+        self.dirty_accounts = None
+        self.ledger_hash = None
+
+    def restart(self, tracking_months, snapshot=None, use_cache=True):
+        """Restart by reading in all the data records and recreating the ledger
 
-    def restart(self, tracking_months):
-        """Restart by reading in all the data records and recreating the ledger"""
+        Only the registers of dirty accounts are recreated unless a full
+        rebuild is required. A full rebuild is skipped altogether if the
+        ledger cache of the database was computed from the same inputs
+        (unless 'use_cache' is False).
+
+        If a snapshot is given, the ledger is rebuilt from it instead of
+        the database (eg for a what-if run). The next restart from the
+        database is then a full one.
+        """
+        self.profile = RestartProfile(tracking_months)
+        try:
+            self.rebuild(tracking_months, snapshot, use_cache)
+        finally:
+            self.restart_profile = self.profile
+            self.profile = None
+
+    def rebuild(self, tracking_months, snapshot, use_cache):
+        """The body of restart()"""
 
         # tracking_months_count can be changed in Setting menu
-        self.end_date = self.get_next_date(self.start_date, tracking_months) - timedelta(days=1)
+        end_date = self.get_next_date(self.start_date, tracking_months) - timedelta(days=1)
+        what_if = snapshot is not None
+
+        if self.dirty_accounts is None or end_date != self.end_date or what_if:
+            self.scope = None
+            self.ledger.clear()
+        else:
+            self.scope = self.dirty_accounts
+        self.end_date = end_date
+
+        # If the rebuild fails, the next restart must be a full one
+        self.dirty_accounts = None
+        query_count = self.dao.query_count
+
+        if snapshot is None:
+            snapshot = self.run_stage("load_snapshot", self.dao.load_snapshot)
+        self.run_stage("check_snapshot", check_snapshot, snapshot)
+        self.snapshot = snapshot
+
+        input_hash = None
+        if self.scope is None and not what_if and self.dao.is_open():
+            input_hash = self.run_stage("input_hash", self.get_ledger_input_hash)
+
+        if self.scope is None and use_cache and input_hash is not None and \
+                self.run_stage("load_cache", self.load_cached_ledger, input_hash):
+            rebuilt = "none (cached)"
+        else:
+            rebuilt = "all" if self.scope is None else len(self.scope)
+            self.build_ledger()
+            if self.write_cache and input_hash is not None and input_hash != self.ledger_hash:
+                self.run_stage("write_cache", self.save_ledger_cache, input_hash)
+
+        self.profile.rebuilt = str(rebuilt)
+        self.logger.log(logging.INFO, "restart() rebuilt %s accounts with %s queries in %.3f sec",
+                        rebuilt, self.dao.query_count - query_count, self.profile.total().seconds)
+        self.scope = None
+        if not what_if:
+            self.dirty_accounts = set()
+
+    def build_ledger(self):
+        """Build the registers in scope from the snapshot"""
 
         ##########################################
         # Establish the balance in each cash account
         ##########################################
-        self.account_set_up()
+        self.run_stage("account_set_up", self.account_set_up)
 
         ##########################################
         # Record all the transfers so balances
         # at any given instant are correct 
         ##########################################
-        self.process_transfers()
+        self.stage_transactions()
+        self.run_stage("process_transfers", self.process_transfers)
 
         ##########################################
         # Process holdings prior to Cash Account/
         # Checking Account interest calculations 
         ##########################################
-        self.process_loans()
-        self.process_cds()
-        self.process_bonds()
-        self.process_funds()
+        self.run_stage("process_loans", self.process_loans)
+        self.run_stage("process_cds", self.process_cds)
+        self.run_stage("process_bonds", self.process_bonds)
+        self.run_stage("process_funds", self.process_funds)
+        self.run_stage("commit_transactions", self.commit_transactions)
 
         ##########################################
         # Apply interest to all interest
         # bearing holdings
         ##########################################
-        self.apply_interest()
-        self.logger.log(logging.INFO, "{}".format(util.f_name()))
+        self.run_stage("apply_interest", self.apply_interest)
+
+    @classmethod
+    def set_arg_checks(cls, enabled):
+        """Turn the per call argument checks of the ledger helpers on or off"""
+
+        cls.check_args = enabled
+
+    def run_stage(self, stage, func, *args):
+        """Run func(*args) as a stage of the restart in progress and return
+        its result. The counters of the stage are added to the profile of
+        the restart (see profiling.py).
+        """
+        if self.profile is None:
+            return func(*args)
+
+        transactions = self.transaction_count
+        queries = self.dao.query_count
+        inserts = Register.insert_count
+        start = time.perf_counter()
+
+        result = func(*args)
+
+        self.profile.add(StageStats(stage, time.perf_counter() - start,
+                                    self.transaction_count - transactions,
+                                    self.dao.query_count - queries,
+                                    Register.insert_count - inserts))
+        return result
+
+    def get_restart_profile(self):
+        """Return the RestartProfile of the last restart (None before the first)"""
+
+        return self.restart_profile
+
+    def profile_restart(self, tracking_months, filename):
+        """Run a full rebuild of the ledger under cProfile.
+
+        The ledger cache is not used. The cProfile stats are written to
+        'filename'. Return the RestartProfile of the rebuild.
+        """
+        self.mark_all_dirty()
+        profile_to_file(self.restart, filename, tracking_months, None, False)
+
+        return self.restart_profile
+
+    def get_ledger_input_hash(self):
+        """Return a hash of everything the ledger is computed from"""
+
+        inputs = [LEDGER_CACHE_VERSION, self.end_date.isoformat()]
+        for table in self.snapshot:
+            inputs.append([tuple(rec.values()) for rec in table])
+
+        return hashlib.sha256(repr(inputs).encode('utf-8')).hexdigest()
+
+    def save_ledger_cache(self, input_hash):
+        """Write the ledger to the ledger cache of the database.
+
+        The cache is only a speed-up, so a failed write (eg a locked or
+        read only database) is logged and the restart carries on.
+        """
+        try:
+            self.dao.write_ledger_cache(input_hash, encode_ledger(self.ledger))
+        except RuntimeError as e:
+            self.logger.log(logging.INFO, "Ledger cache not written: %s", e)
+            return
+
+        self.ledger_hash = input_hash
+
+    def load_cached_ledger(self, input_hash):
+        """Load the ledger from the ledger cache of the database.
+
+        Return False if the cache wasn't computed from the same inputs.
+        """
+        data = self.dao.read_ledger_cache(input_hash)
+        if data is None:
+            return False
+
+        try:
+            ledger = decode_ledger(data)
+        except Exception as e:
+            self.logger.log(logging.INFO, "Ledger cache ignored: %s", e)
+            return False
+
+        self.ledger.clear()
+        self.ledger.update(ledger)
+        self.ledger_hash = input_hash
+
+        return True
+
+    def in_scope(self, *account_rec_ids):
+        """Return True if any of the given accounts is being rebuilt"""
+
+        if self.scope is None:
+            return True
+        for account_rec_id in account_rec_ids:
+            if account_rec_id in self.scope:
+                return True
+        return False
+
+    def mark_dirty(self, table, rec):
+        """Mark the accounts fed by record 'rec' of 'table' for rebuild.
+
+        An account record also feeds the other side of each of its transfers
+        because transfers only start once both accounts are open.
+        """
+        if self.dirty_accounts is None:
+            # a full rebuild is already pending
+            return
+
+        if table == 'transfer':
+            self.dirty_accounts.update((rec['from_account_rec_id'], rec['to_account_rec_id']))
+        elif table == 'account':
+            self.mark_account_dirty(rec['rec_id'])
+        elif table in ('ca', 'bond', 'cd', 'loan', 'fund'):
+            self.dirty_accounts.add(rec['account_rec_id'])
+        else:
+            self.mark_all_dirty()
+
+    def mark_account_dirty(self, account_rec_id):
+        """Mark an account and its transfer counterparties for rebuild"""
+
+        if self.dirty_accounts is None:
+            return
+
+        self.dirty_accounts.add(account_rec_id)
+        for rec in self.get_from_db('transfer', 'from_account_rec_id', account_rec_id):
+            self.dirty_accounts.add(rec['to_account_rec_id'])
+        for rec in self.get_from_db('transfer', 'to_account_rec_id', account_rec_id):
+            self.dirty_accounts.add(rec['from_account_rec_id'])
+
+    def mark_rec_dirty(self, table, rec_id):
+        """Mark the accounts fed by the DB record 'rec_id' of 'table' for rebuild"""
+
+        if self.dirty_accounts is None:
+            return
+
+        for rec in self.get_from_db(table, 'rec_id', rec_id):
+            self.mark_dirty(table, rec)
+
+    def mark_all_dirty(self):
+        """Force a full rebuild on the next restart"""
+
+        self.dirty_accounts = None
 
     ################################################
     # Support Code
@@ -96,88 +392,55 @@ class CfAnalysis:
     @staticmethod
     def format_date(dt):
         """ Take a datetime and return a string with just date"""
-        if type(dt) is not datetime:
+        if CfAnalysis.check_args and type(dt) is not datetime:
             raise TypeError("{0}(): Input is not a datetime object".
                             format(util.f_name()))
 
         return "{0}-{1:02}-{2:02}".format(dt.year, dt.month, dt.day)
 
     @staticmethod
-    def append_register(trans, bal, register):
-        """Simply append the transaction 'trans' to the 'register',
-        updating the register balance.  Return the updated balance"""
-
-        #  self.logger.log.info("{0}( {1}, {2:.2f} + {3:.2f})".format(
-        #    util.f_name(), self.format_date(trans[0]), bal, trans[1]))
-
-        if type(trans) != tuple:
-            raise TypeError("{0}(): trans is wrong type".format(util.f_name()))
-        if type(bal) != float:
-            raise TypeError("{0}(): float is wrong type".format(util.f_name()))
-        if type(register) != list:
-            raise TypeError("{0}(): List is wrong type".format(util.f_name()))
-        if type(trans) != tuple or type(bal) != float or type(register) != list:
-            raise TypeError("{0}(): Input is wrong type".format(util.f_name()))
-
-        bal = bal + trans[1]
-        new_trans = (trans[0], trans[1], bal, trans[3])
-        register.append(new_trans)
-
-        return bal
-
-    def trans_to_register(self, new_trans, reg):
-        """Insert transaction 'new_trans' into the register 'reg' by date
-        and update the balance of all following register entries.
-        (Register 'reg' is a list of tuples.  Each tuple contains four elements
-        in the following order:  datetime, amount, balance, comment)
+    def trans_to_register(new_trans, reg):
+        """Insert transaction 'new_trans' into the register 'reg' by date.
+        The balance of all following register entries is updated the next
+        time the register is read.
+        (Transaction 'new_trans' is a tuple containing four elements
+        in the following order:  datetime, amount, balance, comment.
+        The comment is the description text or its id.)
         """
 
-        if type(new_trans) != tuple or type(reg) != list:
+        if CfAnalysis.check_args and (type(new_trans) != tuple or type(reg) != Register):
             raise TypeError("{0}(): Input is wrong type".format(util.f_name()))
 
-        #  self.logger.log.info("({0}: {1}, {2} {3})".format(
-        #    util.f_name(),self.format_date(new_trans[0]),
-        #    new_trans[1],reg[0][3]))
+        reg.insert(new_trans[0], new_trans[1], new_trans[3])
 
-        inserted = False
-        new_list = list()
-        bal = float(reg[0][2])  # opening balance
-
-        for trans in reg:
-            if new_trans[0] > trans[0]:  # date comparison
-                bal = self.append_register(trans, bal, new_list)
-            else:
-                if not inserted:
-                    inserted = True
-                    bal = self.append_register(new_trans, bal, new_list)
-                bal = self.append_register(trans, bal, new_list)
-        if not inserted:
-            self.append_register(new_trans, bal, new_list)
-
-        return new_list
+        return reg
 
     @staticmethod
     def get_bal_on_date(dt, reg):
         """Return the balance of register 'reg' on date 'dt'
 
-        Look for a date beyond 'dt' then use the balance of the previous
-        register entry. This ensures the correct day's balance if there
-        are multiple entries for the day.
+        Look for the last register entry on 'dt' and use its balance.
+        This ensures the correct day's balance if there are multiple
+        entries for the day.
         """
-        if type(dt) != datetime or type(reg) != list:
+        if CfAnalysis.check_args and (type(dt) != datetime or type(reg) != Register):
             raise TypeError("{0}(): Input is wrong type".format(util.f_name()))
 
-        # self.logger.log.info("{0}: Date: {1}".format(util.f_name(),
-        #                                         self.format_date(dt)))
-        dt = dt.replace(hour=LATEST_TIME)
+        return float(reg.balance_on(dt.replace(hour=LATEST_TIME)))
 
-        latest_bal = reg[0][2]  # opening balance
-        for trans in reg:
-            if trans[0] > dt:
-                break
-            latest_bal = trans[2]
-        #  self.logger.log.info("{0}: Bal: {1}".format(util.f_name(), latest_bal))
-        return float(latest_bal)
+    @staticmethod
+    def get_balances_on_dates(dates, reg):
+        """Return a list of the balances of register 'reg' on each of 'dates'
+
+        'dates' must be in ascending order. The result is the same as calling
+        get_bal_on_date() for each date, but the register is only walked once.
+        """
+        if CfAnalysis.check_args and (type(dates) != list or type(reg) != Register):
+            raise TypeError("{0}(): Input is wrong type".format(util.f_name()))
+
+        balances = reg.balances_on([dt.replace(hour=LATEST_TIME) for dt in dates])
+
+        return [float(bal) for bal in balances]
 
     def get_periodic_dates(self, start_date, period, end_date):
         """ Return a list of periodic dates, starting with 'start_date',
@@ -185,92 +448,59 @@ class CfAnalysis:
         This can go in either the forward or backward direction based
         on the relationship between 'start_date' and 'end_date'"""
 
-        if type(start_date) != datetime or type(end_date) != datetime or \
-                type(period) != str:
+        if self.check_args and (type(start_date) != datetime or type(end_date) != datetime or
+                                type(period) != str):
             raise TypeError("{0}() : Input type error".format(util.f_name()))
 
         #  self.logger.log.info("{0}() {1}, {2}, {3})".format(
         #    util.f_name(), self.format_date(start_date),
         #    period, self.format_date(end_date)))
 
-        dates = []
-
         month_interval = self.period_to_months(period)
 
-        if start_date <= end_date:
-            # generate dates forward from the start date
-            for i in itertools.count():  # infinite loop
-                next_date = self.get_next_date(start_date, i * month_interval)
-                if next_date <= end_date:
-                    dates.append(next_date)
-                else:
-                    break
-        else:
-            # generate dates backward from the end date
-            for i in itertools.count():  # infinite loop
-                prev_date = self.get_previous_date(start_date, i * month_interval)
-                # if next_date >= today and next_date <= end_date:
-                if prev_date >= end_date:
-                    dates.append(prev_date)
-                else:
-                    dates.reverse()  # date to ascending order
-                    break
-
-        # for date in dates:
-        #    self.logger.log.info"  {0}".format(date))
-
-        return dates
+        return cf_calendar.periodic_dates(start_date, month_interval, end_date)
 
     @staticmethod
     def get_next_date(start_date, months):
         """Return a date 'months' months from 'start_date.  Correct 
         for short months (eg 1 month from jan 31st is feb 28th"""
 
-        if type(start_date) != datetime or type(months) != int:
+        if CfAnalysis.check_args and (type(start_date) != datetime or type(months) != int):
             raise TypeError("{0}() : Input type error".format(util.f_name()))
 
-        next_year = start_date.year + ((start_date.month + months - 1) // 12)
-        next_month = start_date.month + months  # modulo months avoids next loop
-        while next_month > 12:
-            next_month -= 12
-        days_next_month = monthrange(next_year, next_month)[1]
-
-        return start_date.replace(
-            year=next_year,
-            month=next_month,
-            day=min(start_date.day, days_next_month))
+        return cf_calendar.add_months(start_date, months)
 
     @staticmethod
     def get_previous_date(start_date, months):
         """Return a date 'months' months back from 'start_date.  Correct 
         for short months (eg 1 month from jan 31st is feb 28th"""
 
-        if type(start_date) != datetime or type(months) != int:
+        if CfAnalysis.check_args and (type(start_date) != datetime or type(months) != int):
             raise TypeError("{0}() : Input type error".format(util.f_name()))
 
-        # // for negative numbers rounds instead of truncating !!!!
-        prev_year = start_date.year - ((-(start_date.month - months - 12)) // 12)
-        prev_month = start_date.month - months
-        while prev_month <= 0:
-            prev_month += 12
-        days_next_month = monthrange(prev_year, prev_month)[1]
-
-        return start_date.replace(
-            year=prev_year,
-            month=prev_month,
-            day=min(start_date.day, days_next_month))
+        return cf_calendar.add_months(start_date, -months)
 
     def credit(self, account_rec_id, amount, dt, comment, credit_type=DEPOSIT_TIME):
         """Credit account 'account_rec_id' on 'dt' in the 'amount' with 'comment'.
         The register balance will be recalculated and updated"""
 
-        self.logger.log(logging.INFO, "{0}() account_rec_id: {1}, amount: {2}, {3})".format(
-            util.f_name(), account_rec_id, amount, self.format_date(dt)))
+        if self.logger.is_enabled(logging.DEBUG):
+            self.logger.log(logging.DEBUG, "credit() account_rec_id: %s, amount: %s, %s, %s",
+                            account_rec_id, amount, dt,
+                            comment if type(comment) is str else descriptions.text(comment))
 
-        if type(account_rec_id) != int or type(amount) != float or type(dt) != datetime:
+        if self.check_args and (type(account_rec_id) != int or type(amount) != float or
+                                type(dt) != datetime):
             raise TypeError("{0}() : Input type error".format(util.f_name()))
 
+        self.transaction_count += 1
         dt = dt.replace(hour=credit_type)
+        if self.staged is not None:
+            if type(comment) is str:
+                comment = descriptions.get_id(comment)
+            self.staged.append((account_rec_id, dt, amount, comment))
+            return
+
         transaction = (dt, amount, 0, comment)
         self.ledger[account_rec_id] = self.trans_to_register(transaction,
                                                              self.ledger[account_rec_id])
@@ -278,24 +508,61 @@ class CfAnalysis:
     def debit(self, account_rec_id, amount, dt, comment):
         """Debit account 'account_rec_id' on 'dt' in the amount 'amount' with 'comment'"""
 
-        #  self.logger.log.info("{0}() {1}, {2}, {3})".format(
-        #    util.f_name(), account, amount, self.format_date(dt)))
+        if self.logger.is_enabled(logging.DEBUG):
+            self.logger.log(logging.DEBUG, "debit() account_rec_id: %s, amount: %s, %s, %s",
+                            account_rec_id, amount, dt,
+                            comment if type(comment) is str else descriptions.text(comment))
 
-        if type(account_rec_id) != int or type(amount) != float or type(dt) != datetime:
+        if self.check_args and (type(account_rec_id) != int or type(amount) != float or
+                                type(dt) != datetime):
             raise TypeError("{0}() : Input type error".
                             format(util.f_name()))
 
+        self.transaction_count += 1
         dt = dt.replace(hour=WITHDRAWAL_TIME)
+        if self.staged is not None:
+            if type(comment) is str:
+                comment = descriptions.get_id(comment)
+            self.staged.append((account_rec_id, dt, -amount, comment))
+            return
+
         transaction = (dt, -amount, 0, comment)
         self.ledger[account_rec_id] = self.trans_to_register(transaction,
                                                              self.ledger[account_rec_id])
 
+    def stage_transactions(self):
+        """Start staging transactions rather than entering them in the registers"""
+
+        self.staged = []
+
+    def commit_transactions(self):
+        """Enter all staged transactions in the registers and stop staging.
+
+        The transactions are grouped by account and each register receives
+        its group in a single batch. Transactions for accounts that are not
+        being rebuilt are dropped; their registers already hold them.
+        """
+        staged = self.staged
+        self.staged = None
+
+        by_account = {}
+        for account_rec_id, dt, amount, comment in staged:
+            if not self.in_scope(account_rec_id):
+                continue
+            by_account.setdefault(account_rec_id, []).append((dt, amount, comment))
+
+        for account_rec_id, transactions in by_account.items():
+            self.ledger[account_rec_id].extend(transactions)
+
+        self.logger.log(logging.INFO, "commit_transactions() %s transactions in %s accounts",
+                        len(staged), len(by_account))
+
     @staticmethod
     def period_to_months(period):
         """Convert a string defining the period (e.g. quarterly) to
         months in the period"""
 
-        if type(period) != str:
+        if CfAnalysis.check_args and type(period) != str:
             raise TypeError("{0}() : Input type error".format(util.f_name()))
 
         if period == "once":
@@ -317,7 +584,7 @@ class CfAnalysis:
         """Convert a string defining the period (e.g. quarterly) to a divisor that
         converts an annual rate to an applicable rate (e.g. quarterly => 4)"""
 
-        if type(period) != str:
+        if CfAnalysis.check_args and type(period) != str:
             raise TypeError("{0}() : Input type error".format(util.f_name()))
 
         if period == "monthly":
@@ -389,26 +656,23 @@ class CfAnalysis:
     def account_set_up(self):
         """Establish the opening balance of all cash accounts in the ledger"""
 
-        self.logger.log(logging.INFO, "Entering: {}".format(util.f_name()))
+        self.logger.log(logging.INFO, "Entering: account_set_up()")
 
         # todo entry= { account, balance,  } Use dictionary instead of tuple
-        for entry in self.get_from_db('ca'):
+        for entry in self.snapshot.cash_accounts:
+            if not self.in_scope(entry['account_rec_id']):
+                continue
             #  self.logger.log.info("{0} account balance on {1}: ${2} ".format(
             #    entry['account'], entry['opening_date'], entry['balance']))
 
-            # The account record holds the opening date for the cash account
-            account_rec = self.get_from_db('account', 'rec_id', entry['account_rec_id'])[0]
-
-            start_date = datetime.strptime(account_rec['opening_date'], dfc.DATE_FORMAT)
+            # The snapshot carries the opening date of the account
+            start_date = datetime.strptime(entry['opening_date'], dfc.DATE_FORMAT)
             start_date = start_date.replace(hour=INITIAL_DEPOSIT_TIME)
 
-            # first entry for this account in the ledger - tuple
-            beg_bal = (start_date, 0, entry['balance'],
-                       account_rec['account_name'] + " Opening Balance")
-
-            # Ensure each dictionary entry is treated as a list of tuples
-            self.ledger[entry['account_rec_id']] = list()
-            self.ledger[entry['account_rec_id']].append(beg_bal)
+            # first entry for this account in the ledger
+            self.ledger[entry['account_rec_id']] = Register(
+                start_date, entry['balance'],
+                entry['account_name'] + " Opening Balance")
 
     def validate_transfer(self, entry):
 
@@ -437,13 +701,13 @@ class CfAnalysis:
         Note that transfers may have an inflation factor associated with it.
         If so, the factor is applied before the transfers are entered.
         """
-        transfer_records = self.get_from_db('transfer')
+        transfer_records = self.snapshot.transfers
 
-        self.logger.log(logging.INFO,
-                        "Entries in Transfers list: {0}".format(len(transfer_records)))
+        self.logger.log(logging.INFO, "Entries in Transfers list: %s", len(transfer_records))
 
         for entry in transfer_records:
-            # print(entry)
+            if not self.in_scope(entry['from_account_rec_id'], entry['to_account_rec_id']):
+                continue
             # Fault if invalid
             self.validate_transfer(entry)
             transfer_dates = self.get_dates(entry['frequency'], self.end_date)
@@ -458,6 +722,11 @@ class CfAnalysis:
             else:
                 opening_date = self.ledger[entry['to_account_rec_id']][0][0]
 
+            debit_note = descriptions.get_id("Transfer to " + str(entry['to_account_name']) +
+                                             ", Note: " + entry['note'])
+            credit_note = descriptions.get_id("Transfer from " + str(entry['from_account_name'])
+                                              + ", Note: " + entry['note'])
+
             # print("Opening Date :{}".format(opening_date))
             # print(transfer_dates)
             # print(transfer_amounts)
@@ -467,13 +736,13 @@ class CfAnalysis:
                     self.debit(entry['from_account_rec_id'],
                                transfer_amounts[i],  # float(entry['amount']),
                                transDate,
-                               "Transfer to " + str(entry['to_account_name']) +
-                               ", Note: " + entry['note'])
+                               debit_note)
                     self.credit(entry['to_account_rec_id'],
                                 transfer_amounts[i],  # float(entry['amount']),
                                 transDate,
-                                "Transfer from " + str(entry['from_account_name'])
-                                + ", Note: " + entry['note'])
+                                credit_note)
+
+        self.logger.log(logging.INFO, "Occurrence date cache: %s", occurrence_dates.cache_info())
 
         """
             # select an opening date that is the  
@@ -511,11 +780,13 @@ class CfAnalysis:
     def process_loans(self):
         """Update each account based on loans on top of balances"""
 
-        loan_records = self.get_from_db('loan')
+        loan_records = self.snapshot.loans
 
-        self.logger.log(logging.INFO, "Entries in Loans list: {0}".format(len(loan_records)))
+        self.logger.log(logging.INFO, "Entries in Loans list: %s", len(loan_records))
 
         for entry in loan_records:
+            if not self.in_scope(entry['account_rec_id']):
+                continue
             # If the Loan origination date is on or after
             # the opening date,
             # enter both the debit on loan and a credit on maturity.
@@ -548,8 +819,7 @@ class CfAnalysis:
             earlier_date = origination_date
             for dt in interest_dates:
                 if dt >= opening_date:
-                    period = dt - earlier_date
-                    rate = period.days / 365 * float(entry['rate']) / 100
+                    rate = day_count.actual_365(earlier_date, dt) * float(entry['rate']) / 100
                     interest = float(loan_bal) * rate
                     loan_bal += interest
                     earlier_date = dt
@@ -559,11 +829,13 @@ class CfAnalysis:
                         credit_type=SALE_TIME)
 
     def process_cds(self):
-        cd_records = self.get_from_db('cd')
+        cd_records = self.snapshot.cds
 
-        self.logger.log(logging.INFO, "Entries in CDs list: {0}".format(len(cd_records)))
+        self.logger.log(logging.INFO, "Entries in CDs list: %s", len(cd_records))
 
         for entry in cd_records:
+            if not self.in_scope(entry['account_rec_id']):
+                continue
             # If the CD purchase date is on or after the opening date,
             # enter both the debit on purchase and a credit on maturity.
             # Otherwise, just enter a credit on maturity.
@@ -571,52 +843,67 @@ class CfAnalysis:
             # not face value
 
             opening_date = self.ledger[entry['account_rec_id']][0][0]
-            purchase_date = datetime.strptime(entry['purchase_date'], "%Y-%m-%d")
-            maturity_date = datetime.strptime(entry['maturity_date'], "%Y-%m-%d")
+            notes = {}  # record note -> description id
+            for record in self.cd_cash_flow(entry, opening_date):
+                note = notes.get(record['note'])
+                if note is None:
+                    note = descriptions.get_id(record['note'] + ", CUSIP: " + entry['cusip'])
+                    notes[record['note']] = note
+                if record['note'] == "CD purchase":
+                    self.debit(entry['account_rec_id'], -record['amount'], record['date'], note)
+                elif record['note'] == "CD Sale":
+                    self.credit(entry['account_rec_id'], record['amount'], record['date'], note,
+                                credit_type=SALE_TIME)
+                else:
+                    self.credit(entry['account_rec_id'], record['amount'], record['date'], note)
 
-            if purchase_date >= maturity_date:
-                raise ValueError(
-                    "CD maturity date must follow purchase date")
-            if opening_date >= maturity_date:
-                # pass history
-                continue
+    def cd_cash_flow(self, entry, opening_date=None):
+        """Return the cash flow of a CD in the form of bond_cash_flow().
 
-            # The CD may be entered with its original purchase date.
-            # The opening balance should account for any interest already
-            # paid. So ignore any interest before the opening date
-            if purchase_date > opening_date:
-                earliest_interest_date = purchase_date
-            else:
-                earliest_interest_date = opening_date
+        If the CD is held in an account opened on 'opening_date', a purchase
+        before the opening date is left out and interest is only paid from
+        the opening date on. Nothing is returned if the CD matured by then.
+        """
+        purchase_date = datetime.strptime(entry['purchase_date'], "%Y-%m-%d")
+        maturity_date = datetime.strptime(entry['maturity_date'], "%Y-%m-%d")
 
-            #  period_months = self.period_to_months(entry['frequency'])
+        if purchase_date >= maturity_date:
+            raise ValueError(
+                "CD maturity date must follow purchase date")
+        if opening_date is None:
+            opening_date = purchase_date
+        if opening_date >= maturity_date:
+            # pass history
+            return []
+
+        # The CD may be entered with its original purchase date.
+        # The opening balance should account for any interest already
+        # paid. So ignore any interest before the opening date
+        if purchase_date > opening_date:
+            earliest_interest_date = purchase_date
+        else:
+            earliest_interest_date = opening_date
 
-            interest_dates = self.get_periodic_dates(maturity_date,
-                                                     entry['frequency'],
-                                                     earliest_interest_date)
-            #  first_interest_date = interest_dates[0]
+        interest_dates = self.get_periodic_dates(maturity_date,
+                                                 entry['frequency'],
+                                                 earliest_interest_date)
 
-            purchase_price = float(entry['purchase_price']) * \
-                float(entry['quantity'])
-            if purchase_date >= opening_date:
-                self.debit(entry['account_rec_id'], purchase_price,
-                           purchase_date,
-                           "CD purchase, CUSIP: " + entry['cusip'])
+        details = []
+        principal = float(entry['purchase_price']) * float(entry['quantity'])
+        if purchase_date >= opening_date:
+            details.append({'date': purchase_date, 'amount': -principal,
+                            'note': "CD purchase"})
 
-            earlier_date = earliest_interest_date
-            principal = float(entry['purchase_price']) * float(entry['quantity'])
+        earlier_date = earliest_interest_date
+        for dt in interest_dates:
+            rate = day_count.actual_365(earlier_date, dt) * float(entry['rate']) / 100
+            details.append({'date': dt, 'amount': principal * rate,
+                            'note': "CD Interest"})
+            earlier_date = dt
 
-            for dt in interest_dates:
-                period = dt - earlier_date
-                rate = period.days / 365 * float(entry['rate']) / 100
-                interest = principal * rate
-                self.credit(entry['account_rec_id'], interest, dt,
-                            "CD Interest, CUSIP: " + entry['cusip'])
-                earlier_date = dt
-
-            self.credit(entry['account_rec_id'], principal, maturity_date,
-                        "CD Sale, CUSIP: " + entry['cusip'],
-                        credit_type=SALE_TIME)
+        details.append({'date': maturity_date, 'amount': principal,
+                        'note': "CD Sale"})
+        return details
 
     def process_bonds(self):
         # TODO - handle a bond call
@@ -624,38 +911,70 @@ class CfAnalysis:
         #  calc interest based on outstanding days
         #  calc final payment on call date based on call premium
         #
-        bond_records = self.get_from_db('bond')
-        self.logger.log(logging.INFO, "Entries in Bonds list: {0}".format(len(bond_records)))
-        for entry in bond_records:
-            # print(entry)
-            details = self.bond_cash_flow(entry)
+        bond_records = self.snapshot.bonds
+        self.logger.log(logging.INFO, "Entries in Bonds list: %s", len(bond_records))
+        bond_records = [entry for entry in bond_records if self.in_scope(entry['account_rec_id'])]
+        schedule = bond_schedule.schedule_bonds(bond_records, self.bond_cash_flow)
+
+        # If the Bond purchase date is on or after the opening date,
+        # enter both the debit on purchase and a credit on maturity.
+        # Otherwise, just enter a credit on maturity.
+
+        entry = None
+        for index, dt, amount, kind in schedule.rows():
+            if bond_records[index] is not entry:
+                entry = bond_records[index]
+                account_rec_id = entry['account_rec_id']
+                opening_date = self.ledger[account_rec_id][0][0]
+                notes = {}  # row kind -> description id
+            if dt >= opening_date:
+                note = notes.get(kind)
+                if note is None:
+                    note = descriptions.get_id(bond_schedule.KIND_NOTES[kind] + ", CUSIP: " +
+                                               entry['cusip'])
+                    notes[kind] = note
+                if amount < 0:
+                    self.debit(account_rec_id, -amount, dt, note)
+                elif kind == bond_schedule.SALE:
+                    self.credit(account_rec_id, amount, dt, note, credit_type=SALE_TIME)
+                else:
+                    self.credit(account_rec_id, amount, dt, note)
 
-            # If the Bond purchase date is on or after the opening date,
-            # enter both the debit on purchase and a credit on maturity.
-            # Otherwise, just enter a credit on maturity.
+    def get_bond_yields(self, bonds, at_market=False):
+        """Return the BondYields of each of 'bonds' at its purchase price or,
+        if 'at_market', at its most recent price on the start date
+        (see bond_analytics.py)"""
 
-            opening_date = self.ledger[entry['account_rec_id']][0][0]
-            for record in details:
-                if record['date'] >= opening_date:
-                    if record['amount'] < 0:
-                        self.debit(entry['account_rec_id'],
-                                   -record['amount'],
-                                   record['date'],
-                                   record['note'] + ", CUSIP: " + entry['cusip'])
-                    else:
-                        if record['note'] == 'Bond Sale':
-                            self.credit(entry['account_rec_id'],
-                                        record['amount'],
-                                        record['date'],
-                                        record['note'] + ", CUSIP: " +
-                                        entry['cusip'],
-                                        credit_type=SALE_TIME)
-                        else:
-                            self.credit(entry['account_rec_id'],
-                                        record['amount'],
-                                        record['date'],
-                                        record['note'] + ", CUSIP: " +
-                                        entry['cusip'])
+        if not at_market:
+            return self.bond_analytics.yields(bonds)
+
+        return self.bond_analytics.yields(bonds, [bond['most_recent_price'] for bond in bonds],
+                                          self.start_date)
+
+    def get_ladder_report(self, bucket_years=1, buckets=10):
+        """Return the LadderReport of the bonds and CDs as of the start date
+        (see ladder.py). Each bond is discounted at its yield to worst at its
+        most recent price, else at its purchase price, else at its coupon.
+        """
+        snapshot = self.snapshot if self.snapshot is not None else self.dao.load_snapshot()
+
+        bonds, schedule = bond_schedule.schedule_valid_bonds(list(snapshot.bonds),
+                                                             self.bond_cash_flow)
+        bond_yields = []
+        for bond, at_market, at_cost in zip(bonds, self.get_bond_yields(bonds, at_market=True),
+                                            self.get_bond_yields(bonds)):
+            bond_yields.append(at_market.ytw if at_market.ytw is not None else
+                               at_cost.ytw if at_cost.ytw is not None else float(bond['coupon']))
+
+        cd_flows = []
+        for cd in snapshot.cds:
+            try:
+                cd_flows.append(self.cd_cash_flow(cd))
+            except (TypeError, ValueError):
+                cd_flows.append(None)
+
+        return ladder_report(self.start_date, bonds, schedule, bond_yields, snapshot.cds,
+                             cd_flows, bucket_years, buckets)
 
     def bond_cash_flow(self, entry):
         details = []
@@ -742,30 +1061,32 @@ class CfAnalysis:
 
         The fund entry is used to set the balance in the fund.
         """
-        fund_records = self.get_from_db('fund')
-        self.logger.log(logging.INFO, "Entries in Funds list: {0}".format(len(fund_records)))
+        fund_records = self.snapshot.funds
+        self.logger.log(logging.INFO, "Entries in Funds list: %s", len(fund_records))
+        balance_note = descriptions.get_id('balance')
 
         for entry in fund_records:
+            if not self.in_scope(entry['account_rec_id']):
+                continue
             entry_date = datetime.strptime(entry['date'], dfc.DATE_FORMAT)
 
             self.credit(entry['account_rec_id'],
                         entry['balance'],
                         entry_date,
-                        'balance')
+                        balance_note)
             # TODO - how about interest processing ???
 
     def apply_interest(self):
         """Apply interest to all cash accounts"""
-        cash_accounts = self.get_from_db('ca')
-        self.logger.log(logging.INFO,
-                        "Entries in Cash Accounts: {0}".format(len(cash_accounts)))
+        cash_accounts = self.snapshot.cash_accounts
+        self.logger.log(logging.INFO, "Entries in Cash Accounts: %s", len(cash_accounts))
         for ca in cash_accounts:
+            if not self.in_scope(ca['account_rec_id']):
+                continue
             start_date = datetime.strptime(ca['interest_date'], "%Y-%m-%d")
 
             # push all int payment dates after opening date
-            # account_rec = self.get_account(ca['account_rec_id'])
-            account_rec = self.get_from_db('account', 'rec_id', ca['account_rec_id'])[0]
-            opening_date = datetime.strptime(account_rec['opening_date'], "%Y-%m-%d")
+            opening_date = datetime.strptime(ca['opening_date'], "%Y-%m-%d")
             months_in_period = self.period_to_months(ca['frequency'])
             while opening_date > start_date:
                 start_date = self.get_next_date(start_date,
@@ -777,18 +1098,11 @@ class CfAnalysis:
             rate_adj = self.period_to_rate_factor(ca['frequency'])
             rate = (float(ca['rate']) / rate_adj) / 100
 
-            for interest_date in interest_dates:
-                bal = self.get_bal_on_date(interest_date,
-                                           self.ledger[ca['account_rec_id']])
-                interest = bal * rate
-
-                if interest > 0.0:
-                    self.credit(ca['account_rec_id'], interest, interest_date,
-                                "Interest", credit_type=INTEREST_TIME)
-                else:
-                    # ignore negative interest
-                    self.credit(ca['account_rec_id'], 0.0, interest_date,
-                                "Interest", credit_type=INTEREST_TIME)
+            # interest is credited on the interest date, based on the
+            # balance at the end of that day
+            periods = [(dt.replace(hour=INTEREST_TIME), dt.replace(hour=LATEST_TIME))
+                       for dt in interest_dates]
+            self.ledger[ca['account_rec_id']].accrue_interest(periods, rate, "Interest")
 
     @staticmethod
     def calc_30_360(date_1, date_2):
@@ -796,47 +1110,9 @@ class CfAnalysis:
 
         The resulting factor is the ratio of annual interest that should
         be applied for the period specified by the two dates.
-
-        This is my best guess at what 30/360 used by Fidelity means.
-        First, every month is assumed to have 30 days and the year has 360.
-        When doing a calculation, first determine the number of whole 
-        months - assume each has 30 has. Then figure the number of remaining
-        days. Add those together and divide by 360.
-
-
-            eg    5/1/2018 - 9/28/2018
-                     4 months * 30  = 120 days     (5,6,7,8)
-                     28 - 1         =  27 days     (in Sept)
-                                      ----
-                                      147 days
-
-                   147/360 = % of yearly interest due
-        
-            eg    5/28/2018 - 9/1/2018
-                     3 months       = 90 days      
-                     2 + 1          =  3 days    5/29,5/30, 9/1)
-                                      --- 
-                                      93 days
-                     93/360 = % of yearly interest due
+        (see day_count.thirty_360())
         """
-        if date_2 < date_1:
-            raise ValueError("date_2 must be >= date_1")
-
-        if date_2.month >= date_1.month:
-            months = date_2.month - date_1.month + (12 * (date_2.year - date_1.year))
-        else:
-            months = (12 - date_1.month + 1) + (date_2.month - 1) + \
-                     (12 * (date_2.year - date_1.year - 1))
-        if date_1.day > date_2.day:
-            months -= 1
-            days = 30 - date_1.day + date_2.day
-        else:
-            days = date_2.day - date_1.day
-
-        total_days = (30 * months) + days
-        ratio = total_days / 360.0
-
-        return ratio
+        return day_count.thirty_360(date_1, date_2)
 
     @staticmethod
     def get_dates(occurrence_spec, last_date):
@@ -857,9 +1133,7 @@ class CfAnalysis:
             date (list(datetime)): a list of dates, in datetime format
                 matching the given input
         """
-        occ = Occurrences(occurrence_spec, last_date)
-
-        return occ.get_dates()
+        return list(occurrence_dates(occurrence_spec, last_date))
 
     @staticmethod
     def get_inflated_amounts(amount, inflation, date_list):
@@ -954,21 +1228,16 @@ class CfAnalysis:
         """
         Return just the rec_id for the given account_name
 
-        Note: The query returns a set of tuples, one tuple for each
-              row that matches the query. In my case, one row for each account
-              with a matching rec_id. Of course, by design, rec_ids are
-              unique so there will only be one row (tuple) in the returned set.
-              The tuple will have a component for each column in the row.
-              All components in the tuple are set to None except the first
-              since that is the column that contains the rec_id. (see DB schema)
+        Note: Account names are unique so at most one row matches the query.
+              0 is returned if there is no such account.
         """
-        try:
-            query = "SELECT rec_id FROM account WHERE account_name=\'{}\'".format(account_name)
-            self.logger.log(logging.INFO, query)
-            cursor = self.fm.db_conn.execute(query)
-            # print(cursor.description)
-            account_rec_id = cursor.fetchone()[0]
-        except TypeError:
+        if self.batch is not None:
+            if self.account_ids is None:
+                self.account_ids = {name: rec_id for rec_id, name in self.get_account_id_map().items()}
+            account_rec_id = self.account_ids.get(account_name)
+        else:
+            account_rec_id = self.dao.select_one_value('account', 'rec_id', 'account_name', account_name)
+        if account_rec_id is None:
             # the following is used in case there are no accounts yet
             account_rec_id = 0
 
@@ -991,56 +1260,18 @@ class CfAnalysis:
         If a column is specified, value must also be specified. Any row where
         'column' data matches 'value' are returned.
 
-        Read the column names and data from the DB and construct a python style
-        dict to return.
+        The query is handled by the data access layer (see data_access.py).
 
         Return: table_content[{},{},...] - list of dictionaries
         """
+        return self.dao.select(table, column, value)
 
-        """
-        >>> import sqlite3
-        >>> con.row_factory = sqlite3.Row
-        >>> cur = con.cursor()
-        >>> cur.execute("SELECT id, first_name, last_name FROM customers WHERE id = 2")
-        >>> result = cur.fetchone()
-        >>> id, first_name, last_name = result['id'], result['first_name'], result['last_name']
-        >>> print(f"Customer: {first_name} {last_name}'s id is {id}")
-        Customer: Donald Knuth's id is 2
-        """
-        self.logger.log(logging.INFO,
-                        "get_from_db:  table: {}, column: {}, Value: {} ".format(table, column, value))
-        table_content = []
-        if not self.fm.is_data_file_open():
-            self.logger.log(logging.INFO, "DB not open")
-            return table_content
-
-        column_names = []
-
-        # Get the column names to be used for the dictionary
-        cursor = self.fm.db_conn.execute("SELECT * FROM PRAGMA_TABLE_INFO(\'{}\');".format(table))
-        for row in cursor:
-            column_names.append(row[1])  # column 1 has the column name
-        try:
-            if column:
-                query = "SELECT * FROM {} WHERE {} == {}".format(table, column, value)
-            else:
-                query = "SELECT * FROM {}".format(table)
-
-            self.logger.log(logging.INFO, query)
-            cursor = self.fm.db_conn.execute(query)
-
-            # connect the column names and column data
-            for row in cursor:
-                row_dict = {}
-                for i, col_name in enumerate(column_names):
-                    row_dict[col_name] = row[i]
-                table_content.append(row_dict)
-        except Exception as e:
-            self.logger.log(logging.INFO, "Query failed: {}".format(e))
-            raise RuntimeError("Failed DB Query: {}". format(e))
+    def get_accounts_by_id(self, rec_ids=None):
+        """Return a dict of account records indexed by account rec_id.
 
-        # self.logger.log(logging.INFO,"      {}".format(table_content))
-        return table_content
+        All accounts are read with a single query.
+        """
+        return self.dao.get_accounts_by_id(rec_ids)
 
     def set_setting(self, setting, value):
         update = "UPDATE setting SET \'{}\'=\'{}\'".format(setting, value)
@@ -1064,6 +1295,107 @@ class CfAnalysis:
         db_conn.execute(update)
         db_conn.commit()
 
+    def begin_batch(self):
+        """Start queuing the writes of write_to_db(), new_db_rec() and
+        delete_db_rec() until commit_batch() or rollback_batch().
+        """
+        if self.batch is not None:
+            raise RuntimeError("{}(): A batch is already open".format(util.f_name()))
+
+        self.batch = []
+        self.batch_dirty = []
+        self.account_ids = None
+
+    def commit_batch(self):
+        """Write all the queued changes and commit them as one transaction"""
+
+        try:
+            self.flush_batch()
+            self.fm.db_conn.commit()
+        except Exception as e:
+            self.logger.log(logging.INFO, "Batch Update Failed: %s", e)
+            self.rollback_batch()
+            raise RuntimeError("Batch Update Failed: {}".format(e))
+
+        dirty = self.batch_dirty
+        self.end_batch()
+        for table, rec_id in dirty:
+            self.mark_rec_dirty(table, rec_id)
+
+    def rollback_batch(self):
+        """Discard every change of the open batch"""
+
+        if self.batch is None:
+            return
+
+        self.fm.db_conn.rollback()
+        self.end_batch()
+
+        # the batch may have marked accounts that weren't changed after all
+        self.mark_all_dirty()
+
+    def end_batch(self):
+        self.batch = None
+        self.batch_dirty = None
+        self.account_ids = None
+
+    def flush_batch(self):
+        """Execute the queued statements without committing them.
+
+        Consecutive statements with the same text are sent with a
+        single executemany().
+        """
+        for statement, group in groupby(self.batch, key=itemgetter(0)):
+            self.fm.db_conn.executemany(statement, [params for _, params in group])
+        self.batch.clear()
+
+    def flush_db(self):
+        """Execute the queued statements of an open batch, if any"""
+
+        if self.batch is not None:
+            self.flush_batch()
+
+    def rollback_db(self):
+        """Roll back the open batch or, if there is none, the current transaction"""
+
+        if self.batch is not None:
+            self.rollback_batch()
+        else:
+            self.fm.db_conn.rollback()
+
+    def commit_db(self):
+        """Commit unless a batch is open (the batch is committed as a whole)"""
+
+        if self.batch is None:
+            self.fm.db_conn.commit()
+
+    def execute_db(self, statement, params, failure):
+        """Execute and commit a statement or queue it if a batch is open.
+
+        'failure' prefixes the log message if the statement fails.
+        """
+        self.logger.log(logging.DEBUG, "%s %s", statement, params)
+
+        if self.batch is not None:
+            self.batch.append((statement, params))
+            return
+
+        try:
+            self.fm.db_conn.execute(statement, params)
+            self.fm.db_conn.commit()
+        except Exception as e:
+            self.logger.log(logging.INFO, "%s: %s", failure, e)
+            self.fm.db_conn.rollback()
+            raise RuntimeError("Update Failed: {}".format(statement))
+
+    def check_columns(self, table, columns):
+        """Raise RuntimeError unless each of the columns is in the table"""
+
+        known = self.dao.columns(table)
+        for column in columns:
+            if column not in known:
+                raise RuntimeError("{}(): Unknown column {}.{}".format(util.f_name(), table, column))
+
     def write_to_db(self, table, rec_id, data):
         """ Write the given modifications to the given rec (rec_id)
 
@@ -1089,20 +1421,16 @@ class CfAnalysis:
             elif mod[0] == 'to_account_name':
                 data.append(('to_account_rec_id', self.get_account_rec_id(mod[1])))
         if data:
-            update = "Update {} Set ".format(table)
-            for mod in data:
-                update += "\'{}\' = \'{}\' ,".format(mod[0], mod[1])
-            update = update[:-1]  # remove the final comma
-            update += "Where rec_id = \'{}\'".format(rec_id)
-
-            self.logger.log(logging.INFO, update)
-            try:
-                self.fm.db_conn.execute(update)
-                self.fm.db_conn.commit()
-            except Exception as e:
-                self.logger.log(logging.INFO, "Update Failed: {}".format(e))
-                self.fm.db_conn.rollback()
-                raise RuntimeError("Update Failed: {}". format(update))
+            self.check_columns(table, [mod[0] for mod in data])
+            self.mark_rec_dirty(table, rec_id)
+            update = "UPDATE {} SET {} WHERE rec_id = ?".format(
+                table, ", ".join("{} = ?".format(mod[0]) for mod in data))
+
+            self.execute_db(update, [mod[1] for mod in data] + [rec_id], "Update Failed")
+            if self.batch is not None:
+                self.batch_dirty.append((table, rec_id))
+            else:
+                self.mark_rec_dirty(table, rec_id)
 
     def new_db_rec(self, table, rec):
         """Add a new record to the DB
@@ -1119,37 +1447,18 @@ class CfAnalysis:
         else:
             raise RuntimeError("Unknown Table Type : {}".format(table))
 
-        values = "VALUES ("
-        insert = "Insert into {} (".format(table)
-        for key in rec.keys():
-            insert += key + ","
-            values += "\'{}\',".format(rec[key])
-        insert = insert[:-1]  # remove the final comma
-        insert += ")"
-        values = values[:-1]
-        values += ")"
-        insert += values
-
-        self.logger.log(logging.INFO, insert)
-        try:
-            self.fm.db_conn.execute(insert)
-            self.fm.db_conn.commit()
-        except Exception as e:
-            self.logger.log(logging.INFO, "Insert Failed: {}".format(e))
-            self.fm.db_conn.rollback()
-            raise RuntimeError("Update Failed: {}".format(insert))
+        self.check_columns(table, rec.keys())
+        insert = "INSERT INTO {} ({}) VALUES ({})".format(
+            table, ",".join(rec.keys()), ",".join("?" * len(rec)))
+
+        self.execute_db(insert, list(rec.values()), "Insert Failed")
+        self.mark_dirty(table, rec)
 
     def delete_db_rec(self, table, rec_id):
-        delete = "Delete from {} where rec_id = \'{}\'".format(table, rec_id)
-        self.logger.log(logging.INFO, delete)
+        self.check_columns(table, ['rec_id'])
+        self.mark_rec_dirty(table, rec_id)
 
-        try:
-            self.fm.db_conn.execute(delete)
-            self.fm.db_conn.commit()
-        except Exception as e:
-            self.logger.log(logging.INFO, "Delete Failed: {}".format(e))
-            self.fm.db_conn.rollback()
-            raise RuntimeError("Update Failed: {}".format(delete))
+        self.execute_db("DELETE FROM {} WHERE rec_id = ?".format(table), [rec_id], "Delete Failed")
 
     def account_create(self, rec):
         """User has created a new account. Create the corresponding cash account
@@ -1172,8 +1481,10 @@ class CfAnalysis:
             insert += values
             self.logger.log(logging.INFO, insert)
 
+            self.flush_db()
             self.fm.db_conn.execute(insert)
-            self.fm.db_conn.commit()
+            self.commit_db()
+            self.account_ids = None  # the account map must pick up the new account
 
             # ################################################
             # Now add a record to the ca table
@@ -1192,10 +1503,11 @@ class CfAnalysis:
             self.logger.log(logging.INFO, insert)
 
             self.fm.db_conn.execute(insert)
-            self.fm.db_conn.commit()
+            self.commit_db()
+            self.mark_all_dirty()
         except Exception as e:
-            self.logger.log(logging.INFO, "Account Create Failed: {}".format(e))
-            self.fm.db_conn.rollback()
+            self.logger.log(logging.INFO, "Account Create Failed: %s", e)
+            self.rollback_db()
             raise RuntimeError("Update Failed: {}".format(insert))
 
     def account_delete(self, account_rec_id):
@@ -1211,6 +1523,7 @@ class CfAnalysis:
         rec = rec_list[0]
 
         try:
+            self.flush_db()
             for table in ('fund', 'cd', 'ca', 'bond', 'loan'):
                 delete = "Delete from {} where account_name = \'{}\'".format(table, rec['account_name'])
                 self.logger.log(logging.INFO, delete)
@@ -1237,11 +1550,13 @@ class CfAnalysis:
                 self.logger.log(logging.INFO, update)
                 self.fm.db_conn.execute(update)
 
-            self.fm.db_conn.commit()
+            self.commit_db()
+            self.account_ids = None
+            self.mark_all_dirty()
 
         except Exception as e:
-            self.logger.log(logging.INFO, "Account Delete Exception: {}".format(e))
-            self.fm.db_conn.rollback()
+            self.logger.log(logging.INFO, "Account Delete Exception: %s", e)
+            self.rollback_db()
             raise RuntimeError("Account delete failed")
 
     def account_name_changed(self, old_name, new_name):
@@ -1250,6 +1565,7 @@ class CfAnalysis:
         Go through all tables in the DB  and update the account name
         """
         try:
+            self.flush_db()
             for table in ('fund', 'cd', 'ca', 'bond', 'loan'):
                 update = "Update \'{}\' Set account_name = \'{}\' Where account_name = \'{}\'".format(table, new_name,
                                                                                                       old_name)
@@ -1271,11 +1587,13 @@ class CfAnalysis:
             self.logger.log(logging.INFO, update)
             self.fm.db_conn.execute(update)
 
-            self.fm.db_conn.commit()
+            self.commit_db()
+            self.account_ids = None
+            self.mark_all_dirty()
 
         except Exception as e:
-            self.logger.log(logging.INFO, "Account Name Change Exception: {}".format(e))
-            self.fm.db_conn.rollback()
+            self.logger.log(logging.INFO, "Account Name Change Exception: %s", e)
+            self.rollback_db()
             raise RuntimeError("Account name change failed")
 
     def get_start_date(self):
@@ -1348,52 +1666,207 @@ class CfAnalysis:
             account = self.ledger[account_rec_id]
             dates = self.get_periodic_dates(start_date, granularity.lower(),
                                             end_date)
-            for dt in dates:
-                bal = self.get_bal_on_date(dt, account)
-                # print("Date {} = {}".format(dt,bal))
-                data.append((dt, bal))
+            balances = self.get_balances_on_dates(dates, account)
+            data = list(zip(dates, balances))
 
         return data
 
 
 class Logger:
+    """The logger of the app (see Developers Notes 2f).
+
+    Args:
+        default_level (int): level of the records written to the log file
+    """
+    LOG_FILE = "./cf_log.txt"
+    LOG_FILE_MAX_BYTES = 5 * 1024 * 1024
+    LOG_FILE_BACKUPS = 3
+    LEVELS = (logging.CRITICAL, logging.ERROR, logging.WARNING, logging.INFO, logging.DEBUG)
+
+    _listener = None  # one background writer per process
+
     def __init__(self, default_level):
-        self.log_connection = None
         self.default_level = default_level
+        self.log_connection = logging.getLogger("cf")
 
         ##########################################
         # Set up logger
         ##########################################
+        if Logger._listener is None:
+            log_format = "%(levelname)s %(asctime)s - %(message)s"
+            file_handler = RotatingFileHandler(self.LOG_FILE, maxBytes=self.LOG_FILE_MAX_BYTES,
+                                               backupCount=self.LOG_FILE_BACKUPS, delay=True)
+            file_handler.setFormatter(logging.Formatter(log_format))
 
-        log_format = "%(levelname)s %(asctime)s - %(message)s"
-        logging.basicConfig(filename="./cf_log.txt",
-                            level=default_level,
-                            format=log_format,
-                            filemode='a')
-        self.log_connection = logging.getLogger()
-
-        self.log_connection.log(logging.INFO, "Logger setup complete")
-
-    def log(self, lvl, debug_msg):
-        if lvl == logging.CRITICAL:
-            self.log_connection.log(logging.CRITICAL, debug_msg)
-        elif lvl == logging.ERROR:
-            self.log_connection.log(logging.ERROR, debug_msg)
-        elif lvl == logging.WARNING:
-            self.log_connection.log(logging.WARNING, debug_msg)
-        elif lvl == logging.INFO:
-            self.log_connection.log(logging.INFO, debug_msg)
-        elif lvl == logging.DEBUG:
-            self.log_connection.log(logging.DEBUG, debug_msg)
-        else:
-            self.log_connection.log(logging.INFO, debug_msg)
+            log_queue = queue.SimpleQueue()
+            Logger._listener = QueueListener(log_queue, file_handler)
+            Logger._listener.start()
+            atexit.register(Logger._listener.stop)  # flushes the queue
+
+            self.log_connection.addHandler(QueueHandler(log_queue))
+            self.log_connection.propagate = False
+
+        self.log_connection.setLevel(default_level)
+
+        self.log(logging.INFO, "Logger setup complete")
+
+    def log(self, lvl, msg, *args):
+        """Log msg % args at level 'lvl' (an unknown level logs at INFO).
+
+        The message is only formatted if the level is enabled.
+        """
+        if lvl not in self.LEVELS:
+            lvl = logging.INFO
+        if self.log_connection.isEnabledFor(lvl):
+            self.log_connection.log(lvl, msg, *args)
+
+    def is_enabled(self, lvl):
+        return self.log_connection.isEnabledFor(lvl)
+
+    def set_debug(self, enabled):
+        """Turn the DEBUG records (the per transaction and per query logs) on or off"""
 
+        self.log_connection.setLevel(logging.DEBUG if enabled else self.default_level)
+
+    def is_debug(self):
+        return self.is_enabled(logging.DEBUG)
+
+
+REPORTS = ('balances', 'registers', 'csv')
+
+
+def get_report_accounts(cfa):
+    """Return a list of (account_rec_id, account_name) of the real accounts
+    in the ledger, sorted by name.
+    """
+    id_map = cfa.get_account_id_map()
+    accounts = [(rec_id, id_map[rec_id]) for rec_id in cfa.ledger
+                if rec_id >= dfc.FIRST_REAL_ACCOUNT and rec_id in id_map]
+
+    return sorted(accounts, key=lambda account: account[1])
+
+
+def get_monthly_balances(cfa, accounts):
+    """Return (dates, rows) where each row is the list of the account
+    balances at each month from the start date to the end date.
+    """
+    dates = cfa.get_periodic_dates(cfa.get_start_date(), 'monthly', cfa.get_end_date())
+    columns = [cfa.get_balances_on_dates(dates, cfa.get_register(rec_id)) for rec_id, _ in accounts]
+
+    return dates, list(zip(*columns))
+
+
+def report_registers(cfa, out):
+    for rec_id, name in get_report_accounts(cfa):
+        out.write("Account: {}\n".format(name))
+        for dt, amount, balance, comment in cfa.get_register(rec_id):
+            out.write("{}  {:>14,.2f}  {:>14,.2f}  {}\n".format(
+                dt.strftime(dfc.DATE_FORMAT), amount, balance, comment))
+        out.write("\n")
+
+
+def report_balances(cfa, out):
+    accounts = get_report_accounts(cfa)
+    dates, rows = get_monthly_balances(cfa, accounts)
+
+    out.write("{:10}".format("Date") + "".join("  {:>16.16}".format(name) for _, name in accounts) + "\n")
+    for dt, row in zip(dates, rows):
+        out.write(dt.strftime(dfc.DATE_FORMAT) + "".join("  {:>16,.2f}".format(bal) for bal in row) + "\n")
+
+
+def report_csv(cfa, out):
+    import csv
+
+    accounts = get_report_accounts(cfa)
+    dates, rows = get_monthly_balances(cfa, accounts)
+
+    writer = csv.writer(out)
+    writer.writerow(["date"] + [name for _, name in accounts])
+    for dt, row in zip(dates, rows):
+        writer.writerow([dt.strftime(dfc.DATE_FORMAT)] + ["{:.2f}".format(bal) for bal in row])
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        prog="cf", description="Cash flow analysis. Without --db, the GUI is started.")
+    parser.add_argument("--db", help="database file to report on, without the GUI")
+    parser.add_argument("--months", type=int,
+                        help="months to track (default: the tracking_months setting)")
+    parser.add_argument("--start", help="start date, YYYY-MM-DD (default: today)")
+    parser.add_argument("--report", choices=REPORTS, default='balances',
+                        help="balances: monthly balances, registers: every transaction, "
+                             "csv: monthly balances as CSV")
+    parser.add_argument("--time", action='store_true',
+                        help="write the time taken by each stage of the ledger build to stderr")
+    parser.add_argument("--profile", metavar="FILE",
+                        help="write a cProfile of a full ledger build to FILE")
+    parser.add_argument("--debug", action='store_true',
+                        help="write the DEBUG records (every transaction and query) to the log file")
+    parser.add_argument("--check-args", action='store_true',
+                        help="check the arguments of every ledger call (slower)")
+    args = parser.parse_args(argv)
+
+    if args.db and not os.path.isfile(args.db):
+        parser.error("no such database file: {}".format(args.db))
+    if args.start:
+        try:
+            args.start = datetime.strptime(args.start, dfc.DATE_FORMAT)
+        except ValueError:
+            parser.error("invalid start date: {}".format(args.start))
+
+    return args
+
+
+def run_headless(args, out=sys.stdout):
+    """Build the ledger of args.db and write the requested report to 'out'"""
+
+    logger = Logger(logging.DEBUG if args.debug else logging.WARNING)
+    if args.check_args:
+        CfAnalysis.set_arg_checks(True)
+    fm = FileManager(logger)
+    cfa = CfAnalysis(fm, logger)
+    fm.set_cfa(cfa)
+    fm.open_database(args.db)
+    cfa.write_cache = False  # a report leaves the database as it is
+
+    if args.start:
+        cfa.start_date = args.start
+    months = args.months
+    if months is None:
+        months = int(cfa.get_from_db('setting')[0]['tracking_months'])
+
+    if args.profile:
+        cfa.profile_restart(months, args.profile)
+    else:
+        cfa.restart(months)
+    if args.time:
+        sys.stderr.write("\n".join(cfa.get_restart_profile().report()) + "\n")
+
+    if args.report == 'registers':
+        report_registers(cfa, out)
+    elif args.report == 'csv':
+        report_csv(cfa, out)
+    else:
+        report_balances(cfa, out)
+
+    fm.db_conn.close()
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.db:
+        run_headless(args)
+        return
 
-def main():
     ##########################################
     # Run the GUI
     ##########################################
+    start_time = time.perf_counter()
+
     logger = Logger(logging.INFO)
+    logger.set_debug(args.debug)
+    if args.check_args:
+        CfAnalysis.set_arg_checks(True)
 
     fm = FileManager(logger)
 
@@ -1401,7 +1874,15 @@ def main():
 
     fm.set_cfa(cfa)
 
-    gui = CfGui(cfa, fm, logger)
+    # Time the imports made to put up the main window (see import_timer.py)
+    with ImportTimer() as import_timer:
+        from cf_gui import CfGui
+
+        gui = CfGui(cfa, fm, logger, start_time=start_time)
+
+    logger.log(logging.INFO, "Startup imports took %.3f sec", import_timer.total())
+    for line in import_timer.report():
+        logger.log(logging.INFO, line)
 
     gui.run()
 
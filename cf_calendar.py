@@ -0,0 +1,94 @@
+#
+# Author: Greg Glezman
+#
+# Copyright (c) 2018-2022 G.Glezman.  All Rights Reserved.
+#
+# This file contains the month arithmetic shared by the cash flow
+# analysis and occurrences.
+#
+# Moving a date by a number of months corrects for short months
+# (eg 1 month from jan 31st is feb 28th). The days in each month are
+# cached since the same few hundred months are asked for over and over.
+#
+# month_offsets() produces a whole series of dates in one call. If NumPy
+# is installed the year/month/day arithmetic is done on arrays.
+
+from calendar import monthrange
+from functools import lru_cache
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional
+    np = None
+
+MONTHS_IN_YEAR = 12
+
+# days in each month of a non leap year, used by the NumPy path
+_DAYS_IN_MONTH = (31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31)
+
+
+@lru_cache(maxsize=None)
+def days_in_month(year, month):
+    """Return the number of days in the given month of the given year"""
+
+    return monthrange(year, month)[1]
+
+
+def add_months(dt, months):
+    """Return the datetime 'months' months from 'dt'.
+
+    'months' may be negative. The day is limited to the last day of the
+    resulting month. The time of day is preserved.
+    """
+    index = dt.month - 1 + months
+    year = dt.year + index // MONTHS_IN_YEAR
+    month = index % MONTHS_IN_YEAR + 1
+
+    return dt.replace(year=year, month=month,
+                      day=min(dt.day, days_in_month(year, month)))
+
+
+def months_between(date_1, date_2):
+    """Return the number of calendar months from date_1 to date_2 (days ignored)"""
+
+    return (date_2.year - date_1.year) * MONTHS_IN_YEAR + date_2.month - date_1.month
+
+
+def month_offsets(start, months):
+    """Return a list with add_months(start, m) for each m in 'months'."""
+
+    if np is None:
+        return [add_months(start, m) for m in months]
+
+    index = (start.month - 1) + np.asarray(months, dtype=np.int64)
+    years = start.year + index // MONTHS_IN_YEAR
+    month_index = index % MONTHS_IN_YEAR
+
+    leap = ((years % 4 == 0) & (years % 100 != 0)) | (years % 400 == 0)
+    month_days = np.asarray(_DAYS_IN_MONTH)[month_index] + ((month_index == 1) & leap)
+    days = np.minimum(start.day, month_days)
+
+    return [start.replace(year=y, month=m + 1, day=d)
+            for y, m, d in zip(years.tolist(), month_index.tolist(), days.tolist())]
+
+
+def periodic_dates(start, interval_in_months, last):
+    """Return the dates every 'interval_in_months' months from 'start', up to
+    and including 'last'.
+
+    If 'last' precedes 'start', the dates go backward from 'start' down to
+    and including 'last' and are returned in ascending order.
+    """
+    if start <= last:
+        count = months_between(start, last) // interval_in_months + 1
+        dates = month_offsets(start, range(0, count * interval_in_months, interval_in_months))
+        while dates and dates[-1] > last:
+            dates.pop()
+    else:
+        count = months_between(last, start) // interval_in_months + 1
+        dates = month_offsets(start, range(0, -count * interval_in_months, -interval_in_months))
+        while dates and dates[-1] < last:
+            dates.pop()
+        dates.reverse()
+
+    return dates
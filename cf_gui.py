@@ -144,24 +144,23 @@
 #    5. AccountEdit - Deleted instrument does not show properly
 #    6. scheduled transfers / left click on date to bring up change window
 #        the window is to small, buttons on the bottom are hidden
+#
+# Only the modules needed to put up the main window are imported at load
+# time. The help viewer, settings window, edit windows and import
+# machinery are imported by the menu commands that open them.
+#
 # Keep the next two statements in order so ttk widgets override TK widgets
+import logging
+import time
 import tkinter as tk
 import tkinter.ttk as ttk
 from datetime import datetime, date
 from tkinter import messagebox
 from functools import partial
-from help import Help
 import data_file_constants as dfc
-from settings_win import SettingsWin
-from account_edit_win import AccountEditWin
-from import_win import ImportAccountsWin
-from import_win import ImportBondDetailsWin
-from import_support import ImportMethodsSupported
 import gui as gui
 import cf_styles
 import utils as local_util
-# todo - the following line should go away
-from import_support import process_fidelity_account_download
 
 
 class GraphFrame:
@@ -358,6 +357,8 @@ class MyMenuBar:
                                    command=self.validate_database_file)
         self.file_menu.add_command(label="Dump Current Database",
                                    command=self.dump_db)
+        self.file_menu.add_command(label="Restore Database From Dump",
+                                   command=self.restore_db)
         self.file_menu.add_separator()
 
         # todo - create an exit function which will close the DB then quit
@@ -405,6 +406,27 @@ class MyMenuBar:
                             menu=self.report_menu, state='disabled')
         self.report_menu.add_command(label="Interest!",
                                      command=self.report_interest)
+        self.report_menu.add_command(label="Bond Ladder",
+                                     command=self.show_ladder_report)
+
+        ########################################################
+        # Performance Menu - disable until a file is opened
+        ########################################################
+        self.performance_menu = tk.Menu(my_menu)
+        my_menu.add_cascade(label="Performance",
+                            menu=self.performance_menu, state='disabled')
+        self.performance_menu.add_command(label="Last Restart",
+                                          command=self.show_restart_profile)
+        self.performance_menu.add_command(label="Profile Restart To File",
+                                          command=self.profile_restart)
+        self.debug_logging_var = tk.BooleanVar(master, value=parent.is_debug_logging())
+        self.performance_menu.add_checkbutton(label="Debug Logging",
+                                              variable=self.debug_logging_var,
+                                              command=self.debug_logging_changed)
+        self.arg_checks_var = tk.BooleanVar(master, value=parent.get_arg_checks())
+        self.performance_menu.add_checkbutton(label="Argument Checks",
+                                              variable=self.arg_checks_var,
+                                              command=self.arg_checks_changed)
 
         ########################################################
         # Help Menu
@@ -413,86 +435,75 @@ class MyMenuBar:
         my_menu.add_cascade(label="Help", menu=self.help_menu)
         self.help_menu.add_command(label="Overview",
                                    command=partial(
-                                       Help,
-                                       "OVERVIEW",
-                                       self.master))
+                                       self.show_help,
+                                       "OVERVIEW"))
         self.help_menu.add_command(label="Using This Application",
                                    command=partial(
-                                       Help,
-                                       "USING_APP",
-                                       self.master))
+                                       self.show_help,
+                                       "USING_APP"))
         self.help_menu.add_command(label="File Menu",
                                    command=partial(
-                                       Help,
-                                       "FILE_MENU",
-                                       self.master))
+                                       self.show_help,
+                                       "FILE_MENU"))
         self.edit_menu = tk.Menu(self.help_menu)
         self.help_menu.add_cascade(label="Edit Menu", menu=self.edit_menu)
         self.edit_menu.add_command(label="Settings",
                                    command=partial(
-                                       Help,
-                                       "EDIT_SETTINGS",
-                                       self.master))
+                                       self.show_help,
+                                       "EDIT_SETTINGS"))
         self.edit_menu.add_command(label="Accounts",
                                    command=partial(
-                                       Help,
-                                       "EDIT_ACCOUNTS",
-                                       self.master))
+                                       self.show_help,
+                                       "EDIT_ACCOUNTS"))
         self.edit_menu.add_command(label="Cash Accounts",
                                    command=partial(
-                                       Help,
-                                       "EDIT_CASH_ACCOUNTS",
-                                       self.master))
+                                       self.show_help,
+                                       "EDIT_CASH_ACCOUNTS"))
         self.edit_menu.add_command(label="CDs!",
                                    command=partial(
-                                       Help,
-                                       "EDIT_CDS",
-                                       self.master))
+                                       self.show_help,
+                                       "EDIT_CDS"))
         self.edit_menu.add_command(label="Bonds",
                                    command=partial(
-                                       Help,
-                                       "EDIT_BONDS",
-                                       self.master))
+                                       self.show_help,
+                                       "EDIT_BONDS"))
         self.edit_menu.add_command(label="Funds!",
                                    command=partial(
-                                       Help,
-                                       "EDIT_FUNDS",
-                                       self.master))
+                                       self.show_help,
+                                       "EDIT_FUNDS"))
         self.edit_menu.add_command(label="Loans!",
                                    command=partial(
-                                       Help,
-                                       "EDIT_LOANS",
-                                       self.master))
+                                       self.show_help,
+                                       "EDIT_LOANS"))
         self.edit_menu.add_command(label="Transfers!",
                                    command=partial(
-                                       Help,
-                                       "EDIT_TRANSFERS",
-                                       self.master))
+                                       self.show_help,
+                                       "EDIT_TRANSFERS"))
         self.help_menu.add_command(label="Imports!",
                                    command=partial(
-                                       Help,
-                                       "IMPORT_MENU",
-                                       self.master))
+                                       self.show_help,
+                                       "IMPORT_MENU"))
         self.help_menu.add_command(label="Account Pull Down!",
                                    command=partial(
-                                       Help,
-                                       "QA_ACCOUNT_PULL_DOWN",
-                                       self.master))
+                                       self.show_help,
+                                       "QA_ACCOUNT_PULL_DOWN"))
         self.help_menu.add_command(label="Text/Graph!",
                                    command=partial(
-                                       Help,
-                                       "QA_TEXT_GRAPH",
-                                       self.master))
+                                       self.show_help,
+                                       "QA_TEXT_GRAPH"))
         self.help_menu.add_command(label="Date Range",
                                    command=partial(
-                                       Help,
-                                       "QA_DATE_RANGE",
-                                       self.master))
+                                       self.show_help,
+                                       "QA_DATE_RANGE"))
         self.help_menu.add_command(label="About",
                                    command=partial(
-                                       Help,
-                                       "HELP_ABOUT",
-                                       self.master))
+                                       self.show_help,
+                                       "HELP_ABOUT"))
+
+    def show_help(self, topic):
+        from help import Help
+
+        Help(topic, self.master)
 
     def open_database_file(self):
         self.parent.init_storage()
@@ -520,6 +531,7 @@ class MyMenuBar:
         self.my_menu.entryconfig("Edit", state='normal')
         self.my_menu.entryconfig("Import", state='normal')
         self.my_menu.entryconfig("Reports", state='normal')
+        self.my_menu.entryconfig("Performance", state='normal')
 
     @staticmethod
     def validate_database_file():
@@ -529,12 +541,57 @@ class MyMenuBar:
     def dump_db(self):
         self.parent.fm.dump_db()
 
+    def restore_db(self):
+        # FileManager creates the new data file and loads the dump into it
+        self.parent.init_storage()
+        filename = self.parent.fm.restore_db()
+        if filename:
+            self.parent.restart()
+            self.parent.mode_change("Graph")
+            self.parent.set_datafile(filename)
+            self.enable_full_menu_bar()
+
     @staticmethod
     def report_interest():
         messagebox.showerror("Interest Report",
                              "This feature is not yet in place")
 
+    def show_ladder_report(self):
+        from ladder_win import LadderWin
+
+        LadderWin(self.parent, self.parent.get_ladder_report())
+
+    def show_restart_profile(self):
+        from performance_win import PerformanceWin
+
+        profile = self.parent.get_restart_profile()
+        if profile is None:
+            messagebox.showerror("Restart Performance", "There has been no restart yet")
+            return
+        PerformanceWin(self.parent, profile)
+
+    def debug_logging_changed(self):
+        self.parent.set_debug_logging(self.debug_logging_var.get())
+
+    def arg_checks_changed(self):
+        self.parent.set_arg_checks(self.arg_checks_var.get())
+
+    def profile_restart(self):
+        from tkinter.filedialog import asksaveasfilename
+        from performance_win import PerformanceWin
+
+        filename = asksaveasfilename(
+            filetypes=(("cProfile Stats", "*.prof"), ("All Files", "*.*")),
+            title="Save the Restart Profile",
+            defaultextension=".prof")
+        if filename:
+            profile = self.parent.profile_restart(filename)
+            PerformanceWin(self.parent, profile, filename)
+
     def edit_accounts(self):
+        from account_edit_win import AccountEditWin
+        from import_support import ImportMethodsSupported
+
         if self.edit_window_open['account'] == 0:
             columns = [
                 {"heading": "Account Name", "key": "account_name", "width": dfc.FW_MED,
@@ -556,6 +613,8 @@ class MyMenuBar:
                            validate_func=self.validate_account_entry)
 
     def edit_cash_accounts(self):
+        from account_edit_win import AccountEditWin
+
         if self.edit_window_open['ca'] == 0:
             compound1 = ['monthly', 'quarterly', 'annual', 'semi-annual']
             # account_set = self.parent.get_sorted_accounts_list()
@@ -580,6 +639,8 @@ class MyMenuBar:
                            validate_func=self.validate_ca_entry)
 
     def edit_cds(self):
+        from account_edit_win import AccountEditWin
+
         if self.edit_window_open['cd'] == 0:
             compound0 = ['monthly', 'quarterly', 'annual', 'semi-annual', 'once']
             account_set = self.parent.get_sorted_accounts_list()
@@ -608,6 +669,8 @@ class MyMenuBar:
                            validate_func=self.validate_cd_entry)
 
     def edit_loans(self):
+        from account_edit_win import AccountEditWin
+
         if self.edit_window_open['loan'] == 0:
             compound0 = ['monthly', 'quarterly', 'annual', 'semi-annual', 'once']
             account_set = self.parent.get_sorted_accounts_list()
@@ -633,6 +696,8 @@ class MyMenuBar:
                            validate_func=self.validate_loan_entry)
 
     def edit_bonds(self):
+        from account_edit_win import AccountEditWin
+
         if self.edit_window_open['bond'] == 0:
             compound1 = ['monthly', 'quarterly', 'annual', 'semi-annual']
             account_set = self.parent.get_sorted_accounts_list(account_type="Brokerage")
@@ -675,6 +740,8 @@ class MyMenuBar:
                            validate_func=self.validate_bond_entry)
 
     def edit_funds(self):
+        from account_edit_win import AccountEditWin
+
         if self.edit_window_open['fund'] == 0:
             # compound1 = ['monthly', 'quarterly', 'annual', 'semi-annual']
             account_set = self.parent.get_sorted_accounts_list()
@@ -708,6 +775,8 @@ class MyMenuBar:
                            validate_func=self.validate_fund_entry)
 
     def edit_transfers(self):
+        from account_edit_win import AccountEditWin
+
         if self.edit_window_open['transfer'] == 0:
             account_set1 = self.parent.get_sorted_accounts_list(income=True)
             # account_set1.append('income')
@@ -755,6 +824,8 @@ class MyMenuBar:
                            validate_func=self.validate_xfer_entry)
 
     def edit_settings(self):
+        from settings_win import SettingsWin
+
         if self.edit_window_open['setting'] == 0:
             self.edit_window_open['setting'] = 1
             SettingsWin(self.parent, self.master, self)
@@ -766,6 +837,7 @@ class MyMenuBar:
 
         # Todo - this are needs work. gjg  It needs to be moved into import_support
         # this is the trigger point for account init
+        from import_support import process_fidelity_account_download
 
         for account in new_accounts:
             update_method = self.parent.get_account_update_method(account['account_id'])
@@ -1091,6 +1163,8 @@ class MyMenuBar:
         return ""
 
     def import_accounts(self):
+        from import_win import ImportAccountsWin
+
         if self.import_account_win_open is False:
             accounts = self.parent.get_accounts_with_import_methods()
             if len(accounts) > 0:
@@ -1109,6 +1183,8 @@ class MyMenuBar:
         self.import_account_win_open = False
 
     def import_bonds(self):
+        from import_win import ImportBondDetailsWin
+
         if self.import_bond_details_win_open is False:
             self.import_bond_details_win_open = True
             accounts = self.parent.get_accounts_with_bond_import_methods()
@@ -1158,14 +1234,18 @@ class CfGui:
     It will construct the window and add all the required components.
     The 'data_source' will provide account data."""
 
-    def __init__(self, data_source, file_manager, logger):
+    def __init__(self, data_source, file_manager, logger, start_time=None):
         """The init method creates the user frame and related objects.
         The run() function puts it up on the screen.
         The user can then open a data file which triggers creation of
-        the text frame"""
+        the text frame.
+
+        If a 'start_time' (time.perf_counter()) is given, the time to the
+        first paint of the window is logged."""
 
         self.ds = data_source
         self.logger = logger
+        self.start_time = start_time
         self.root = tk.Tk()
         self.root.title("Cash Flow Analysis")
         cf_styles.set_styles()
@@ -1200,8 +1280,15 @@ class CfGui:
         # print("w={}, h={}, x={}, y={}".format(w,h,x,y))
         self.root.geometry('{}x{}+{}+{}'.format(w, h, x, y))
 
+        if self.start_time is not None:
+            # idle callbacks run once the window has been drawn
+            self.root.after_idle(self.log_first_paint)
+
         self.root.mainloop()
 
+    def log_first_paint(self):
+        self.logger.log(logging.INFO, "Time to first paint: %.3f sec", time.perf_counter() - self.start_time)
+
     def update_graph(self):
         account_data = self.ds.get_account_data(
             self.bf.get_active_account_id(),
@@ -1251,6 +1338,9 @@ class CfGui:
     def format_date(self, dt):
         return self.ds.format_date(dt)
 
+    def get_start_date(self):
+        return self.ds.get_start_date()
+
     def get_from_db(self, table, column=None, value=None):
         return self.ds.get_from_db(table, column, value)
 
@@ -1263,6 +1353,12 @@ class CfGui:
     def get_bond_cash_flow(self, bond_entry_from_source):
         return self.ds.bond_cash_flow(bond_entry_from_source)
 
+    def get_bond_yields(self, bonds, at_market=False):
+        return self.ds.get_bond_yields(bonds, at_market)
+
+    def get_ladder_report(self):
+        return self.ds.get_ladder_report()
+
     def get_sorted_accounts_list(self, expense=False, income=False, account_type=None):
         return self.ds.get_sorted_accounts_list(expense, income, account_type)
 
@@ -1281,6 +1377,15 @@ class CfGui:
     def delete_db_rec(self, table, rec_id):
         self.ds.delete_db_rec(table, rec_id)
 
+    def begin_batch(self):
+        self.ds.begin_batch()
+
+    def commit_batch(self):
+        self.ds.commit_batch()
+
+    def rollback_batch(self):
+        self.ds.rollback_batch()
+
     def get_settings(self, column=None):
         """Get the requested setting(s)
 
@@ -1330,6 +1435,14 @@ class CfGui:
             # Get the active account and requests its data
             self.update_graph()
 
+    def get_restart_profile(self):
+        return self.ds.get_restart_profile()
+
+    def profile_restart(self, filename):
+        """Run a profiled full rebuild of the ledger (see CfAnalysis.profile_restart())"""
+
+        return self.ds.profile_restart(int(self.get_settings('tracking_months')), filename)
+
     def update_bf_account_list(self):
         self.bf.update_account_list()
 
@@ -1342,8 +1455,20 @@ class CfGui:
     def init_storage(self):
         self.ds.init_storage()
 
-    def log(self, lvl, debug_str):
-        self.ds.log(lvl, debug_str, )
+    def log(self, lvl, debug_str, *args):
+        self.logger.log(lvl, debug_str, *args)
+
+    def set_debug_logging(self, enabled):
+        self.logger.set_debug(enabled)
+
+    def is_debug_logging(self):
+        return self.logger.is_debug()
+
+    def set_arg_checks(self, enabled):
+        self.ds.set_arg_checks(enabled)
+
+    def get_arg_checks(self):
+        return self.ds.check_args
 
     def get_tracking_end_date(self):
         return self.ds.get_end_date()
@@ -25,6 +25,7 @@ import sqlite3
 from shutil import copyfile
 # import utilities as util
 import data_file_constants as dfc
+from data_access import connect, create_indexes, create_ledger_cache
 
 
 def get_extended_version(major, minor):
@@ -49,6 +50,10 @@ def database_upgrade(filename, db_conn, cfa):
                                                int(db_version.split(".")[1]))
     if db_extended_version < get_extended_version(2, 1):
         upgrade_to_2_1(cfa, db_conn)
+    if db_extended_version < get_extended_version(2, 3):
+        upgrade_to_2_3(cfa, db_conn)
+    if db_extended_version < get_extended_version(2, 4):
+        upgrade_to_2_4(cfa, db_conn)
 
     old_db_conn.close()
 
@@ -59,6 +64,18 @@ def upgrade_to_2_1(cfa, db_conn):
     cfa.set_version(db_conn, 'base_version', dfc.SW_VERSION)
 
 
+def upgrade_to_2_3(cfa, db_conn):
+    """Add the indexes used for account lookups and cascades"""
+    create_indexes(db_conn)
+    cfa.set_version(db_conn, 'base_version', dfc.SW_VERSION)
+
+
+def upgrade_to_2_4(cfa, db_conn):
+    """Add the table that caches the computed ledger"""
+    create_ledger_cache(db_conn)
+    cfa.set_version(db_conn, 'base_version', dfc.SW_VERSION)
+
+
 def backup_db(filename, db_conn, old_version):
     # close the original db
     db_conn.close()
@@ -71,7 +88,7 @@ def backup_db(filename, db_conn, old_version):
     copyfile(filename, old_filename)
 
     # reopen the db
-    new_db_conn = sqlite3.connect(filename)
+    new_db_conn = connect(filename)
     old_db_conn = sqlite3.connect(old_filename)
 
     return old_db_conn, new_db_conn
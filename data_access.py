@@ -0,0 +1,288 @@
+#
+# Author: Greg Glezman
+#
+# Copyright (c) 2018-2022 G.Glezman.  All Rights Reserved.
+#
+# This file contains the data access layer used to read the cash flow
+# database.
+#
+# Developers Notes
+# 0. Every connection to a database file is opened with connect(). It sets
+#    the performance profile of the connection (see DB_PRAGMAS).
+# 1. The column names of each table are read once per connection and
+#    cached. They are used to build the records and to validate the table
+#    and column names used in a query. Table and column names can't be
+#    passed as SQL parameters so only known names are ever placed in a query.
+# 2. Values are always passed as SQL parameters, never formatted into the
+#    query text.
+# 3. Records are returned as dicts (column name -> value). Callers are free
+#    to modify them.
+# 4. query_count counts the queries issued. It is used to confirm the number
+#    of queries per restart doesn't grow with the number of accounts.
+# 5. load_snapshot() reads everything a restart needs in a single read
+#    transaction and returns it as a Snapshot. The records of a snapshot
+#    are read only so the same snapshot can be used for more than one run
+#    (eg a what-if run with Snapshot._replace(bonds=...)) without going
+#    back to the database.
+# 6. Queries are logged as DEBUG records (see cf.py Developers Notes 2f).
+# 7. check_snapshot() checks the types of the snapshot columns the ledger
+#    build uses as is (SNAPSHOT_COLUMN_TYPES), once per restart. The other
+#    numeric columns are converted with float() where they are used.
+# 8. The ledger_cache table holds the last computed ledger (see
+#    ledger.encode_ledger()) with a hash of everything it was computed from.
+#    It is derived data: it isn't dumped and can be dropped at any time.
+
+import logging
+import sqlite3
+from types import MappingProxyType
+from typing import NamedTuple, Tuple, Mapping
+
+import data_file_constants as dfc
+
+# Applied to every connection, in order
+DB_PRAGMAS = (
+    "PRAGMA journal_mode = WAL",  # readers don't block the writer
+    "PRAGMA synchronous = NORMAL",  # with WAL, only fsync on checkpoint
+    "PRAGMA cache_size = -16384",  # page cache in KiB (16 MB)
+    "PRAGMA mmap_size = 67108864",  # 64 MB
+    "PRAGMA foreign_keys = ON",
+)
+
+
+def connect(filename):
+    """Open a connection to the database file and apply DB_PRAGMAS"""
+
+    db_conn = sqlite3.connect(filename)
+    for pragma in DB_PRAGMAS:
+        db_conn.execute(pragma)
+
+    return db_conn
+
+
+def create_ledger_cache(db_conn):
+    """Create the ledger_cache table if it doesn't exist yet"""
+
+    db_conn.execute('''CREATE TABLE IF NOT EXISTS ledger_cache
+         (input_hash          TEXT PRIMARY KEY,
+         ledger               BLOB NOT NULL);''')
+
+
+def create_indexes(db_conn):
+    """Create any of the indexes in dfc.DB_INDEXES that don't exist yet"""
+
+    for name, table, column in dfc.DB_INDEXES:
+        db_conn.execute("CREATE INDEX IF NOT EXISTS {} ON {} ({})".format(name, table, column))
+
+
+# Snapshot columns used without conversion when the ledger is built
+SNAPSHOT_COLUMN_TYPES = {
+    'cash_accounts': (('account_rec_id', int), ('balance', float)),
+    'transfers': (('from_account_rec_id', int), ('to_account_rec_id', int),
+                  ('amount', float), ('inflation', float)),
+    'loans': (('account_rec_id', int),),
+    'cds': (('account_rec_id', int),),
+    'bonds': (('account_rec_id', int),),
+    'funds': (('account_rec_id', int), ('balance', float)),
+}
+
+
+def check_snapshot(snapshot):
+    """Raise TypeError if a column of SNAPSHOT_COLUMN_TYPES holds a value of
+    the wrong type. An int is accepted for a float.
+    """
+    for table, column_types in SNAPSHOT_COLUMN_TYPES.items():
+        for rec in getattr(snapshot, table):
+            for column, column_type in column_types:
+                value = rec[column]
+                if type(value) is column_type or (column_type is float and type(value) is int):
+                    continue
+                raise TypeError("check_snapshot(): {} rec_id {}: {} is {!r}".format(
+                    table, rec.get('rec_id'), column, value))
+
+
+class Snapshot(NamedTuple):
+    """Read only view of the tables used to build the ledger.
+
+    Each record is a read only mapping of column name to value. The cash
+    account records also carry the opening_date of their account.
+    """
+    cash_accounts: Tuple[Mapping, ...]
+    transfers: Tuple[Mapping, ...]
+    loans: Tuple[Mapping, ...]
+    cds: Tuple[Mapping, ...]
+    bonds: Tuple[Mapping, ...]
+    funds: Tuple[Mapping, ...]
+
+
+class DataAccess:
+    """Read access to the tables of the open database.
+
+    Args:
+        file_manager (FileManager): owner of the db connection
+
+        logger (Logger): logger of the app
+    """
+
+    def __init__(self, file_manager, logger):
+        self.fm = file_manager
+        self.logger = logger
+        self.query_count = 0
+        self._conn = None  # connection the schema cache belongs to
+        self._schemas = {}  # table -> tuple of column names
+
+    def is_open(self):
+        return self.fm is not None and self.fm.is_data_file_open()
+
+    def clear_schema_cache(self):
+        """Forget the cached table schemas (eg after the schema changed)"""
+
+        self._schemas.clear()
+
+    def columns(self, table):
+        """Return a tuple with the column names of the table, in column order.
+
+        An unknown table raises RuntimeError.
+        """
+        if self.fm.db_conn is not self._conn:
+            # a different database has been opened
+            self._conn = self.fm.db_conn
+            self._schemas.clear()
+
+        if table not in self._schemas:
+            cursor = self.execute("SELECT name FROM PRAGMA_TABLE_INFO(?)", (table,))
+            names = tuple(row[0] for row in cursor)
+            if not names:
+                raise RuntimeError("Failed DB Query: no such table: {}".format(table))
+            self._schemas[table] = names
+
+        return self._schemas[table]
+
+    def has_table(self, table):
+        try:
+            self.columns(table)
+        except RuntimeError:
+            return False
+        return True
+
+    def execute(self, query, params=()):
+        """Execute a parameterized query and return the cursor"""
+
+        if self.logger.is_enabled(logging.DEBUG):
+            # blobs (eg the ledger cache) are logged by size only
+            self.logger.log(logging.DEBUG, "%s %s", query,
+                            tuple("<{} bytes>".format(len(p)) if isinstance(p, bytes) else p for p in params))
+        self.query_count += 1
+
+        try:
+            return self.fm.db_conn.execute(query, params)
+        except Exception as e:
+            self.logger.log(logging.INFO, "Query failed: %s", e)
+            raise RuntimeError("Failed DB Query: {}".format(e))
+
+    def select(self, table, column=None, value=None):
+        """Return the rows of the table as a list of dicts.
+
+        If a column is specified, only the rows where 'column' matches
+        'value' are returned.
+        """
+        if not self.is_open():
+            self.logger.log(logging.INFO, "DB not open")
+            return []
+
+        names = self.columns(table)
+        if column:
+            if column not in names:
+                raise RuntimeError("Failed DB Query: no such column: {}.{}".format(table, column))
+            cursor = self.execute("SELECT * FROM {} WHERE {} = ?".format(table, column), (value,))
+        else:
+            cursor = self.execute("SELECT * FROM {}".format(table))
+
+        return [dict(zip(names, row)) for row in cursor]
+
+    def select_one_value(self, table, result_column, column, value):
+        """Return 'result_column' of the first row where 'column' matches
+        'value', or None if there is no such row.
+        """
+        names = self.columns(table)
+        if result_column not in names or column not in names:
+            raise RuntimeError("Failed DB Query: no such column in {}".format(table))
+
+        row = self.execute("SELECT {} FROM {} WHERE {} = ?".format(result_column, table, column),
+                           (value,)).fetchone()
+
+        return None if row is None else row[0]
+
+    def get_accounts_by_id(self, rec_ids=None):
+        """Return a dict mapping account rec_id to account record.
+
+        All accounts are fetched with a single query. If 'rec_ids' is given,
+        only those accounts are included.
+        """
+        accounts = {rec['rec_id']: rec for rec in self.select('account')}
+        if rec_ids is None:
+            return accounts
+
+        return {rec_id: accounts[rec_id] for rec_id in rec_ids if rec_id in accounts}
+
+    def load_snapshot(self):
+        """Read the tables used to build the ledger into a Snapshot.
+
+        All tables are read in one transaction so they are consistent with
+        each other. The cash accounts are joined with their account to
+        pick up the opening date.
+        """
+        if not self.is_open():
+            self.logger.log(logging.INFO, "DB not open")
+            return Snapshot((), (), (), (), (), ())
+
+        conn = self.fm.db_conn
+        own_transaction = not conn.in_transaction
+        if own_transaction:
+            self.execute("BEGIN")
+        try:
+            names = self.columns('ca') + ('opening_date',)
+            cursor = self.execute("SELECT ca.*, account.opening_date FROM ca "
+                                  "JOIN account ON ca.account_rec_id = account.rec_id "
+                                  "ORDER BY ca.rec_id")
+            cash_accounts = tuple(MappingProxyType(dict(zip(names, row))) for row in cursor)
+
+            tables = {}
+            for table in ('transfer', 'loan', 'cd', 'bond', 'fund'):
+                tables[table] = tuple(MappingProxyType(rec) for rec in self.select(table))
+        finally:
+            if own_transaction:
+                conn.commit()  # ends the read transaction
+
+        return Snapshot(cash_accounts=cash_accounts,
+                        transfers=tables['transfer'],
+                        loans=tables['loan'],
+                        cds=tables['cd'],
+                        bonds=tables['bond'],
+                        funds=tables['fund'])
+
+    def read_ledger_cache(self, input_hash):
+        """Return the cached ledger data for the input hash or None"""
+
+        if not self.has_table('ledger_cache'):
+            return None
+
+        row = self.execute("SELECT ledger FROM ledger_cache WHERE input_hash = ?",
+                           (input_hash,)).fetchone()
+
+        return None if row is None else row[0]
+
+    def write_ledger_cache(self, input_hash, data):
+        """Replace the cached ledger data"""
+
+        if not self.has_table('ledger_cache'):
+            return
+
+        conn = self.fm.db_conn
+        try:
+            self.execute("DELETE FROM ledger_cache")
+            self.execute("INSERT INTO ledger_cache (input_hash, ledger) VALUES (?, ?)",
+                         (input_hash, data))
+            conn.commit()
+        except RuntimeError:
+            conn.rollback()
+            raise
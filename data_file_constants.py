@@ -17,7 +17,7 @@ import platform
 # Some useful constants
 #################################
 # The following software version should be updated with every release
-SW_VERSION = "2.2"
+SW_VERSION = "2.4"
 SW_RELEASE_DATE = "01/20/22"
 
 HELP_FILE_NAME = "help.html"
@@ -60,6 +60,26 @@ INCOME_ACCOUNT_ID = 0
 EXPENSE_ACCOUNT_ID = 1
 FIRST_REAL_ACCOUNT = 2
 
+# Indexes on the columns used to look up and cascade by account.
+# (index name, table, column) - added to existing files in 2.3
+DB_INDEXES = (
+    ('idx_account_name', 'account', 'account_name'),
+    ('idx_ca_account_rec_id', 'ca', 'account_rec_id'),
+    ('idx_ca_account_name', 'ca', 'account_name'),
+    ('idx_bond_account_rec_id', 'bond', 'account_rec_id'),
+    ('idx_bond_account_name', 'bond', 'account_name'),
+    ('idx_cd_account_rec_id', 'cd', 'account_rec_id'),
+    ('idx_cd_account_name', 'cd', 'account_name'),
+    ('idx_fund_account_rec_id', 'fund', 'account_rec_id'),
+    ('idx_fund_account_name', 'fund', 'account_name'),
+    ('idx_loan_account_rec_id', 'loan', 'account_rec_id'),
+    ('idx_loan_account_name', 'loan', 'account_name'),
+    ('idx_transfer_from_account_rec_id', 'transfer', 'from_account_rec_id'),
+    ('idx_transfer_to_account_rec_id', 'transfer', 'to_account_rec_id'),
+    ('idx_transfer_from_account_name', 'transfer', 'from_account_name'),
+    ('idx_transfer_to_account_name', 'transfer', 'to_account_name'),
+)
+
 # ###################################################
 # Fieldnames for the data file
 # ###################################################
@@ -0,0 +1,175 @@
+#
+# Author: Greg Glezman
+#
+# Copyright (c) 2018-2022 G.Glezman.  All Rights Reserved.
+#
+# This file contains the day count conventions used to turn a period
+# between two dates into the fraction of a year of interest due.
+#
+# Developers Notes
+# 1. Each convention has a scalar function of two dates (date or datetime)
+#    used by the existing call sites, and a *_days() function of two
+#    arrays of day numbers (date.toordinal()) or NumPy datetime64 dates.
+#    Both do the same integer arithmetic followed by the same float
+#    operations, so the array results are identical to the scalar ones.
+# 2. If NumPy is not installed, the *_days() functions take sequences of
+#    day numbers and return a list.
+# 3. All conventions raise ValueError if date_2 precedes date_1.
+
+from datetime import date
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional
+    np = None
+
+_EPOCH_ORDINAL = 719163  # date(1970, 1, 1).toordinal(), day 0 of datetime64
+
+
+def thirty_360(date_1, date_2):
+    """Using the 30/360 approach, calculate an interest factor.
+
+    The resulting factor is the ratio of annual interest that should
+    be applied for the period specified by the two dates.
+
+    This is my best guess at what 30/360 used by Fidelity means.
+    First, every month is assumed to have 30 days and the year has 360.
+    When doing a calculation, first determine the number of whole
+    months - assume each has 30 has. Then figure the number of remaining
+    days. Add those together and divide by 360.
+
+
+        eg    5/1/2018 - 9/28/2018
+                 4 months * 30  = 120 days     (5,6,7,8)
+                 28 - 1         =  27 days     (in Sept)
+                                  ----
+                                  147 days
+
+               147/360 = % of yearly interest due
+
+        eg    5/28/2018 - 9/1/2018
+                 3 months       = 90 days
+                 2 + 1          =  3 days    5/29,5/30, 9/1)
+                                  ---
+                                  93 days
+                 93/360 = % of yearly interest due
+    """
+    if date_2 < date_1:
+        raise ValueError("date_2 must be >= date_1")
+
+    months = date_2.month - date_1.month + (12 * (date_2.year - date_1.year))
+    if date_1.day > date_2.day:
+        months -= 1
+        days = 30 - date_1.day + date_2.day
+    else:
+        days = date_2.day - date_1.day
+
+    total_days = (30 * months) + days
+    ratio = total_days / 360.0
+
+    return ratio
+
+
+def actual_365(date_1, date_2):
+    """Return the actual days from date_1 to date_2 over a 365 day year"""
+
+    if date_2 < date_1:
+        raise ValueError("date_2 must be >= date_1")
+
+    return (date_2 - date_1).days / 365
+
+
+def actual_actual(date_1, date_2):
+    """Return the actual days from date_1 to date_2 over the actual days
+    of each year (ISDA): the days falling in a leap year count 1/366.
+    """
+    if date_2 < date_1:
+        raise ValueError("date_2 must be >= date_1")
+
+    day_1 = date_1.toordinal()
+    day_2 = date_2.toordinal()
+    if date_1.year == date_2.year:
+        return (day_2 - day_1) / _days_in_year(date_1.year)
+
+    return ((date(date_1.year + 1, 1, 1).toordinal() - day_1) / _days_in_year(date_1.year) +
+            (date_2.year - date_1.year - 1) +
+            (day_2 - date(date_2.year, 1, 1).toordinal()) / _days_in_year(date_2.year))
+
+
+def _days_in_year(year):
+    return 366 if year % 4 == 0 and (year % 100 != 0 or year % 400 == 0) else 365
+
+
+def thirty_360_days(days_1, days_2):
+    """Return thirty_360() of each pair of day numbers (see Developers Notes)"""
+
+    if np is None:
+        return _scalar(thirty_360, days_1, days_2)
+
+    dt_1, dt_2 = _datetime64(days_1, days_2)
+    month_1 = dt_1.astype('datetime64[M]')
+    month_2 = dt_2.astype('datetime64[M]')
+    day_1 = (dt_1 - month_1).astype(np.int64)  # day of month - 1
+    day_2 = (dt_2 - month_2).astype(np.int64)
+
+    later_day = day_1 > day_2
+    months = (month_2 - month_1).astype(np.int64) - later_day
+    days = np.where(later_day, 30 - day_1 + day_2, day_2 - day_1)
+
+    return (30 * months + days) / 360.0
+
+
+def actual_365_days(days_1, days_2):
+    """Return actual_365() of each pair of day numbers (see Developers Notes)"""
+
+    if np is None:
+        return _scalar(actual_365, days_1, days_2)
+
+    dt_1, dt_2 = _datetime64(days_1, days_2)
+
+    return (dt_2 - dt_1).astype(np.int64) / 365
+
+
+def actual_actual_days(days_1, days_2):
+    """Return actual_actual() of each pair of day numbers (see Developers Notes)"""
+
+    if np is None:
+        return _scalar(actual_actual, days_1, days_2)
+
+    dt_1, dt_2 = _datetime64(days_1, days_2)
+    year_1 = dt_1.astype('datetime64[Y]')
+    year_2 = dt_2.astype('datetime64[Y]')
+    next_year_1 = year_1 + 1
+    year_days_1 = (next_year_1.astype('datetime64[D]') -
+                   year_1.astype('datetime64[D]')).astype(np.int64)
+    year_days_2 = ((year_2 + 1).astype('datetime64[D]') -
+                   year_2.astype('datetime64[D]')).astype(np.int64)
+
+    same_year = (dt_2 - dt_1).astype(np.int64) / year_days_1
+    across_years = ((next_year_1.astype('datetime64[D]') - dt_1).astype(np.int64) / year_days_1 +
+                    ((year_2 - year_1).astype(np.int64) - 1) +
+                    (dt_2 - year_2.astype('datetime64[D]')).astype(np.int64) / year_days_2)
+
+    return np.where(year_1 == year_2, same_year, across_years)
+
+
+def _datetime64(days_1, days_2):
+    """Return the day numbers or dates as datetime64[D] arrays, raising
+    ValueError if any of days_2 precedes its days_1.
+    """
+    dates = []
+    for days in (days_1, days_2):
+        days = np.asarray(days)
+        if days.dtype.kind != 'M':
+            days = (days.astype(np.int64) - _EPOCH_ORDINAL).astype('datetime64[D]')
+        dates.append(days.astype('datetime64[D]'))
+
+    if np.any(dates[1] < dates[0]):
+        raise ValueError("date_2 must be >= date_1")
+
+    return dates
+
+
+def _scalar(convention, days_1, days_2):
+    return [convention(date.fromordinal(day_1), date.fromordinal(day_2))
+            for day_1, day_2 in zip(days_1, days_2)]
@@ -0,0 +1,296 @@
+#
+# Author: Greg Glezman
+#
+# Copyright (c) 2018-2022 G.Glezman.  All Rights Reserved.
+#
+# This file contains the dump and restore of a cash flow database.
+#
+# Developers Notes
+# 1. Rows are streamed from the database in chunks of CHUNK_SIZE rows
+#    (cursor.fetchmany()) so a dump runs in constant memory no matter how
+#    large the database is. A restore reads and inserts in chunks too.
+# 2. The dump formats are
+#       txt      - one line per column, for people. It can't be restored.
+#       csv      - each table starts with a header row
+#                        #table, <table name>, <column>, <column>...
+#                  followed by a row per record. NULL is written as \N
+#       jsonl    - each table starts with the header line
+#                        {"table": <table name>, "columns": [<column>,...]}
+#                  followed by a JSON list per record.
+#       snapshot - compact binary. A gzip stream of length prefixed marshal
+#                  blocks: (table name, columns) for each table followed
+#                  by lists of row tuples. Fast, but only meant to be read
+#                  back by this app (marshal is Python specific).
+# 3. A restore goes into a database freshly created by create_db(). The
+#    rows of each table in the dump replace the rows of the same table
+#    (including the pseudo accounts) so rec_ids are preserved. The
+#    version_info table is not restored, the new database keeps its own.
+# 4. Derived tables (DERIVED_TABLES) are neither dumped nor restored.
+
+import csv
+import gzip
+import json
+import marshal
+import struct
+
+CHUNK_SIZE = 1000
+
+FORMATS = ('txt', 'csv', 'jsonl', 'snapshot')
+
+CSV_TABLE_MARK = "#table"
+CSV_NULL = "\\N"
+
+SNAPSHOT_MAGIC = b"CFSNAP1\n"
+_BLOCK_LEN = struct.Struct("<I")
+
+# Tables that are never restored from a dump
+SKIPPED_TABLES = ('version_info',)
+
+# Derived data, not dumped (see data_access.py)
+DERIVED_TABLES = ('ledger_cache',)
+
+
+def format_from_filename(filename):
+    """Return the dump format implied by the file extension ('txt' by default)"""
+
+    ext = filename.rsplit(".", 1)[-1].lower() if "." in filename else ""
+    if ext in ('csv', 'jsonl'):
+        return ext
+    if ext in ('snap', 'snapshot'):
+        return 'snapshot'
+    return 'txt'
+
+
+def get_tables(db_conn):
+    """Return the names of the user tables of the database, less the derived ones"""
+
+    cursor = db_conn.execute("SELECT name FROM sqlite_master WHERE type='table' ORDER BY rowid")
+    return [row[0] for row in cursor
+            if not row[0].startswith("sqlite_") and row[0] not in DERIVED_TABLES]
+
+
+def iter_table(db_conn, table, chunk_size=CHUNK_SIZE):
+    """Yield (columns, rows) for each chunk of rows of the table.
+
+    The first chunk is yielded even if the table is empty.
+    """
+    cursor = db_conn.execute("SELECT * FROM \"{}\"".format(table))
+    columns = [d[0] for d in cursor.description]
+
+    rows = cursor.fetchmany(chunk_size)
+    yield columns, rows
+    while rows:
+        rows = cursor.fetchmany(chunk_size)
+        if rows:
+            yield columns, rows
+
+
+def dump(db_conn, filename, fmt=None, chunk_size=CHUNK_SIZE):
+    """Dump every table of the database to 'filename'.
+
+    If fmt is None, the format is taken from the file extension.
+    Return the number of rows written.
+    """
+    fmt = fmt or format_from_filename(filename)
+    if fmt not in FORMATS:
+        raise ValueError("Unknown dump format: {}".format(fmt))
+
+    if fmt == 'snapshot':
+        with gzip.open(filename, 'wb', compresslevel=1) as file_obj:
+            file_obj.write(SNAPSHOT_MAGIC)
+            return _dump_tables(db_conn, _SnapshotWriter(file_obj), chunk_size)
+
+    with open(filename, 'w', newline='', encoding='utf-8') as file_obj:
+        if fmt == 'csv':
+            writer = _CsvWriter(file_obj)
+        elif fmt == 'jsonl':
+            writer = _JsonlWriter(file_obj)
+        else:
+            writer = _TextWriter(file_obj)
+        return _dump_tables(db_conn, writer, chunk_size)
+
+
+def _dump_tables(db_conn, writer, chunk_size):
+    count = 0
+    for table in get_tables(db_conn):
+        for i, (columns, rows) in enumerate(iter_table(db_conn, table, chunk_size)):
+            if i == 0:
+                writer.table(table, columns)
+            writer.rows(rows)
+            count += len(rows)
+
+    return count
+
+
+class _TextWriter:
+    def __init__(self, file_obj):
+        self.file_obj = file_obj
+        self.columns = None
+
+    def table(self, table, columns):
+        self.columns = columns
+        self.file_obj.write("******************\n")
+        self.file_obj.write("Table: {}\n".format(table))
+        self.file_obj.write("******************\n")
+
+    def rows(self, rows):
+        lines = []
+        for row in rows:
+            for column_name, value in zip(self.columns, row):
+                lines.append("{:20}: {}\n".format(column_name, value))
+            lines.append("\n")
+        self.file_obj.writelines(lines)
+
+
+class _CsvWriter:
+    def __init__(self, file_obj):
+        self.writer = csv.writer(file_obj)
+
+    def table(self, table, columns):
+        self.writer.writerow([CSV_TABLE_MARK, table] + list(columns))
+
+    def rows(self, rows):
+        self.writer.writerows([CSV_NULL if v is None else v for v in row] for row in rows)
+
+
+class _JsonlWriter:
+    def __init__(self, file_obj):
+        self.file_obj = file_obj
+
+    def table(self, table, columns):
+        self.file_obj.write(json.dumps({'table': table, 'columns': list(columns)}) + "\n")
+
+    def rows(self, rows):
+        self.file_obj.writelines(json.dumps(list(row)) + "\n" for row in rows)
+
+
+class _SnapshotWriter:
+    def __init__(self, file_obj):
+        self.file_obj = file_obj
+
+    def _write(self, obj):
+        data = marshal.dumps(obj)
+        self.file_obj.write(_BLOCK_LEN.pack(len(data)))
+        self.file_obj.write(data)
+
+    def table(self, table, columns):
+        self._write((table, tuple(columns)))
+
+    def rows(self, rows):
+        if rows:
+            self._write(rows)
+
+
+def read_dump(filename, fmt=None, chunk_size=CHUNK_SIZE):
+    """Yield (table, columns, rows) for each chunk of rows in the dump"""
+
+    fmt = fmt or format_from_filename(filename)
+    if fmt == 'csv':
+        return _read_csv(filename, chunk_size)
+    if fmt == 'jsonl':
+        return _read_jsonl(filename, chunk_size)
+    if fmt == 'snapshot':
+        return _read_snapshot(filename)
+
+    raise ValueError("A {} dump can't be restored".format(fmt))
+
+
+def _read_chunks(records, chunk_size):
+    """Group a stream of ('table', name, columns) / ('row', row) records
+    into (table, columns, rows) chunks.
+    """
+    table = columns = None
+    rows = []
+    for record in records:
+        if record[0] == 'table':
+            if table is not None:
+                yield table, columns, rows
+            table, columns = record[1], record[2]
+            rows = []
+        else:
+            rows.append(record[1])
+            if len(rows) >= chunk_size:
+                yield table, columns, rows
+                rows = []
+    if table is not None:
+        yield table, columns, rows
+
+
+def _read_csv(filename, chunk_size):
+    def records():
+        with open(filename, 'r', newline='', encoding='utf-8') as file_obj:
+            for row in csv.reader(file_obj):
+                if row and row[0] == CSV_TABLE_MARK:
+                    yield 'table', row[1], row[2:]
+                elif row:
+                    yield 'row', [None if v == CSV_NULL else v for v in row]
+
+    return _read_chunks(records(), chunk_size)
+
+
+def _read_jsonl(filename, chunk_size):
+    def records():
+        with open(filename, 'r', encoding='utf-8') as file_obj:
+            for line in file_obj:
+                obj = json.loads(line)
+                if isinstance(obj, dict):
+                    yield 'table', obj['table'], obj['columns']
+                else:
+                    yield 'row', obj
+
+    return _read_chunks(records(), chunk_size)
+
+
+def _read_snapshot(filename):
+    with gzip.open(filename, 'rb') as file_obj:
+        if file_obj.read(len(SNAPSHOT_MAGIC)) != SNAPSHOT_MAGIC:
+            raise ValueError("Not a snapshot file: {}".format(filename))
+
+        table = columns = None
+        while True:
+            header = file_obj.read(_BLOCK_LEN.size)
+            if not header:
+                break
+            block = marshal.loads(file_obj.read(_BLOCK_LEN.unpack(header)[0]))
+            if isinstance(block, tuple):
+                # a new table
+                table, columns = block[0], list(block[1])
+                yield table, columns, []
+            else:
+                yield table, columns, block
+
+
+def restore(db_conn, filename, fmt=None, chunk_size=CHUNK_SIZE):
+    """Load a dump into a database freshly created by create_db().
+
+    The whole restore is one transaction. Return the number of rows restored.
+    """
+    tables = set(get_tables(db_conn))
+
+    # The dump holds complete tables, the order of the tables doesn't
+    # follow the foreign keys.
+    db_conn.execute("PRAGMA foreign_keys = OFF")
+    count = 0
+    cleared = set()
+    try:
+        for table, columns, rows in read_dump(filename, fmt, chunk_size):
+            if table in SKIPPED_TABLES:
+                continue
+            if table not in tables:
+                raise ValueError("Unknown table in dump: {}".format(table))
+            if table not in cleared:
+                db_conn.execute("DELETE FROM \"{}\"".format(table))
+                cleared.add(table)
+            if rows:
+                insert = "INSERT INTO \"{}\" ({}) VALUES ({})".format(
+                    table, ",".join("\"{}\"".format(c) for c in columns), ",".join("?" * len(columns)))
+                db_conn.executemany(insert, rows)
+                count += len(rows)
+        db_conn.commit()
+    except Exception:
+        db_conn.rollback()
+        raise
+    finally:
+        db_conn.execute("PRAGMA foreign_keys = ON")
+
+    return count
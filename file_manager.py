@@ -8,19 +8,19 @@
 # This file contains classes that are used by the cash flow python script
 # to manage files.
 #
+# The tkinter dialogs are imported by the methods that use them so the
+# file manager can be used without a display (see cf.py --db). db_export
+# is imported the same way, it is only needed by a dump or restore.
+#
 
-import sqlite3
-from tkinter.filedialog import asksaveasfilename
-from tkinter.filedialog import askopenfilename
-from tkinter import messagebox
 import logging
-import csv
 from typing import Dict, Union
 
 import utilities as util
 from occurrences import Occurrences
 import data_file_constants as dfc
 from cf_upgrade import database_upgrade
+from data_access import connect, create_indexes, create_ledger_cache
 
 
 class FileManager:
@@ -38,30 +38,39 @@ class FileManager:
         self.cfa = cfa
 
     def open_database_file(self):
+        from tkinter.filedialog import askopenfilename
+
         filename = askopenfilename(
                 filetypes=(("Database File", "*.db"), ("Data File", "*.dat"), ("All Files", "*.*")),
                 title="Open a Data File")
         if filename:
-            self.data_filename = filename
-            # todo - what id you attempt to open a garbage file
-            self.db_conn = sqlite3.connect(filename)
-            # Upgrade the datanase if necessary
-            self.db_conn = database_upgrade(filename, self.db_conn, self.cfa)
+            self.open_database(filename)
         else:
             # todo - what if no filename is specified
             pass
 
         return filename
 
+    def open_database(self, filename):
+        """Open the given database file, upgrading it if necessary"""
+
+        self.data_filename = filename
+        # todo - what id you attempt to open a garbage file
+        self.db_conn = connect(filename)
+        # Upgrade the datanase if necessary
+        self.db_conn = database_upgrade(filename, self.db_conn, self.cfa)
+
     def new_data_file(self):
         """Query the user for the name of the database and create it"""
+        from tkinter.filedialog import asksaveasfilename
+
         filename = asksaveasfilename(
                 filetypes=(("Database File", "*.db"), ("All Files", "*.*")),
                 title="Create a New Database File",
                 defaultextension=".db")
         if filename:
             self.data_filename = filename
-            self.logger.log(logging.INFO, "{}: {}".format(util.f_name(), filename))
+            self.logger.log(logging.INFO, "%s: %s", util.f_name(), filename)
             self.create_db(filename)
         return filename
 
@@ -77,10 +86,8 @@ class FileManager:
         Note that this function defines the schema for the current version
         of this application. It also adds the version number table to the DB
         """
-        self.db_conn = sqlite3.connect(filename)
-
-        # The following is required for foreign key constraints to work
-        self.db_conn.execute("PRAGMA foreign_keys = 1")
+        # connect() also turns on foreign key constraints
+        self.db_conn = connect(filename)
 
         self.db_conn.execute('''CREATE TABLE version_info
             (base_version        TEXT NOT NULL);''')
@@ -183,6 +190,9 @@ class FileManager:
             graph_type           TEXT
             );''')
 
+        create_ledger_cache(self.db_conn)
+        create_indexes(self.db_conn)
+
         self.db_conn.execute("INSERT INTO version_info (base_version) VALUES('2.00')")
 
         self.db_conn.execute("INSERT INTO setting (tracking_months," +
@@ -317,43 +327,62 @@ class FileManager:
     def dump_db(self):
         """ Dump the content of the database to a file.
 
-        We'll ask the user for a file name
+        We'll ask the user for a file name. The file extension selects the
+        format (see db_export.py). Only the text format can't be restored.
         """
+        from tkinter.filedialog import asksaveasfilename
+        from tkinter import messagebox
+        import db_export
+
+        if not self.is_data_file_open():
+            messagebox.showerror("Dump Database", "There is no database open")
+            return
+
         filename = asksaveasfilename(
-            filetypes=(("Text File", "*.txt"), ("All Files", "*.*")),
+            filetypes=(("Text File", "*.txt"), ("CSV File", "*.csv"), ("JSON Lines File", "*.jsonl"),
+                       ("Snapshot File", "*.snap"), ("All Files", "*.*")),
             title="Save the Database",
             defaultextension=".txt")
         if filename:
-            with open(filename, 'w', newline='') as text_file:
-                # ######################################################
-                # Get a list of tables in the DB
-                # ######################################################
-                cursor = self.db_conn.execute("SELECT name FROM sqlite_master WHERE type='table';")
-                tables = [
-                    v[0] for v in cursor.fetchall()
-                    if v[0] != "sqlite_sequence"
-                ]
-
-                for table in tables:
-                    text_file.write("******************\n")
-                    text_file.write("Table: {}\n".format(table))
-                    text_file.write("******************\n")
-                    # ######################################################
-                    # Get the column names in the table
-                    # ######################################################
-                    column_names = []
-                    cursor = self.db_conn.execute("SELECT * FROM PRAGMA_TABLE_INFO(\'{}\');".format(table))
-                    for row in cursor:
-                        column_names.append(row[1])
-
-                    # ######################################################
-                    # Get the data and display it
-                    # ######################################################
-                    cursor = self.db_conn.execute("SELECT * FROM \'{}\';".format(table))
-                    for row in cursor:
-                        for i, column_name in enumerate(column_names):
-                            text_file.write("{:20}: {}\n".format(column_name, row[i]))
-                        text_file.write("\n")
+            count = db_export.dump(self.db_conn, filename)
+            self.logger.log(logging.INFO, "%s: %s rows to %s", util.f_name(), count, filename)
+
+    def restore_db(self):
+        """Create a new database from a dump file.
+
+        We'll ask the user for the dump file and the name of the new database.
+        Return the filename of the new database or "" if there is none.
+        """
+        from tkinter.filedialog import askopenfilename, asksaveasfilename
+        from tkinter import messagebox
+        import db_export
+
+        dump_filename = askopenfilename(
+            filetypes=(("Database Dump", "*.csv *.jsonl *.snap"), ("All Files", "*.*")),
+            title="Open a Database Dump")
+        if not dump_filename:
+            return ""
+
+        filename = asksaveasfilename(
+            filetypes=(("Database File", "*.db"), ("All Files", "*.*")),
+            title="Create the Restored Database File",
+            defaultextension=".db")
+        if not filename:
+            return ""
+
+        self.data_filename = filename
+        self.create_db(filename)
+        try:
+            count = db_export.restore(self.db_conn, dump_filename)
+        except Exception as e:
+            self.db_conn.close()
+            self.db_conn = None
+            self.data_filename = ""
+            messagebox.showerror("Restore Database", "Restore failed: {}".format(e))
+            return ""
+        self.logger.log(logging.INFO, "%s: %s rows from %s", util.f_name(), count, dump_filename)
+
+        return filename
 
     #################################################################
     # todo - For the following, I think I can write one function that takes
@@ -361,6 +390,7 @@ class FileManager:
     # These functions are for handling files downloaded from brokerage sites
     def open_bond_list(self, read_callback):
         """Open a csv file to read in bond information"""
+        from tkinter.filedialog import askopenfilename
 
         filename = askopenfilename(
                 filetypes=(("Text File", "*.csv"), ("All Files", "*.*")),
@@ -372,6 +402,7 @@ class FileManager:
 
     def open_account_import(self, read_callback, account_id):
         """Open a csv file to read in Account information"""
+        from tkinter.filedialog import askopenfilename
 
         filename = askopenfilename(
                 filetypes=(("Text File", "*.csv"), ("All Files", "*.*")),
@@ -0,0 +1,104 @@
+#
+# Author: Greg Glezman
+#
+# Copyright (c) 2018-2022 G.Glezman.  All Rights Reserved.
+#
+# This file contains a timer for the module imports made at start up.
+#
+# Developers Notes
+# 1. ImportTimer is a meta path finder. While installed it is first on
+#    sys.meta_path: it asks the other finders for the spec of each module
+#    imported for the first time and wraps the loader so exec_module() is
+#    timed. The real loader is put back on the spec before the module runs.
+# 2. The report follows the layout of 'python -X importtime': the time
+#    spent in the module itself, the time including the modules it imported
+#    and the module name, indented by import depth.
+# 3. Modules already in sys.modules cost nothing and are not reported.
+
+import sys
+import time
+
+
+class _TimedLoader:
+    """Stand in for a loader that times exec_module()"""
+
+    def __init__(self, timer, loader):
+        self._timer = timer
+        self._loader = loader
+
+    def __getattr__(self, name):
+        return getattr(self._loader, name)
+
+    def create_module(self, spec):
+        return self._loader.create_module(spec)
+
+    def exec_module(self, module):
+        spec = module.__spec__
+        spec.loader = self._loader
+        module.__loader__ = self._loader
+        self._timer.exec_module(spec.name, self._loader, module)
+
+
+class ImportTimer:
+    """Time the imports made between install() and uninstall().
+
+    Also usable as a context manager.
+    """
+
+    def __init__(self):
+        self.records = []  # (depth, name, self seconds, cumulative seconds)
+        self._nested = [0.0]  # time spent in nested imports, per depth
+
+    def __enter__(self):
+        self.install()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.uninstall()
+
+    def install(self):
+        if self not in sys.meta_path:
+            sys.meta_path.insert(0, self)
+
+    def uninstall(self):
+        if self in sys.meta_path:
+            sys.meta_path.remove(self)
+
+    def find_spec(self, name, path, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, 'find_spec'):
+                continue
+            spec = finder.find_spec(name, path, target)
+            if spec is not None:
+                if spec.loader is not None and hasattr(spec.loader, 'exec_module'):
+                    spec.loader = _TimedLoader(self, spec.loader)
+                return spec
+
+        return None
+
+    def exec_module(self, name, loader, module):
+        depth = len(self._nested) - 1
+        self._nested.append(0.0)
+        start = time.perf_counter()
+        try:
+            loader.exec_module(module)
+        finally:
+            cumulative = time.perf_counter() - start
+            nested = self._nested.pop()
+            self._nested[-1] += cumulative
+            self.records.append((depth, name, cumulative - nested, cumulative))
+
+    def total(self):
+        """Return the time spent in the top level imports, in seconds"""
+
+        return sum(record[3] for record in self.records if record[0] == 0)
+
+    def report(self):
+        """Return the report as a list of lines (see Developers Notes)"""
+
+        lines = ["import time: self [us] | cumulative | imported package"]
+        for depth, name, self_time, cumulative in self.records:
+            lines.append("import time: {:>9} | {:>10} | {}{}".format(
+                int(self_time * 1e6), int(cumulative * 1e6), "  " * depth, name))
+
+        return lines
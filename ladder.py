@@ -0,0 +1,247 @@
+#
+# Author: Greg Glezman
+#
+# Copyright (c) 2018-2022 G.Glezman.  All Rights Reserved.
+#
+# This file contains the ladder report of the bonds and CDs of a portfolio:
+# what they pay in each maturity bucket, and their duration and convexity,
+# per account and for the whole portfolio.
+#
+# Developers Notes
+# 1. The report covers the cash flows paid after the as of date, taken from
+#    CfAnalysis.bond_cash_flow() (see bond_schedule.py) and
+#    CfAnalysis.cd_cash_flow(). Calls, sales at maturity and CD sales are
+#    principal; coupons and CD interest are interest. A flow falls in the
+#    bucket of its date: bucket b holds the flows paid b to b + 1 bucket
+#    lengths after the as of date, the last bucket also holds any later flow.
+# 2. Each position is discounted at its own yield y, compounded f times a
+#    year (f of the coupons): a flow c at t years (30/360) is worth
+#    PV = c (1 + y/f)^-ft. For a position
+#       Macaulay duration  D = sum(t PV) / sum(PV)
+#       modified duration    = D / (1 + y/f)
+#       convexity            = sum(c t (t + 1/f) (1 + y/f)^-(ft + 2)) / sum(PV)
+#    The figures of an account and of the portfolio are the averages of
+#    their positions weighted by present value.
+# 3. If NumPy is installed the terms of all the flows are computed on arrays
+#    and summed by position and by account and bucket with bincount(), in
+#    one pass over the flows.
+
+from typing import NamedTuple, Tuple
+
+from bond_schedule import FREQUENCIES, INTEREST, CALL
+from day_count import thirty_360_days
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional
+    np = None
+
+PORTFOLIO = "Portfolio"
+
+
+class LadderLine(NamedTuple):
+    """The figures of an account, or of the whole portfolio"""
+    account: str
+    positions: int
+    value: float  # present value of the flows
+    macaulay: float  # years
+    modified: float  # years
+    convexity: float
+    principal: Tuple[float, ...]  # paid in each bucket
+    interest: Tuple[float, ...]
+
+
+class LadderReport:
+    """The ladder of the accounts holding bonds or CDs (see Developers Notes)
+
+    Args:
+        as_of (datetime): flows after this date are covered
+        bucket_years (int): length of a bucket in years
+        lines (list): LadderLine of each account, by account name
+        total (LadderLine): LadderLine of the portfolio
+    """
+
+    def __init__(self, as_of, bucket_years, lines, total):
+        self.as_of = as_of
+        self.bucket_years = bucket_years
+        self.lines = lines
+        self.total = total
+
+    def bucket_labels(self):
+        """Return the label of each bucket, eg '0-1y' ... '9y+'"""
+
+        count = len(self.total.principal)
+        step = self.bucket_years
+        return ["{}-{}y".format(b * step, (b + 1) * step) for b in range(count - 1)] + \
+               ["{}y+".format((count - 1) * step)]
+
+    def report(self):
+        """Return the report as a list of lines"""
+
+        labels = self.bucket_labels()
+        lines = ["Bond and CD ladder as of {}".format(self.as_of.strftime("%Y-%m-%d")),
+                 "{:20} {:>5} {:>14} {:>9} {:>9} {:>9}".format(
+                     "Account", "Pos", "Value", "Macaulay", "Modified", "Convexity")]
+        for line in self.lines + [self.total]:
+            lines.append("{:20} {:>5} {:>14,.2f} {:>9.3f} {:>9.3f} {:>9.3f}".format(
+                line.account, line.positions, line.value, line.macaulay, line.modified,
+                line.convexity))
+
+        for title, field in (("Principal", 'principal'), ("Interest", 'interest')):
+            lines.append("")
+            lines.append("{:20} ".format(title) + " ".join("{:>12}".format(label) for label in labels))
+            for line in self.lines + [self.total]:
+                lines.append("{:20} ".format(line.account) +
+                             " ".join("{:>12,.2f}".format(amount) for amount in getattr(line, field)))
+
+        return lines
+
+
+def ladder_report(as_of, bonds, schedule, bond_yields, cds, cd_flows, bucket_years=1, buckets=10):
+    """Return the LadderReport of the flows paid after 'as_of'.
+
+    'schedule' is the BondSchedule of 'bonds' and 'bond_yields' holds the
+    yield of each bond in percent. 'cd_flows' holds the cd_cash_flow() of
+    each of 'cds', None for a CD without one.
+    """
+    positions = list(bonds) + list(cds)
+    accounts = sorted({entry['account_name'] for entry in positions})
+    account_index = {name: index for index, name in enumerate(accounts)}
+    position_account = [account_index[entry['account_name']] for entry in positions]
+    rates = [rate / 100 for rate in bond_yields] + \
+            [0.0 if flows is None else float(cd['rate']) / 100 for cd, flows in zip(cds, cd_flows)]
+    factors = [FREQUENCIES.get(entry['frequency'], (12, 1))[1] for entry in positions]
+
+    as_of_day = as_of.toordinal()
+    position, day, amount, principal = _flows(as_of_day, schedule, len(bonds), cd_flows)
+    pv, time_pv, convexity_pv, bucket, account = _terms(
+        as_of_day, position, day, amount, rates, factors, position_account, bucket_years, buckets)
+
+    # per position
+    count = len(positions)
+    flow_counts = _sum_by(position, [1] * len(position), count)
+    values = _sum_by(position, pv, count)
+    macaulay = _sum_by(position, time_pv, count)
+    convexity = _sum_by(position, convexity_pv, count)
+    # (value, macaulay, modified, convexity) of the positions with flows, by account
+    terms = [[] for _ in accounts]
+    for index in range(count):
+        if flow_counts[index] and values[index]:
+            mac = macaulay[index] / values[index]
+            terms[position_account[index]].append((values[index], mac,
+                                                   mac / (1 + rates[index] / factors[index]),
+                                                   convexity[index] / values[index]))
+
+    # per account and bucket
+    keys = [a * buckets + b for a, b in zip(account, bucket)] if np is None else \
+        account * buckets + bucket
+    principal_amounts = _sum_by(keys, _select(amount, principal, True), len(accounts) * buckets)
+    interest_amounts = _sum_by(keys, _select(amount, principal, False), len(accounts) * buckets)
+
+    lines = []
+    for index, name in enumerate(accounts):
+        lines.append(_line(name, terms[index],
+                           principal_amounts[index * buckets:(index + 1) * buckets],
+                           interest_amounts[index * buckets:(index + 1) * buckets]))
+    total = _line(PORTFOLIO, [t for account_terms in terms for t in account_terms],
+                  [sum(line.principal[b] for line in lines) for b in range(buckets)],
+                  [sum(line.interest[b] for line in lines) for b in range(buckets)])
+
+    return LadderReport(as_of, bucket_years, lines, total)
+
+
+def _flows(as_of_day, schedule, first_cd, cd_flows):
+    """Return the position, day number, amount and principal flag of each
+    flow paid after 'as_of_day'. The CDs are positions first_cd on.
+    """
+    cd_rows = [(first_cd + index, record['date'].toordinal(), record['amount'],
+                record['note'] == "CD Sale")
+               for index, flows in enumerate(cd_flows) if flows is not None
+               for record in flows
+               if record['note'] != "CD purchase" and record['date'].toordinal() > as_of_day]
+
+    if np is None:
+        bond_rows = [(index, day, amount, kind >= CALL)
+                     for index, day, amount, kind in zip(schedule.bond, schedule.date,
+                                                         schedule.amount, schedule.kind)
+                     if kind >= INTEREST and day > as_of_day]
+        return tuple(map(list, zip(*(bond_rows + cd_rows)))) if bond_rows or cd_rows else \
+            ([], [], [], [])
+
+    kind = np.asarray(schedule.kind, dtype=np.int64)
+    keep = (kind >= INTEREST) & (np.asarray(schedule.date, dtype=np.int64) > as_of_day)
+    columns = [np.asarray(schedule.bond, dtype=np.int64)[keep],
+               np.asarray(schedule.date, dtype=np.int64)[keep],
+               np.asarray(schedule.amount, dtype=float)[keep],
+               kind[keep] >= CALL]
+    if cd_rows:
+        cd_columns = list(zip(*cd_rows))
+        columns = [np.concatenate((column, np.asarray(cd_column, dtype=column.dtype)))
+                   for column, cd_column in zip(columns, cd_columns)]
+
+    return tuple(columns)
+
+
+def _terms(as_of_day, position, day, amount, rates, factors, position_account,
+           bucket_years, buckets):
+    """Return the present value, time weighted present value, convexity
+    term, bucket and account of each flow (see Developers Notes)
+    """
+    times = thirty_360_days([as_of_day] * len(day) if np is None else
+                            np.full(len(day), as_of_day), day)
+
+    if np is None:
+        pv, time_pv, convexity_pv, bucket, account = [], [], [], [], []
+        for index, t, c in zip(position, times, amount):
+            f = factors[index]
+            base = 1 + rates[index] / f
+            pv.append(c * base ** (-f * t))
+            time_pv.append(t * pv[-1])
+            convexity_pv.append(c * t * (t + 1 / f) * base ** -(f * t + 2))
+            bucket.append(min(int(t // bucket_years), buckets - 1))
+            account.append(position_account[index])
+        return pv, time_pv, convexity_pv, bucket, account
+
+    factor = np.asarray(factors, dtype=float)[position]
+    base = 1 + np.asarray(rates, dtype=float)[position] / factor
+    pv = amount * base ** (-factor * times)
+    bucket = np.minimum(times // bucket_years, buckets - 1).astype(np.int64)
+
+    return (pv, times * pv, amount * times * (times + 1 / factor) * base ** -(factor * times + 2),
+            bucket, np.asarray(position_account, dtype=np.int64)[position])
+
+
+def _select(amount, principal, wanted):
+    """Return 'amount' where 'principal' is 'wanted', else 0"""
+
+    if np is None:
+        return [a if p == wanted else 0.0 for a, p in zip(amount, principal)]
+
+    return np.where(principal == wanted, amount, 0.0)
+
+
+def _sum_by(keys, values, size):
+    """Return a list with the sum of 'values' for each key from 0 to size - 1"""
+
+    if np is not None:
+        return np.bincount(np.asarray(keys, dtype=np.int64), weights=np.asarray(values, dtype=float),
+                           minlength=size).tolist()
+
+    sums = [0.0] * size
+    for key, value in zip(keys, values):
+        sums[key] += value
+    return sums
+
+
+def _line(name, terms, principal, interest):
+    """Return the LadderLine of the positions 'terms' (see ladder_report())"""
+
+    value = sum(t[0] for t in terms)
+    if not value:
+        return LadderLine(name, len(terms), 0.0, 0.0, 0.0, 0.0, tuple(principal), tuple(interest))
+
+    return LadderLine(name, len(terms), value,
+                      sum(t[0] * t[1] for t in terms) / value,
+                      sum(t[0] * t[2] for t in terms) / value,
+                      sum(t[0] * t[3] for t in terms) / value,
+                      tuple(principal), tuple(interest))
@@ -0,0 +1,85 @@
+#
+# Author: Greg Glezman
+#
+# Copyright (c) 2018-2022 G.Glezman.  All Rights Reserved.
+#
+# This file contains the window that shows the bond and CD ladder of the
+# portfolio (see ladder.py).
+
+# Keep the next two statements in order so ttk widgets override TK widgets
+import tkinter as tk
+import tkinter.ttk as ttk
+import utilities as util
+import utils as local_util
+
+COLUMNS = (("Account", 'account', "{}"),
+           ("Positions", 'positions', "{}"),
+           ("Value", 'value', "{:,.2f}"),
+           ("Macaulay", 'macaulay', "{:.3f}"),
+           ("Modified", 'modified', "{:.3f}"),
+           ("Convexity", 'convexity', "{:.3f}"))
+
+
+class LadderWin:
+    """Show a LadderReport: the duration and convexity of each account and
+    of the portfolio, then the principal and the interest paid in each
+    maturity bucket.
+
+    Args:
+        parent (CfGui): the GUI
+
+        report (LadderReport): report to show
+    """
+
+    def __init__(self, parent, report):
+        self.parent = parent
+
+        self.win = tk.Toplevel()
+        self.win.title("Bond Ladder")
+        self.win.protocol("WM_DELETE_WINDOW", self.close_win)
+
+        frame = local_util.add_frame(self.win)
+        lines = report.lines + [report.total]
+        labels = report.bucket_labels()
+
+        ttk.Label(frame, text="Bond and CD ladder as of {}".format(
+            self.parent.format_date(report.as_of)), style='MediumLeft.TLabel'). \
+            grid(row=0, column=0, columnspan=len(labels) + 1, sticky='W')
+
+        row = 1
+        for col, (heading, _, _) in enumerate(COLUMNS):
+            ttk.Label(frame, text=heading, style='Centered.TLabel'). \
+                grid(row=row, column=col, sticky='WE')
+        for line in lines:
+            row += 1
+            for col, (_, key, fmt) in enumerate(COLUMNS):
+                self.add_cell(frame, row, col, fmt.format(getattr(line, key)))
+
+        for title, key in (("Principal", 'principal'), ("Interest", 'interest')):
+            row += 2
+            ttk.Label(frame, text=title, style='Centered.TLabel'). \
+                grid(row=row, column=0, sticky='WE')
+            for col, label in enumerate(labels, start=1):
+                ttk.Label(frame, text=label, style='Centered.TLabel'). \
+                    grid(row=row, column=col, sticky='WE')
+            for line in lines:
+                row += 1
+                self.add_cell(frame, row, 0, line.account)
+                for col, amount in enumerate(getattr(line, key), start=1):
+                    self.add_cell(frame, row, col, "{:,.2f}".format(amount))
+
+        controls_frame = local_util.add_controls_frame(self.win)
+        button_frame = local_util.add_button_frame(controls_frame)
+        ttk.Button(button_frame, text='Close', style='Medium.TButton',
+                   command=self.close_win).grid(row=0, column=0)
+
+        util.center_popup(self.win, self.parent.get_root())
+
+    @staticmethod
+    def add_cell(frame, row, col, text):
+        ttk.Label(frame, text=text,
+                  style='MediumLeft.TLabel' if col == 0 else 'Medium.TLabel'). \
+            grid(row=row, column=col, sticky='W' if col == 0 else 'E')
+
+    def close_win(self):
+        self.win.destroy()
@@ -0,0 +1,384 @@
+#
+# Author: Greg Glezman
+#
+# Copyright (c) 2018-2022 G.Glezman.  All Rights Reserved.
+#
+# This file contains the register used by the cash flow ledger.
+#
+# Developers Notes
+# 1. A register holds the transactions of one cash account in date order.
+#    Each transaction is presented to the outside world as the tuple
+#           (date, amount, balance, comment)
+#    but internally the register keeps a column per tuple component. The
+#    date column is kept sorted so a new transaction can be placed with
+#    a binary search instead of a rebuild of the whole register.
+# 2. Running balances are recomputed lazily. An insert only remembers the
+#    earliest entry whose balance is stale. The balances are brought up
+#    to date the next time any balance is read.
+# 3. The first entry is always the opening balance of the account.
+# 4. When the ledger is built, transactions are staged and handed to the
+#    register in one batch (see extend()). The batch is sorted once and
+#    merged into the register instead of being inserted one at a time.
+# 5. A register can be encoded to bytes and back (see to_bytes()). The
+#    dates are stored as seconds since 0001-01-01 (int64), the amounts and
+#    balances as doubles and the comments as NUL separated utf-8 text.
+#    The indices of the amounts that are ints (eg the 0 of the opening
+#    entry) are stored too, so the amounts come back exactly as they were.
+#    encode_ledger()/decode_ledger() do the same for a whole ledger.
+# 6. The description of an entry (eg "CD Interest, CUSIP: 12345") is the
+#    same for every entry made for the same instrument and event. Each
+#    distinct description is stored once in the Descriptions registry
+#    (descriptions) and a register only keeps its id. The text is looked up
+#    when an entry is read. The ids are only valid in this process, the
+#    encoded register holds the text.
+# 7. Register.insert_count counts the entries added to all registers. It is
+#    read before and after each stage of a restart (see profiling.py).
+
+import struct
+import zlib
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timedelta
+from heapq import merge
+from operator import itemgetter
+
+SECONDS_PER_DAY = 86400
+
+_REGISTER_HEADER = struct.Struct("<dII")  # opening balance, entry count, int amount count
+_LEDGER_ENTRY = struct.Struct("<qI")  # account_rec_id, register size in bytes
+
+
+class Descriptions:
+    """Registry of the transaction descriptions (see Developers Notes 6)"""
+
+    def __init__(self):
+        self._ids = {}  # text -> id
+        self._texts = []  # id -> text
+
+    def get_id(self, text):
+        """Return the id of the description 'text', adding it if it's new"""
+
+        id_ = self._ids.get(text)
+        if id_ is None:
+            id_ = len(self._texts)
+            self._ids[text] = id_
+            self._texts.append(text)
+        return id_
+
+    def text(self, id_):
+        return self._texts[id_]
+
+    def __len__(self):
+        return len(self._texts)
+
+
+descriptions = Descriptions()  # shared by all registers
+
+
+class Register:
+    """The transactions of a single cash account, ordered by date.
+
+    Args:
+        opening_date (datetime): date of the opening balance entry
+
+        opening_balance (float): balance of the account on opening_date
+
+        comment (str): comment of the opening balance entry
+    """
+
+    insert_count = 0  # entries added to all registers (see Developers Notes)
+
+    def __init__(self, opening_date, opening_balance, comment):
+        Register.insert_count += 1
+        self.opening_balance = float(opening_balance)
+        self._dates = [opening_date]
+        self._amounts = [0]
+        self._balances = [self.opening_balance]
+        self._descriptions = [descriptions.get_id(comment)]  # description ids
+        self._stale = None  # index of the first stale balance, None if all are current
+
+    def insert(self, dt, amount, comment):
+        """Insert a transaction into the register by date.
+
+        'comment' is the description text or its id. A transaction is
+        placed ahead of any existing transaction with the same datetime.
+        Return the index of the new entry.
+        """
+        if type(comment) is str:
+            comment = descriptions.get_id(comment)
+        index = bisect_left(self._dates, dt)
+        Register.insert_count += 1
+
+        self._dates.insert(index, dt)
+        self._amounts.insert(index, amount)
+        self._balances.insert(index, 0.0)
+        self._descriptions.insert(index, comment)
+
+        if self._stale is None or index < self._stale:
+            self._stale = index
+
+        return index
+
+    def extend(self, transactions):
+        """Add a batch of transactions to the register.
+
+        'transactions' is a list of (datetime, amount, comment) tuples in
+        the order they were generated, the comment being the description
+        text or its id. The result is the same as calling insert() for each
+        of them in turn: on equal datetimes, the later transaction is placed
+        first.
+        """
+        if not transactions:
+            return
+        Register.insert_count += len(transactions)
+
+        # A stable sort of the reversed batch puts later transactions ahead
+        # of earlier ones with the same datetime. merge() is also stable,
+        # so the batch lands ahead of existing entries with the same datetime.
+        batch = sorted(reversed(transactions), key=itemgetter(0))
+        first = bisect_left(self._dates, batch[0][0])
+        existing = zip(self._dates[first:], self._amounts[first:],
+                       self._descriptions[first:])
+
+        dates = self._dates[:first]
+        amounts = self._amounts[:first]
+        ids = self._descriptions[:first]
+        for dt, amount, id_ in merge(batch, existing, key=itemgetter(0)):
+            if type(id_) is str:
+                id_ = descriptions.get_id(id_)
+            dates.append(dt)
+            amounts.append(amount)
+            ids.append(id_)
+
+        self._dates = dates
+        self._amounts = amounts
+        self._descriptions = ids
+        self._balances = self._balances[:first] + [0.0] * (len(dates) - first)
+
+        if self._stale is None or first < self._stale:
+            self._stale = first
+
+    def accrue_interest(self, periods, rate, comment):
+        """Credit interest to the register in a single forward sweep.
+
+        'periods' is an ascending list of (credit_date, balance_date) tuples.
+        For each period, the balance on balance_date (see balance_on()) is
+        multiplied by 'rate' and the result is entered on credit_date. A
+        negative balance earns no interest; a zero entry is made instead.
+
+        Each interest entry counts toward the balance of later periods, so
+        the result is the same as looking up each balance and inserting each
+        interest entry in turn, but the register is only walked once.
+        """
+        if not periods:
+            return
+        Register.insert_count += len(periods)
+        if type(comment) is str:
+            comment = descriptions.get_id(comment)
+
+        self.refresh()
+        old_dates = self._dates
+        old_amounts = self._amounts
+        old_ids = self._descriptions
+        count = len(old_dates)
+
+        dates = []
+        amounts = []
+        balances = []
+        ids = []
+
+        bal = self.opening_balance
+        i = 0
+        for credit_date, balance_date in periods:
+            # copy the entries ahead of the interest entry
+            while i < count and old_dates[i] < credit_date:
+                bal = bal + old_amounts[i]
+                dates.append(old_dates[i])
+                amounts.append(old_amounts[i])
+                balances.append(bal)
+                ids.append(old_ids[i])
+                i += 1
+
+            # look ahead to the balance on the balance date
+            period_bal = bal
+            j = i
+            while j < count and old_dates[j] <= balance_date:
+                period_bal = period_bal + old_amounts[j]
+                j += 1
+            if not dates and j == 0:
+                # nothing on or before the balance date, use the first entry
+                period_bal = self.opening_balance + old_amounts[0]
+
+            interest = period_bal * rate
+            if not interest > 0.0:
+                # ignore negative interest
+                interest = 0.0
+
+            bal = bal + interest
+            dates.append(credit_date)
+            amounts.append(interest)
+            balances.append(bal)
+            ids.append(comment)
+
+        # copy the rest of the register
+        while i < count:
+            bal = bal + old_amounts[i]
+            dates.append(old_dates[i])
+            amounts.append(old_amounts[i])
+            balances.append(bal)
+            ids.append(old_ids[i])
+            i += 1
+
+        self._dates = dates
+        self._amounts = amounts
+        self._balances = balances
+        self._descriptions = ids
+
+    def balance_on(self, dt):
+        """Return the balance after the last entry dated on or before 'dt'.
+
+        If every entry follows 'dt', the balance of the first entry is returned.
+        """
+        self.refresh()
+        index = bisect_right(self._dates, dt) - 1
+
+        return self._balances[max(index, 0)]
+
+    def balances_on(self, dates):
+        """Return a list with the balance_on() each of the ascending 'dates'.
+
+        The dates and the register are walked together in a single pass.
+        """
+        self.refresh()
+        reg_dates = self._dates
+        last = len(reg_dates) - 1
+
+        balances = []
+        index = 0
+        for dt in dates:
+            while index < last and reg_dates[index + 1] <= dt:
+                index += 1
+            balances.append(self._balances[index])
+
+        return balances
+
+    def refresh(self):
+        """Bring the running balance of all entries up to date"""
+
+        if self._stale is None:
+            return
+
+        if self._stale == 0:
+            bal = self.opening_balance
+        else:
+            bal = self._balances[self._stale - 1]
+
+        balances = self._balances
+        amounts = self._amounts
+        for i in range(self._stale, len(amounts)):
+            bal = bal + amounts[i]
+            balances[i] = bal
+
+        self._stale = None
+
+    def to_bytes(self):
+        """Return the register encoded as bytes (see from_bytes())"""
+
+        self.refresh()
+        seconds = array('q', [dt.toordinal() * SECONDS_PER_DAY +
+                              dt.hour * 3600 + dt.minute * 60 + dt.second for dt in self._dates])
+        amounts = array('d', self._amounts)
+        balances = array('d', self._balances)
+        int_amounts = array('I', [i for i, amount in enumerate(self._amounts)
+                                  if type(amount) is int])
+        comments = "\0".join(map(descriptions.text, self._descriptions))
+        comments = comments.encode('utf-8')
+
+        return b"".join((_REGISTER_HEADER.pack(self.opening_balance, len(seconds), len(int_amounts)),
+                         seconds.tobytes(), amounts.tobytes(), balances.tobytes(),
+                         int_amounts.tobytes(), comments))
+
+    @classmethod
+    def from_bytes(cls, data, date_cache=None):
+        """Return a register decoded from the bytes of to_bytes().
+
+        'date_cache' is an optional dict used to share the datetime objects
+        of equal dates between registers.
+        """
+        opening_balance, count, int_count = _REGISTER_HEADER.unpack_from(data)
+        offset = _REGISTER_HEADER.size
+        columns = []
+        for typecode, length in (('q', count), ('d', count), ('d', count), ('I', int_count)):
+            column = array(typecode)
+            size = length * column.itemsize
+            column.frombytes(data[offset:offset + size])
+            columns.append(column)
+            offset += size
+
+        if date_cache is None:
+            date_cache = {}
+        dates = []
+        for seconds in columns[0]:
+            dt = date_cache.get(seconds)
+            if dt is None:
+                days, seconds_in_day = divmod(seconds, SECONDS_PER_DAY)
+                dt = datetime.fromordinal(days) + timedelta(seconds=seconds_in_day)
+                date_cache[seconds] = dt
+            dates.append(dt)
+
+        reg = cls.__new__(cls)
+        reg.opening_balance = opening_balance
+        reg._dates = dates
+        reg._amounts = columns[1].tolist()
+        for index in columns[3]:
+            reg._amounts[index] = int(reg._amounts[index])
+        reg._balances = columns[2].tolist()
+        reg._descriptions = [descriptions.get_id(text)
+                             for text in data[offset:].decode('utf-8').split("\0")]
+        reg._stale = None
+
+        return reg
+
+    def __len__(self):
+        return len(self._dates)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+
+        self.refresh()
+        return (self._dates[index], self._amounts[index],
+                self._balances[index], descriptions.text(self._descriptions[index]))
+
+    def __iter__(self):
+        self.refresh()
+        return zip(self._dates, self._amounts, self._balances,
+                   map(descriptions.text, self._descriptions))
+
+
+def encode_ledger(ledger):
+    """Return the ledger (account_rec_id -> Register) encoded as compressed bytes"""
+
+    parts = []
+    for account_rec_id, reg in ledger.items():
+        data = reg.to_bytes()
+        parts.append(_LEDGER_ENTRY.pack(account_rec_id, len(data)))
+        parts.append(data)
+
+    return zlib.compress(b"".join(parts), 1)
+
+
+def decode_ledger(data):
+    """Return the ledger encoded by encode_ledger()"""
+
+    data = zlib.decompress(data)
+    ledger = {}
+    date_cache = {}
+    offset = 0
+    while offset < len(data):
+        account_rec_id, size = _LEDGER_ENTRY.unpack_from(data, offset)
+        offset += _LEDGER_ENTRY.size
+        ledger[account_rec_id] = Register.from_bytes(data[offset:offset + size], date_cache)
+        offset += size
+
+    return ledger
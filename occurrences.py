@@ -7,16 +7,21 @@
 # to edit account data. Occurrences are used for compounding, transfers, etc.
 
 from datetime import datetime, date, timedelta
-from calendar import monthrange
+from functools import lru_cache
+from heapq import merge
 import itertools
 import utilities as util
 import data_file_constants as dfc
+import cf_calendar
 
 MONTHS_IN_YEAR = 12
 MONTHS_IN_SEMI_YEAR = 6
 MONTHS_IN_QUARTER = 3
 MONTHS_IN_MONTH = 1
 
+# number of (occurrence_spec, last_date) date lists kept by occurrence_dates()
+OCCURRENCE_CACHE_SIZE = 1024
+
 
 class EndDate:
     """Create a class that represents the end date of an occurrence.
@@ -239,6 +244,156 @@ class Occurrences:
         """
         return dates
 
+    def iter_dates(self, start=None, stop=None):
+        """Generate the dates of the occurrence in ascending order.
+
+        The dates are the ones get_dates() would return, limited to those
+        on or after 'start' and on or before 'stop' (both optional). Dates
+        are produced on demand; the first date on or after 'start' is found
+        without generating the dates before it.
+
+        Args:
+            start (datetime, optional): earliest date of interest
+
+            stop (datetime, optional): latest date of interest
+        """
+        last = self.get_limit_date()
+        if stop is not None and stop < last:
+            last = stop
+
+        generators = []
+        for series in self.get_date_series():
+            generators.append(self.gen_series_dates(series, start, last))
+
+        if len(generators) == 1:
+            return generators[0]
+        return merge(*generators)
+
+    def get_nth_date(self, k):
+        """Return the k-th (0 based) date of the occurrence or None if there
+        are not that many dates."""
+
+        series_list = self.get_date_series()
+        if len(series_list) == 1:
+            # jump straight to the date
+            count = self.get_series_count(series_list[0])
+            if count is not None and k >= count:
+                return None
+            day = self.get_series_date(series_list[0], k)
+            if day > self.get_limit_date():
+                return None
+            return day
+
+        return next(itertools.islice(self.iter_dates(), k, None), None)
+
+    def get_first_date_on_or_after(self, dt):
+        """Return the first date of the occurrence on or after 'dt' or None"""
+
+        return next(self.iter_dates(start=dt), None)
+
+    def get_last_date(self):
+        """Return the last date of the occurrence or None if there are no dates"""
+
+        last = self.get_limit_date()
+        best_date = None
+        for series in self.get_date_series():
+            # index of the first date beyond the limit
+            k = self.get_series_index(series, last + timedelta(microseconds=1))
+            count = self.get_series_count(series)
+            if count is not None and k > count:
+                k = count
+            if k > 0:
+                day = self.get_series_date(series, k - 1)
+                if best_date is None or day > best_date:
+                    best_date = day
+        return best_date
+
+    def get_limit_date(self):
+        """Return the latest date the occurrence may produce (datetime)"""
+
+        if self.regularity == 'once' or self.end_date.has_count():
+            return self.last_date
+        return min(self.end_date.date(), self.last_date)
+
+    def get_date_series(self):
+        """Return the date series that make up the occurrence.
+
+        Each series is a tuple (first_date, weeks, months): the k-th date of
+        the series is first_date plus k times the weeks or months interval.
+        Twice-a-month is made up of two monthly series.
+        """
+        if self.regularity == 'once':
+            return [(self.start_date, 0, 0)]
+        elif self.regularity == 'weekly':
+            return [(self.start_date, self.weekly_interval, 0)]
+        elif self.regularity == 'bi-weekly':
+            return [(self.start_date, 2, 0)]
+        elif self.regularity == 'monthly':
+            return [(self.start_date, 0, MONTHS_IN_MONTH * self.monthly_interval)]
+        elif self.regularity == 'twice-a-month':
+            second_date = self.start_date.replace(day=self.second_day)
+            if second_date < self.start_date:
+                second_date = self.add_months(second_date, 1)
+            return [(self.start_date, 0, MONTHS_IN_MONTH),
+                    (second_date, 0, MONTHS_IN_MONTH)]
+        elif self.regularity == 'quarterly':
+            return [(self.start_date, 0, MONTHS_IN_QUARTER)]
+        elif self.regularity == 'semi-annually':
+            return [(self.start_date, 0, MONTHS_IN_SEMI_YEAR)]
+        elif self.regularity == 'annually':
+            return [(self.start_date, 0, MONTHS_IN_YEAR)]
+        else:
+            raise TypeError("Unknown regularity {}".format(self.regularity))
+
+    def get_series_count(self, series):
+        """Return the maximum number of dates in the series (None if unlimited)"""
+
+        if series[1] == 0 and series[2] == 0:  # once
+            return 1
+        if self.end_date.has_count():
+            return self.end_date.count()
+        return None
+
+    @staticmethod
+    def get_series_date(series, k):
+        """Return the k-th (0 based) date of the series"""
+
+        first_date, weeks, months = series
+        if weeks:
+            return first_date + timedelta(days=weeks * k * 7)
+        return cf_calendar.add_months(first_date, months * k)
+
+    def get_series_index(self, series, dt):
+        """Return the index of the first date in the series on or after 'dt'"""
+
+        first_date, weeks, months = series
+        if dt <= first_date:
+            return 0
+
+        if weeks == 0 and months == 0:  # once
+            k = 1
+        elif weeks:
+            k = -(-(dt - first_date) // timedelta(days=weeks * 7))  # round up
+        else:
+            k = -(-cf_calendar.months_between(first_date, dt) // months)
+            # a short month can put the k-th date before 'dt'
+            if self.get_series_date(series, k) < dt:
+                k += 1
+        return k
+
+    def gen_series_dates(self, series, start, last):
+        """Generate the dates of the series from 'start' through 'last'"""
+
+        count = self.get_series_count(series)
+        k = 0 if start is None else self.get_series_index(series, start)
+
+        while count is None or k < count:
+            day = self.get_series_date(series, k)
+            if day > last:
+                break
+            yield day
+            k += 1
+
     def get_sample_dates(self, n):
         """Get a list of 'n' sample dates for the occurrence.
 
@@ -248,11 +403,9 @@ class Occurrences:
 
         If a date is not available, '-' is returned in its place."""
 
-        dates = self.get_dates()
         s = ['-'] * n  # generate a list of n dashes
-        for i, day in enumerate(dates):
-            if len(dates) > i and len(s) > i:
-                s[i] = dates[i].strftime(dfc.SHORT_DATE_FORMAT)
+        for i, day in enumerate(itertools.islice(self.iter_dates(), n)):
+            s[i] = day.strftime(dfc.SHORT_DATE_FORMAT)
         return s
 
     def gen_date_list_by_months(self, start_date, interval_in_months,
@@ -265,21 +418,21 @@ class Occurrences:
             last_date (datetime)
             dates (list(datetime))
         """
-        day = start_date
         if end_date.has_count():
-            for i in range(end_date.count()):
-                if day <= last_date:
-                    dates.append(day)
-                    day = self.get_next_date(start_date, interval_in_months * (i + 1))
-                else:
-                    break
+            limit = last_date
         else:
-            for i in itertools.count():
-                if day <= end_date.date() and day <= last_date:
-                    dates.append(day)
-                    day = self.get_next_date(start_date, interval_in_months * (i + 1))
-                else:
-                    break
+            limit = min(end_date.date(), last_date)
+
+        # no date past the limit month is needed
+        count = cf_calendar.months_between(start_date, limit) // interval_in_months + 1
+        if end_date.has_count():
+            count = min(count, end_date.count())
+
+        for day in cf_calendar.month_offsets(
+                start_date, range(0, count * interval_in_months, interval_in_months)):
+            if day > limit:
+                break
+            dates.append(day)
 
     def gen_date_list_by_weeks(self, start_date, interval_in_weeks,
                                end_date, last_date, dates):
@@ -333,16 +486,7 @@ class Occurrences:
         if type(months) != int:
             raise TypeError("{}(): months not an int".format(util.f_name()))
 
-        next_year = start_date.year + ((start_date.month + months - 1) // 12)
-        next_month = start_date.month + months  # modulo months avoids next loop
-        while next_month > 12:
-            next_month -= 12
-        days_next_month = monthrange(next_year, next_month)[1]
-
-        return start_date.replace(
-                year=next_year,
-                month=next_month,
-                day=min(start_date.day, days_next_month))
+        return cf_calendar.add_months(start_date, months)
 
     def get_latest_date(self):
         """Determine the latest date in a frequency, beyond the current date.
@@ -355,14 +499,12 @@ class Occurrences:
         d = date.today()
         today = datetime(d.year, d.month, d.day)
 
-        date_list = self.get_dates()
-
-        best_date = self.start_date
-
-        if len(date_list) > 0:
-            for best_date in date_list:
-                if best_date >= today:
-                    break
+        best_date = self.get_first_date_on_or_after(today)
+        if best_date is None:
+            # all dates are prior to today, use the last of them
+            best_date = self.get_last_date()
+        if best_date is None:
+            best_date = self.start_date
 
         return best_date
 
@@ -373,11 +515,8 @@ class Occurrences:
         if type(dt) != datetime:
             raise TypeError("date must be a datetime object")
 
-        month = dt.month - 1 + months
-        year = dt.year + month // 12
-        month = month % 12 + 1
-        day = min(dt.day, monthrange(year, month)[1])
-        return datetime(year, month, day)
+        dt = cf_calendar.add_months(dt, months)
+        return datetime(dt.year, dt.month, dt.day)
 
     def get_start_date(self):
         """return the date portion of the start_date datetime"""
@@ -496,3 +635,20 @@ class Occurrences:
 
         spec = sd + ";" + ed + ";" + regularity
         return spec
+
+
+@lru_cache(maxsize=OCCURRENCE_CACHE_SIZE)
+def occurrence_dates(occurrence_spec, last_date):
+    """Return a tuple of the dates for the given occurrence specification.
+
+    The spec is parsed and its dates generated once; later calls with the
+    same spec and last_date are answered from the cache. A change to either
+    one is a different key, so the cache never needs to be invalidated.
+    occurrence_dates.cache_info() reports the cache hits and misses.
+
+    Args
+        occurrence_spec (str): occurrence specification (see Occurrences)
+
+        last_date (datetime): last date tracked per settings
+    """
+    return tuple(Occurrences(occurrence_spec, last_date).get_dates())
@@ -0,0 +1,72 @@
+#
+# Author: Greg Glezman
+#
+# Copyright (c) 2018-2022 G.Glezman.  All Rights Reserved.
+#
+# This file contains the window that shows the per stage profile of the
+# last restart of the Cash Flow Analysis application (see profiling.py).
+
+# Keep the next two statements in order so ttk widgets override TK widgets
+import tkinter as tk
+import tkinter.ttk as ttk
+import utilities as util
+import utils as local_util
+
+COLUMNS = (("Stage", 'stage', "{}"),
+           ("msec", 'seconds', "{:.1f}"),
+           ("Transactions", 'transactions', "{}"),
+           ("Queries", 'queries', "{}"),
+           ("Inserts", 'inserts', "{}"))
+
+
+class PerformanceWin:
+    """Show the stages of a RestartProfile, one row per stage.
+
+    Args:
+        parent (CfGui): the GUI
+
+        profile (RestartProfile): profile to show
+
+        profile_filename (str): file holding the cProfile stats, if any
+    """
+
+    def __init__(self, parent, profile, profile_filename=""):
+        self.parent = parent
+
+        self.win = tk.Toplevel()
+        self.win.title("Restart Performance")
+        self.win.protocol("WM_DELETE_WINDOW", self.close_win)
+
+        frame = local_util.add_frame(self.win)
+
+        ttk.Label(frame, text="Tracking months: {}   Accounts rebuilt: {}".format(
+            profile.tracking_months, profile.rebuilt), style='MediumLeft.TLabel'). \
+            grid(row=0, column=0, columnspan=len(COLUMNS), sticky='W')
+
+        for col, (heading, _, _) in enumerate(COLUMNS):
+            ttk.Label(frame, text=heading, style='Centered.TLabel'). \
+                grid(row=1, column=col, sticky='WE')
+
+        for row, stats in enumerate(profile.stages + [profile.total()], start=2):
+            for col, (_, key, fmt) in enumerate(COLUMNS):
+                value = getattr(stats, key)
+                if key == 'seconds':
+                    value *= 1000
+                ttk.Label(frame, text=fmt.format(value),
+                          style='MediumLeft.TLabel' if col == 0 else 'Medium.TLabel'). \
+                    grid(row=row, column=col, sticky='W' if col == 0 else 'E')
+
+        if profile_filename:
+            ttk.Label(frame, text="cProfile written to {}".format(profile_filename),
+                      style='MediumLeft.TLabel'). \
+                grid(row=len(profile.stages) + 3, column=0, columnspan=len(COLUMNS), sticky='W')
+
+        controls_frame = local_util.add_controls_frame(self.win)
+        button_frame = local_util.add_button_frame(controls_frame)
+        ttk.Button(button_frame, text='Close', style='Medium.TButton',
+                   command=self.close_win).grid(row=0, column=0)
+
+        util.center_popup(self.win, self.parent.get_root())
+
+    def close_win(self):
+        self.win.destroy()
@@ -0,0 +1,86 @@
+#
+# Author: Greg Glezman
+#
+# Copyright (c) 2018-2022 G.Glezman.  All Rights Reserved.
+#
+# This file contains the per stage profile of a ledger restart.
+#
+# Developers Notes
+# 1. CfAnalysis.restart() runs each of its stages through
+#    CfAnalysis.run_stage(), which records a StageStats for the stage in
+#    the RestartProfile of the restart. The counters are
+#       seconds      - wall time
+#       transactions - credits and debits made
+#       queries      - DB queries issued (see DataAccess.query_count)
+#       inserts      - register entries added (see Register.insert_count)
+#    Recording a stage costs a few counter reads, so it is always on.
+# 2. profile_to_file() runs a function under cProfile and writes the
+#    stats to a file that can be read with pstats, eg
+#         python -m pstats restart.prof
+
+import cProfile
+from typing import NamedTuple
+
+
+class StageStats(NamedTuple):
+    """The counters of one stage of a restart (see Developers Notes)"""
+    stage: str
+    seconds: float
+    transactions: int
+    queries: int
+    inserts: int
+
+
+class RestartProfile:
+    """The stages of one restart, in the order they ran.
+
+    Args:
+        tracking_months (int): months the restart covered
+    """
+
+    def __init__(self, tracking_months):
+        self.tracking_months = tracking_months
+        self.rebuilt = ""  # accounts rebuilt, set at the end of the restart
+        self.stages = []
+
+    def add(self, stats):
+        self.stages.append(stats)
+
+    def total(self):
+        """Return a StageStats with the sum of all stages"""
+
+        return StageStats("total",
+                          sum(s.seconds for s in self.stages),
+                          sum(s.transactions for s in self.stages),
+                          sum(s.queries for s in self.stages),
+                          sum(s.inserts for s in self.stages))
+
+    def as_dict(self):
+        """Return the profile as a dict (eg to be written as JSON)"""
+
+        return {'tracking_months': self.tracking_months,
+                'rebuilt': self.rebuilt,
+                'stages': [stats._asdict() for stats in self.stages]}
+
+    def report(self):
+        """Return a table of the stages as a list of lines"""
+
+        lines = ["Restart of {} months, rebuilt: {}".format(self.tracking_months, self.rebuilt),
+                 "{:20} {:>10} {:>13} {:>8} {:>8}".format(
+                     "Stage", "msec", "Transactions", "Queries", "Inserts")]
+        for stats in self.stages + [self.total()]:
+            lines.append("{:20} {:>10.1f} {:>13} {:>8} {:>8}".format(
+                stats.stage, stats.seconds * 1000, stats.transactions, stats.queries, stats.inserts))
+
+        return lines
+
+
+def profile_to_file(func, filename, *args):
+    """Run func(*args) under cProfile, write the stats to 'filename' and
+    return the result of func.
+    """
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(func, *args)
+    finally:
+        profiler.dump_stats(filename)
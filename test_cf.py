@@ -13,7 +13,29 @@
 import unittest
 import datetime
 # import sys
-from cf import CfAnalysis
+import io
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import benchmark
+import bond_schedule
+from cf import CfAnalysis, Logger, parse_args, run_headless
+from cf_upgrade import database_upgrade
+from data_access import connect, check_snapshot
+import day_count
+import db_export
+import data_file_constants as dfc
+from file_manager import FileManager
+from import_timer import ImportTimer
+from ledger import Register, descriptions, encode_ledger, decode_ledger
+from occurrences import Occurrences, occurrence_dates
+import cf_calendar
+
+# The tests always run with the per call argument checks of CfAnalysis
+CfAnalysis.set_arg_checks(True)
 
 
 class TestCF(unittest.TestCase):
@@ -39,6 +61,27 @@ class TestCF(unittest.TestCase):
 
     DEFAULT_TRACKING_MONTHS = 24
 
+    @staticmethod
+    def make_cfa(db=":memory:", accounts=()):
+        """Return a CfAnalysis with its FileManager on a new database 'db'
+        (none if db is None) holding a Brokerage account for each name of
+        'accounts'.
+        """
+        logger = Logger(logging.WARNING)
+        fm = FileManager(logger)
+        cf = CfAnalysis(fm, logger)
+        fm.set_cfa(cf)
+        if db is not None:
+            fm.create_db(db)
+            for name in accounts:
+                TestCF.add_account(cf, name)
+        return cf
+
+    @staticmethod
+    def add_account(cf, name):
+        cf.account_create(dict(account_name=name, account_number="1", opening_date="2021-01-01",
+                               account_type="Brokerage", update_method="Manual", note=""))
+
     def test_types(self):  # method name must begin with "test_"
         # make sure the function validates types
         valid_datetime = datetime.datetime(2018, 2, 7)
@@ -52,10 +95,6 @@ class TestCF(unittest.TestCase):
         cf = CfAnalysis()
         self.assertRaises(TypeError, cf.format_date, invalid_datetime)
 
-        self.assertRaises(TypeError, cf.append_register, i, f, lst)
-        self.assertRaises(TypeError, cf.append_register, t, i, lst)
-        self.assertRaises(TypeError, cf.append_register, t, f, t)
-
         self.assertRaises(TypeError, cf.trans_to_register, f, lst)
         self.assertRaises(TypeError, cf.trans_to_register, t, t)
 
@@ -86,14 +125,133 @@ class TestCF(unittest.TestCase):
         self.assertRaises(TypeError, cf.period_to_rate_factor, f)
         self.assertRaises(TypeError, cf.period_to_rate_factor, valid_datetime)
 
-    def test_append_register(self):
-        pass
+    def test_register(self):
+        opening = datetime.datetime(2018, 1, 20)
+        reg = Register(opening, 100.0, "Opening Balance")
+
+        reg.insert(self.N_DATE_2, 10.0, "second")
+        reg.insert(self.N_DATE_1, -30.0, "first")
+        reg.insert(self.N_DATE_3, 5.0, "third")
+
+        self.assertEqual(len(reg), 4)
+        self.assertEqual(reg[0], (opening, 0, 100.0, "Opening Balance"))
+        self.assertEqual([t[2] for t in reg], [100.0, 70.0, 80.0, 85.0])
+        self.assertEqual([t[3] for t in reg[1:]], ["first", "second", "third"])
+
+        # same datetime - the latest insert is placed first
+        reg.insert(self.N_DATE_1, 1.0, "same day")
+        self.assertEqual(reg[1], (self.N_DATE_1, 1.0, 101.0, "same day"))
+        self.assertEqual(reg[2], (self.N_DATE_1, -30.0, 71.0, "first"))
+        self.assertEqual(reg[-1][2], 86.0)
+
+    def test_register_extend(self):
+        # a batch must produce the same register as one insert at a time
+        opening = datetime.datetime(2018, 1, 20)
+        batch = [(self.N_DATE_2, 10.0, "a"), (self.N_DATE_1, -30.0, "b"),
+                 (self.N_DATE_2, 7.0, "c"), (opening, 1.0, "d"),
+                 (self.N_DATE_1, 2.0, "e")]
+
+        one_at_a_time = Register(opening, 100.0, "Opening Balance")
+        one_at_a_time.insert(self.N_DATE_1, 4.0, "existing")
+        for transaction in batch:
+            one_at_a_time.insert(*transaction)
+
+        batched = Register(opening, 100.0, "Opening Balance")
+        batched.insert(self.N_DATE_1, 4.0, "existing")
+        batched.extend(batch)
+
+        self.assertEqual(list(batched), list(one_at_a_time))
+
+    def test_register_accrue_interest(self):
+        # the sweep must match a lookup and insert for each interest date
+        opening = datetime.datetime(2018, 1, 20)
+        transactions = [(datetime.datetime(2018, 2, 20, 1), 500.0, "deposit"),
+                        (datetime.datetime(2018, 3, 20, 10), -2000.0, "withdrawal"),
+                        (datetime.datetime(2018, 3, 20, 2), 1.0, "same hour"),
+                        (datetime.datetime(2018, 6, 5, 1), 3000.0, "deposit")]
+        periods = [(datetime.datetime(2018, m, 20, 2), datetime.datetime(2018, m, 20, 11))
+                   for m in range(1, 9)]
+        rate = 0.01
+
+        expected = Register(opening, 1000.0, "Opening Balance")
+        swept = Register(opening, 1000.0, "Opening Balance")
+        expected.extend(transactions)
+        swept.extend(transactions)
+
+        for credit_date, balance_date in periods:
+            interest = expected.balance_on(balance_date) * rate
+            expected.insert(credit_date, interest if interest > 0.0 else 0.0, "Interest")
+        swept.accrue_interest(periods, rate, "Interest")
+
+        self.assertEqual(list(swept), list(expected))
+        # a negative balance earns a zero interest entry
+        self.assertIn((datetime.datetime(2018, 4, 20, 2), 0.0), [t[:2] for t in swept])
+
+    def test_register_descriptions(self):
+        # a description is stored once and registers hold its id
+        first_id = descriptions.get_id("CD Interest, CUSIP: 123")
+        self.assertEqual(descriptions.get_id("CD Interest, CUSIP: " + "123"), first_id)
+        self.assertEqual(descriptions.text(first_id), "CD Interest, CUSIP: 123")
+
+        opening = datetime.datetime(2018, 1, 20)
+        reg = Register(opening, 100.0, "Opening Balance")
+        reg.insert(self.N_DATE_1, 5.0, first_id)
+        reg.extend([(self.N_DATE_2, 5.0, first_id), (self.N_DATE_3, 1.0, "text")])
+        self.assertEqual([t[3] for t in reg], ["Opening Balance", "CD Interest, CUSIP: 123",
+                                               "CD Interest, CUSIP: 123", "text"])
+        self.assertEqual(reg._descriptions[1], reg._descriptions[2])
+
+        # the encoded register holds the text
+        self.assertIn(b"CD Interest, CUSIP: 123", reg.to_bytes())
+        self.assertEqual(list(Register.from_bytes(reg.to_bytes())), list(reg))
+
+    def test_register_bytes(self):
+        # an entry dated before the opening date is ahead of the opening entry
+        reg = Register(datetime.datetime(2024, 1, 1), 1000.0, "Opening Balance")
+        reg.insert(datetime.datetime(2023, 6, 1), 250.0, "early")
+        reg.insert(datetime.datetime(2024, 6, 1), 10.0, "late")
+
+        decoded = Register.from_bytes(reg.to_bytes())
+        self.assertEqual(decoded._amounts, [250.0, 0, 10.0])
+        self.assertIs(type(decoded._amounts[1]), int)
+        self.assertEqual(list(decoded), list(reg))
+
+        # the balances recomputed after a load match the computed register
+        for r in (reg, decoded):
+            r.insert(datetime.datetime(2023, 1, 1), 1.0, "earliest")
+        self.assertEqual(decoded.balance_on(datetime.datetime(2024, 6, 30)), 1261.0)
+        self.assertEqual(list(decoded), list(reg))
 
     def test_trans_to_register(self):
-        pass
+        cf = CfAnalysis(None, None)
+        reg = Register(self.START_DATE, 50.0, "Opening Balance")
+
+        result = cf.trans_to_register((self.N_DATE_1, 25.0, 0, "deposit"), reg)
+        self.assertIs(result, reg)
+        self.assertEqual(reg[1], (self.N_DATE_1, 25.0, 75.0, "deposit"))
+
+        self.assertRaises(TypeError, cf.trans_to_register,
+                          (self.N_DATE_1, 25.0, 0, "deposit"), [])
 
     def test_get_ball_on_date(self):
-        pass
+        cf = CfAnalysis(None, None)
+        reg = Register(self.DATE.replace(hour=0), 100.0, "Opening Balance")
+        cf.trans_to_register((self.N_DATE_1.replace(hour=1), 50.0, 0, "deposit"), reg)
+        cf.trans_to_register((self.N_DATE_1.replace(hour=10), -20.0, 0, "withdrawal"), reg)
+        cf.trans_to_register((self.N_DATE_3.replace(hour=1), 5.0, 0, "deposit"), reg)
+
+        # before opening, uses the first entry
+        self.assertEqual(cf.get_bal_on_date(datetime.datetime(2018, 1, 1), reg), 100.0)
+        self.assertEqual(cf.get_bal_on_date(self.DATE, reg), 100.0)
+        # all entries for the day are included
+        self.assertEqual(cf.get_bal_on_date(self.N_DATE_1, reg), 130.0)
+        self.assertEqual(cf.get_bal_on_date(self.N_DATE_2, reg), 130.0)
+        self.assertEqual(cf.get_bal_on_date(self.N_DATE_13, reg), 135.0)
+
+        dates = [datetime.datetime(2018, 1, 1), self.DATE, self.N_DATE_1,
+                 self.N_DATE_2, self.N_DATE_3, self.N_DATE_13]
+        self.assertEqual(cf.get_balances_on_dates(dates, reg),
+                         [cf.get_bal_on_date(dt, reg) for dt in dates])
 
     def test_get_periodic_dates(self):
         cf = CfAnalysis(None, None)
@@ -244,6 +402,17 @@ class TestCF(unittest.TestCase):
         result = cf.get_previous_date(self.N_DATE_60, 60)
         self.assertEqual(result, self.DATE)
 
+    def test_month_offsets(self):
+        # month_offsets must agree with add_months, forward and backward
+        months = list(range(-30, 31))
+        expected = [cf_calendar.add_months(self.DATE, m) for m in months]
+        self.assertEqual(cf_calendar.month_offsets(self.DATE, months), expected)
+
+        self.assertEqual(cf_calendar.add_months(self.DATE, 1), self.N_DATE_1)
+        self.assertEqual(cf_calendar.add_months(self.N_DATE_12, -12), self.DATE)
+        self.assertEqual(cf_calendar.add_months(datetime.datetime(2020, 3, 31), -1),
+                         datetime.datetime(2020, 2, 29))
+
     def test_credit(self):
         pass
 
@@ -1668,6 +1837,611 @@ class TestCF(unittest.TestCase):
         dates = cf.get_dates(freq, last_date_10yrs)
         self.assertEqual(expected, dates)
 
+    def test_occurrence_iter_dates(self):
+        """Windowed queries must agree with the full date list"""
+        last_date_10yrs = datetime.datetime(2029, 1, 1)
+        window_start = datetime.datetime(2021, 2, 1)
+        window_stop = datetime.datetime(2022, 6, 30)
+
+        for freq in ["2018-01-31;None;monthly;1", "2018-01-31;None;monthly;5",
+                     "2018-09-21;2024-01-01;weekly;3", "2018-09-21;None;bi-weekly",
+                     "2018-01-30;None;twice-a-month;15", "2018-08-31;7;quarterly",
+                     "2018-03-31;None;semi-annually", "2016-02-29;None;annually",
+                     "2021-03-03;2021-03-03;once"]:
+            occ = Occurrences(freq, last_date_10yrs)
+            dates = occ.get_dates()
+
+            self.assertEqual(list(occ.iter_dates()), dates)
+            self.assertEqual(list(occ.iter_dates(window_start, window_stop)),
+                             [d for d in dates if window_start <= d <= window_stop])
+            self.assertEqual(occ.get_first_date_on_or_after(window_start),
+                             next((d for d in dates if d >= window_start), None))
+            for k in (0, 1, 5, 40, 500):
+                self.assertEqual(occ.get_nth_date(k),
+                                 dates[k] if k < len(dates) else None)
+            self.assertEqual(occ.get_last_date(), dates[-1] if dates else None)
+
+    def test_occurrence_dates_cache(self):
+        last_date = datetime.datetime(2029, 1, 1)
+        freq = "2018-01-31;None;monthly;1"
+
+        dates = CfAnalysis.get_dates(freq, last_date)
+        hits = occurrence_dates.cache_info().hits
+        dates.clear()  # callers get their own copy
+
+        self.assertEqual(CfAnalysis.get_dates(freq, last_date),
+                         Occurrences(freq, last_date).get_dates())
+        self.assertEqual(occurrence_dates.cache_info().hits, hits + 1)
+
+        # a new last_date is a new entry
+        self.assertEqual(len(CfAnalysis.get_dates(freq, datetime.datetime(2019, 1, 1))), 12)
+
+    def test_day_count(self):
+        def calc_30_360(date_1, date_2):
+            # CfAnalysis.calc_30_360() before day_count.py
+            if date_2.month >= date_1.month:
+                months = date_2.month - date_1.month + (12 * (date_2.year - date_1.year))
+            else:
+                months = (12 - date_1.month + 1) + (date_2.month - 1) + \
+                         (12 * (date_2.year - date_1.year - 1))
+            if date_1.day > date_2.day:
+                months -= 1
+                days = 30 - date_1.day + date_2.day
+            else:
+                days = date_2.day - date_1.day
+            return ((30 * months) + days) / 360.0
+
+        self.assertEqual(day_count.thirty_360(datetime.date(2018, 5, 1),
+                                              datetime.date(2018, 9, 28)), 147 / 360)
+        self.assertEqual(day_count.thirty_360(datetime.date(2018, 5, 28),
+                                              datetime.date(2018, 9, 1)), 93 / 360)
+        self.assertEqual(day_count.actual_365(datetime.date(2019, 1, 1),
+                                              datetime.date(2020, 1, 1)), 1.0)
+        self.assertEqual(day_count.actual_actual(datetime.date(2020, 1, 1),
+                                                 datetime.date(2021, 1, 1)), 1.0)
+        self.assertEqual(day_count.actual_actual(datetime.date(2019, 7, 2),
+                                                 datetime.date(2020, 7, 2)), 183 / 365 + 183 / 366)
+        self.assertRaises(ValueError, day_count.thirty_360, self.N_DATE_2, self.N_DATE_1)
+        self.assertRaises(ValueError, day_count.actual_365_days, [2], [1])
+
+        # the arrays agree bit for bit with the scalar functions
+        first = datetime.date(2015, 1, 1).toordinal()
+        days_1 = [first + day for day in range(0, 3000, 7) for _ in range(5)]
+        days_2 = [day + span for day in days_1[::5] for span in (0, 1, 30, 400, 3700)]
+        dates = [(datetime.date.fromordinal(day_1), datetime.date.fromordinal(day_2))
+                 for day_1, day_2 in zip(days_1, days_2)]
+        for scalar, array in ((calc_30_360, day_count.thirty_360_days),
+                              (day_count.thirty_360, day_count.thirty_360_days),
+                              (day_count.actual_365, day_count.actual_365_days),
+                              (day_count.actual_actual, day_count.actual_actual_days)):
+            self.assertEqual([float(ratio).hex() for ratio in array(days_1, days_2)],
+                             [scalar(*pair).hex() for pair in dates])
+
+    def test_bond_schedule(self):
+        logger = Logger(logging.WARNING)
+        cf = CfAnalysis(FileManager(logger), logger)
+        bond = dict(account_rec_id=1, bond_price=102.181, quantity=5, coupon=5.25, fee=10.0,
+                    purchase_date="2018-02-14", maturity_date="2028-08-31",
+                    frequency="semi-annual", cusip="Bond_1", call_date=None, call_price=0.0)
+        bonds = [bond,
+                 dict(bond, purchase_date="2018-03-01", maturity_date="2018-03-20"),
+                 dict(bond, frequency="quarterly", call_date="2024-05-31", call_price=101.5),
+                 dict(bond, frequency="monthly", call_date="2018-02-20", call_price=100.0),
+                 dict(bond, frequency="weekly"),
+                 dict(bond, frequency="annual", fee=0.0, coupon=3)]
+
+        # identical to bond_cash_flow(), bond by bond
+        schedule = bond_schedule.schedule_bonds(bonds[:4] + bonds[5:], cf.bond_cash_flow)
+        for index, entry in enumerate(bonds[:4] + bonds[5:]):
+            self.assertEqual(schedule.details(index), cf.bond_cash_flow(entry))
+        self.assertEqual(len(list(schedule.rows())), len(schedule))
+
+        # a bond bond_cash_flow() rejects raises the same error
+        with self.assertRaises(ValueError):
+            bond_schedule.schedule_bonds(bonds, cf.bond_cash_flow)
+        self.assertEqual(len(bond_schedule.schedule_bonds([], cf.bond_cash_flow)), 0)
+
+    def test_bond_yields(self):
+        logger = Logger(logging.WARNING)
+        cf = CfAnalysis(FileManager(logger), logger)
+        cf.start_date = datetime.datetime(2022, 3, 7)
+        bond = dict(account_rec_id=1, bond_price=100.0, quantity=10, coupon=5.0, fee=3.0,
+                    purchase_date="2020-01-15", maturity_date="2030-01-15",
+                    frequency="semi-annual", cusip="Bond_1", call_date="None", call_price=0.0,
+                    next_call_date="2025-01-15", most_recent_price=0.0, est_yield=0.0)
+        bonds = [bond,  # at par, the yields are the coupon
+                 dict(bond, bond_price=95.0, most_recent_price=98.0),
+                 dict(bond, call_price=101.0, call_date="2024-07-15"),
+                 dict(bond, next_call_date="None"),
+                 dict(bond, frequency="weekly"),
+                 dict(bond, purchase_date=None),
+                 dict(bond, purchase_date="")]
+        at_par, discount, called, not_callable, unsupported, *not_bought = \
+            cf.get_bond_yields(bonds)
+
+        self.assertAlmostEqual(at_par.ytm, 5.0, 9)
+        self.assertAlmostEqual(at_par.ytc, 5.0, 9)
+        self.assertEqual(at_par.call_date, datetime.datetime(2025, 1, 15))
+        # bought at a discount, a call at par comes sooner so it yields more
+        self.assertGreater(discount.ytc, discount.ytm)
+        self.assertEqual(discount.ytw, discount.ytm)
+        # a called bond pays its call price on the call date
+        self.assertGreater(called.ytc, called.ytm)
+        self.assertEqual(called.call_date, datetime.datetime(2024, 7, 15))
+        self.assertEqual((not_callable.ytc, not_callable.ytw), (None, not_callable.ytm))
+        self.assertEqual(unsupported, (None, None, None, None))
+        # a bond without a purchase date has no yield
+        self.assertEqual(not_bought, [(None, None, None, None)] * 2)
+
+        # at the most recent price, as of the start date
+        at_market = cf.get_bond_yields(bonds, at_market=True)
+        self.assertIsNone(at_market[0].ytm)  # no recent price
+        self.assertLess(at_market[1].ytm, discount.ytm)
+
+        # the results are cached by bond record and price
+        self.assertIs(cf.get_bond_yields(bonds)[1], discount)
+        self.assertIsNot(cf.get_bond_yields([dict(bonds[1], coupon=5.5)])[0], discount)
+
+    def test_ladder_report(self):
+        cf = self.make_cfa(accounts=("acc1", "acc2"))
+        cf.start_date = datetime.datetime(2022, 1, 15)
+        bond = dict(account_name="acc1", bond_price=100.0, quantity=10, coupon=5.0, fee=0.0,
+                    purchase_date="2022-01-15", maturity_date="2032-01-15",
+                    frequency="semi-annual", issuer="", cusip="Bond_1", call_date="None",
+                    call_price=0.0, most_recent_price=100.0, moodys_rating="", product_type="",
+                    snp_rating="", most_recent_value=0.0, next_call_date="None", est_yield=0.0)
+        cf.new_db_rec('bond', bond)
+        cf.new_db_rec('cd', dict(account_name="acc2", purchase_price=1000.0, quantity=2, rate=2.0,
+                                 purchase_date="2021-07-15", maturity_date="2023-07-15",
+                                 frequency="once", cusip="CD_1"))
+        cf.restart(self.DEFAULT_TRACKING_MONTHS)
+
+        report = cf.get_ladder_report()
+        acc1, acc2 = report.lines
+        self.assertEqual((acc1.account, acc2.account, report.total.account),
+                         ("acc1", "acc2", "Portfolio"))
+        # a bond at par is worth its face value; 20 coupons of 2.5% discounted at 2.5%
+        self.assertAlmostEqual(acc1.value, 10000.0, 6)
+        macaulay = (1.025 / 0.025) * (1 - 1.025 ** -20) / 2
+        self.assertAlmostEqual(acc1.macaulay, macaulay, 9)
+        self.assertAlmostEqual(acc1.modified, macaulay / 1.025, 9)
+        self.assertGreater(acc1.convexity, acc1.macaulay ** 2 / 2)
+        self.assertEqual(acc1.principal, (0.0,) * 9 + (10000.0,))
+        self.assertAlmostEqual(sum(acc1.interest), 5000.0, 6)
+        # the CD pays its interest and principal in the second year
+        self.assertEqual(acc2.positions, 1)
+        self.assertEqual(acc2.principal[1], 2000.0)
+        self.assertAlmostEqual(acc2.macaulay, 1.5, 9)
+        self.assertEqual(report.total.positions, 2)
+        self.assertEqual(report.total.principal, tuple(a + b for a, b in zip(acc1.principal,
+                                                                              acc2.principal)))
+        self.assertTrue(acc1.macaulay > report.total.macaulay > acc2.macaulay)
+        self.assertEqual(report.bucket_labels()[0], "0-1y")
+        self.assertEqual(report.bucket_labels()[-1], "9y+")
+
+    def test_data_access(self):
+        cf = self.make_cfa()
+
+        def restart_queries():
+            count = cf.dao.query_count
+            cf.restart(self.DEFAULT_TRACKING_MONTHS)
+            return cf.dao.query_count - count
+
+        restart_queries()  # the first restart also reads the table schemas
+        self.add_account(cf, "acc0")
+        queries = restart_queries()
+        for i in range(1, 5):
+            self.add_account(cf, "acc{}".format(i))
+        self.assertEqual(restart_queries(), queries)
+
+        accounts = cf.get_accounts_by_id()
+        rec_id = cf.get_account_rec_id("acc3")
+        self.assertEqual(accounts[rec_id]['account_name'], "acc3")
+        self.assertEqual(cf.get_from_db('account', 'account_name', "acc3"), [accounts[rec_id]])
+        self.assertEqual(cf.get_account_rec_id("no such account"), 0)
+
+        # names that are not in the schema never reach the query
+        self.assertRaises(RuntimeError, cf.get_from_db, 'account', 'rec_id = 1 OR 1', 1)
+        self.assertRaises(RuntimeError, cf.get_from_db, 'no_such_table')
+
+    def test_snapshot(self):
+        cf = self.make_cfa(accounts=("acc0",))
+        cf.start_date = datetime.datetime(2022, 1, 15)
+
+        rec_id = cf.get_account_rec_id("acc0")
+        cf.new_db_rec('fund', dict(account_name="acc0", symbol="F", date="2022-03-03",
+                                   balance=1000.0, est_roi=0.0))
+        cf.restart(self.DEFAULT_TRACKING_MONTHS)
+        snapshot = cf.snapshot
+        balance = cf.get_bal_on_date(cf.get_end_date(), cf.get_register(rec_id))
+        self.assertEqual(balance, 1000.0)
+        ca = [ca for ca in snapshot.cash_accounts if ca['account_rec_id'] == rec_id]
+        self.assertEqual(ca[0]['opening_date'], "2021-01-01")
+        with self.assertRaises(TypeError):
+            snapshot.funds[0]['balance'] = 0.0
+
+        # what-if run without the fund, the database is not read
+        count = cf.dao.query_count
+        cf.restart(self.DEFAULT_TRACKING_MONTHS, snapshot._replace(funds=()))
+        self.assertEqual(cf.dao.query_count, count)
+        self.assertEqual(cf.get_bal_on_date(cf.get_end_date(), cf.get_register(rec_id)), 0.0)
+
+        # back to the database
+        cf.restart(self.DEFAULT_TRACKING_MONTHS)
+        self.assertEqual(cf.get_bal_on_date(cf.get_end_date(), cf.get_register(rec_id)), balance)
+
+    def test_batch(self):
+        cf = self.make_cfa(accounts=("acc0",))
+
+        def new_fund(i):
+            cf.new_db_rec('fund', dict(account_name="acc0", symbol="F{}".format(i),
+                                       date="2022-03-03", balance=100.0, est_roi=0.0))
+
+        # a rolled back batch leaves no trace
+        cf.begin_batch()
+        for i in range(20):
+            new_fund(i)
+        self.assertEqual(cf.get_from_db('fund'), [])
+        cf.rollback_batch()
+        self.assertEqual(cf.get_from_db('fund'), [])
+
+        # account names are resolved from one cached map
+        cf.begin_batch()
+        count = cf.dao.query_count
+        for i in range(20):
+            new_fund(i)
+        self.assertLessEqual(cf.dao.query_count - count, 2)
+        cf.commit_batch()
+        funds = cf.get_from_db('fund')
+        self.assertEqual(len(funds), 20)
+        self.assertEqual({f['account_rec_id'] for f in funds}, {cf.get_account_rec_id("acc0")})
+
+        # updates, deletes and a new account in one batch
+        cf.begin_batch()
+        for fund in funds[:10]:
+            cf.write_to_db('fund', fund['rec_id'], [('balance', 200.0)])
+        for fund in funds[10:]:
+            cf.delete_db_rec('fund', fund['rec_id'])
+        self.add_account(cf, "acc1")
+        cf.write_to_db('fund', funds[0]['rec_id'], [('account_name', "acc1")])
+        cf.commit_batch()
+        self.assertFalse(cf.fm.db_conn.in_transaction)
+
+        funds = cf.get_from_db('fund')
+        self.assertEqual([f['balance'] for f in funds], [200.0] * 10)
+        self.assertEqual(funds[0]['account_rec_id'], cf.get_account_rec_id("acc1"))
+
+        # the edit window always rolls back: a no-op once committed, and
+        # after any other error the batch is closed so the next one can open
+        cf.rollback_batch()
+        self.assertEqual(len(cf.get_from_db('fund')), 10)
+        cf.begin_batch()
+        new_fund(20)
+        self.assertRaises(IndexError, cf.account_delete, 9999)
+        cf.rollback_batch()
+        cf.begin_batch()
+        cf.rollback_batch()
+        self.assertEqual(len(cf.get_from_db('fund')), 10)
+
+    def test_db_upgrade_indexes(self):
+        cf = self.make_cfa(None)
+        fm = cf.fm
+
+        def index_names(db_conn):
+            cursor = db_conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")
+            return {row[0] for row in cursor if not row[0].startswith('sqlite_')}
+
+        expected = {index[0] for index in dfc.DB_INDEXES}
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            filename = os.path.join(tmp_dir, "test.db")
+            fm.create_db(filename)
+            self.assertEqual(index_names(fm.db_conn), expected)
+            self.assertEqual(fm.db_conn.execute("PRAGMA journal_mode").fetchone()[0], "wal")
+            self.assertEqual(fm.db_conn.execute("PRAGMA foreign_keys").fetchone()[0], 1)
+
+            # make it look like a 2.2 file
+            for index in expected:
+                fm.db_conn.execute("DROP INDEX {}".format(index))
+            cf.set_version(fm.db_conn, 'base_version', "2.2")
+            fm.db_conn.close()
+
+            fm.db_conn = connect(filename)
+            fm.db_conn = database_upgrade(filename, fm.db_conn, cf)
+            self.assertEqual(index_names(fm.db_conn), expected)
+            self.assertEqual(cf.get_from_db('version_info')[0]['base_version'], dfc.SW_VERSION)
+            self.assertTrue(os.path.exists(os.path.join(tmp_dir, "test_2.2.db")))
+            fm.db_conn.close()
+
+    def test_dump_restore(self):
+        cf = self.make_cfa(accounts=("acc0",))
+        for i in range(25):
+            cf.new_db_rec('fund', dict(account_name="acc0", symbol="F's, \"{}\"".format(i), date="2022-03-03",
+                                       balance=100.0 / (i + 1), est_roi=None))
+
+        def content(db_conn):
+            return {table: db_conn.execute("SELECT * FROM {} ORDER BY rowid".format(table)).fetchall()
+                    for table in db_export.get_tables(db_conn) if table != 'version_info'}
+
+        expected = content(cf.fm.db_conn)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for ext in ("csv", "jsonl", "snap"):
+                filename = os.path.join(tmp_dir, "dump." + ext)
+                db_export.dump(cf.fm.db_conn, filename, chunk_size=10)
+
+                new_fm = FileManager(cf.logger)
+                new_fm.create_db(":memory:")
+                db_export.restore(new_fm.db_conn, filename, chunk_size=10)
+                self.assertEqual(content(new_fm.db_conn), expected, ext)
+
+            # a text dump is for people only
+            filename = os.path.join(tmp_dir, "dump.txt")
+            db_export.dump(cf.fm.db_conn, filename)
+            self.assertRaises(ValueError, db_export.restore, new_fm.db_conn, filename)
+
+    def test_ledger_cache(self):
+        reg = Register(datetime.datetime(2018, 1, 20), 100.0, "Opening Balance")
+        reg.insert(datetime.datetime(2018, 2, 1, 10), 25.5, "Debit, Note: \u00e9")
+        reg.insert(datetime.datetime(2018, 2, 1, 1), -0.1, "")
+        ledger = decode_ledger(encode_ledger({7: reg}))
+        self.assertEqual(list(ledger[7]), list(reg))
+        self.assertEqual(ledger[7].opening_balance, reg.opening_balance)
+
+        cf = self.make_cfa(accounts=("acc0",))
+        cf.new_db_rec('fund', dict(account_name="acc0", symbol="F", date="2022-03-03",
+                                   balance=1000.0, est_roi=0.0))
+        cf.restart(self.DEFAULT_TRACKING_MONTHS)
+
+        # same inputs, the ledger comes from the cache
+        cached = CfAnalysis(cf.fm, cf.logger)
+        cached.start_date = cf.start_date
+        cached.build_ledger = lambda: self.fail("ledger rebuilt")
+        cached.restart(self.DEFAULT_TRACKING_MONTHS)
+        self.assertEqual({acc: list(reg) for acc, reg in cached.ledger.items()},
+                         {acc: list(reg) for acc, reg in cf.ledger.items()})
+
+        # new inputs, the ledger is rebuilt
+        del cached.build_ledger
+        cached.restart(self.DEFAULT_TRACKING_MONTHS + 1)
+        self.assertNotEqual(cached.ledger_hash, cf.ledger_hash)
+
+        # an incremental restart after an edit doesn't write the cache
+        cf.save_ledger_cache = lambda input_hash: self.fail("cache written")
+        cf.new_db_rec('fund', dict(account_name="acc0", symbol="G", date="2022-03-03",
+                                   balance=500.0, est_roi=0.0))
+        cf.restart(self.DEFAULT_TRACKING_MONTHS)
+        self.assertEqual(cf.get_restart_profile().rebuilt, "1")
+
+    def test_ledger_cache_locked(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            filename = os.path.join(tmp_dir, "test.db")
+            cf = self.make_cfa(filename, accounts=("acc0",))
+            fm = cf.fm
+            cf.restart(self.DEFAULT_TRACKING_MONTHS)
+            ledger_hash = cf.ledger_hash
+            cf.new_db_rec('fund', dict(account_name="acc0", symbol="F", date="2022-03-03",
+                                       balance=1000.0, est_roi=0.0))
+
+            # another connection holds the write lock across a cache miss
+            fm.db_conn.execute("PRAGMA busy_timeout = 0")
+            other = connect(filename)
+            other.execute("BEGIN IMMEDIATE")
+            try:
+                cf.mark_all_dirty()
+                cf.restart(self.DEFAULT_TRACKING_MONTHS)
+            finally:
+                other.rollback()
+                other.close()
+
+            # the ledger is built, only the cache is left as it was
+            self.assertEqual(cf.ledger_hash, ledger_hash)
+            rec_id = cf.get_account_rec_id("acc0")
+            self.assertEqual(cf.get_bal_on_date(cf.get_end_date(), cf.get_register(rec_id)), 1000.0)
+            self.assertEqual(cf.dirty_accounts, set())
+            fm.db_conn.close()
+
+    def test_headless(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            filename = os.path.join(tmp_dir, "test.db")
+            cf = self.make_cfa(filename, accounts=("acc0",))
+            fm = cf.fm
+            cf.new_db_rec('fund', dict(account_name="acc0", symbol="F", date="2022-03-03",
+                                       balance=1000.0, est_roi=0.0))
+            fm.db_conn.close()
+
+            out = io.StringIO()
+            run_headless(parse_args(["--db", filename, "--months", "12", "--start", "2022-01-15",
+                                     "--report", "csv"]), out)
+            lines = out.getvalue().splitlines()
+            self.assertEqual(lines[0], "date,acc0")
+            self.assertEqual(lines[1], "2022-01-15,0.00")
+            self.assertEqual(lines[-1], "2022-12-15,1000.00")
+
+            out = io.StringIO()
+            run_headless(parse_args(["--db", filename, "--months", "12", "--report", "registers"]), out)
+            self.assertIn("Account: acc0", out.getvalue())
+
+            # the reports don't write the ledger cache
+            conn = connect(filename)
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM ledger_cache").fetchone()[0], 0)
+            conn.close()
+
+        # the engine doesn't need the GUI
+        self.assertNotIn("cf_gui", sys.modules)
+
+    def test_benchmark(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            filename = os.path.join(tmp_dir, "bench.db")
+            benchmark.generate_portfolio(filename, accounts=3, bonds=4, cds=2, loans=1, transfers=8)
+            cfa = benchmark.open_analysis(filename)
+            counts = {table: len(cfa.get_from_db(table)) for table in ('bond', 'cd', 'loan', 'transfer')}
+            self.assertEqual(counts, dict(bond=4, cd=2, loan=1, transfer=8))
+            self.assertEqual(len(cfa.get_real_accounts('account')), 3)
+            cfa.fm.db_conn.close()
+
+            timings, profile = benchmark.run_benchmark(filename, months=24, repeat=2)
+            self.assertEqual(sorted(timings), sorted(benchmark.TIMINGS))
+            self.assertEqual(profile.rebuilt, "all")
+            for times in timings.values():
+                self.assertEqual(len(times), 2)
+
+        results = dict(version=benchmark.RESULTS_VERSION, commit=None, python="", numpy=False, months=24,
+                       repeat=2, scales={'small': dict(portfolio={}, timings={
+                           name: benchmark.summarize(times) for name, times in timings.items()})})
+        lines = benchmark.format_results(json.loads(json.dumps(results)), base=results)
+        self.assertIn("x1.00", lines[-1])
+
+    def test_restart_profile(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            cf = self.make_cfa(os.path.join(tmp_dir, "test.db"), accounts=("acc0",))
+            fm = cf.fm
+            self.assertIsNone(cf.get_restart_profile())
+            cf.new_db_rec('fund', dict(account_name="acc0", symbol="F", date="2022-03-03",
+                                       balance=1000.0, est_roi=0.0))
+            cf.new_db_rec('transfer', dict(from_account_name="income", to_account_name="acc0",
+                                           amount=10.0, frequency="2022-01-01;12;monthly;1",
+                                           inflation=0.0, note=""))
+
+            cf.mark_all_dirty()
+            cf.restart(24, use_cache=False)
+            profile = cf.get_restart_profile()
+            stages = {stats.stage: stats for stats in profile.stages}
+            self.assertEqual(profile.rebuilt, "all")
+            self.assertNotIn("load_cache", stages)
+            for stage in ('load_snapshot', 'account_set_up', 'process_transfers', 'process_loans',
+                          'process_cds', 'process_bonds', 'process_funds', 'commit_transactions',
+                          'apply_interest'):
+                self.assertIn(stage, stages)
+            self.assertEqual(stages['process_transfers'].transactions, 24)  # 12 debits, 12 credits
+            self.assertEqual(stages['process_funds'].transactions, 1)
+            self.assertGreater(stages['load_snapshot'].queries, 0)
+            self.assertEqual(stages['process_transfers'].queries, 0)
+            # the staged transactions are inserted by commit_transactions()
+            self.assertEqual(stages['process_transfers'].inserts, 0)
+            self.assertEqual(stages['commit_transactions'].inserts,
+                             stages['process_transfers'].transactions + stages['process_funds'].transactions)
+            total = profile.total()
+            self.assertEqual(total.queries, sum(stats.queries for stats in profile.stages))
+            self.assertEqual(profile.report()[-1].split()[0], "total")
+
+            # a cached restart
+            cf.mark_all_dirty()
+            cf.restart(24)
+            self.assertEqual(cf.get_restart_profile().rebuilt, "none (cached)")
+
+            prof_file = os.path.join(tmp_dir, "restart.prof")
+            profile = cf.profile_restart(24, prof_file)
+            self.assertEqual(profile.rebuilt, "all")
+            self.assertIn("apply_interest", [stats.stage for stats in profile.stages])
+            self.assertTrue(os.path.getsize(prof_file) > 0)
+            fm.db_conn.close()
+
+    def test_logger(self):
+        class Arg:
+            formatted = 0
+
+            def __str__(self):
+                Arg.formatted += 1
+                return "arg"
+
+        logger = Logger(logging.WARNING)
+        Logger(logging.WARNING)
+        queue_handlers = [h for h in logger.log_connection.handlers if type(h).__name__ == "QueueHandler"]
+        self.assertEqual(len(queue_handlers), 1)  # one queue, however many Loggers
+
+        # messages of disabled levels are never formatted
+        logger.log(logging.DEBUG, "value %s", Arg())
+        logger.log(logging.INFO, "value %s", Arg())
+        self.assertEqual(Arg.formatted, 0)
+
+        logger.set_debug(True)
+        try:
+            self.assertTrue(logger.is_debug())
+            with self.assertLogs("cf", logging.DEBUG) as logs:
+                logger.log(logging.DEBUG, "value %s", Arg())
+                logger.log(99, "unknown level")
+            self.assertEqual(logs.output, ["DEBUG:cf:value arg", "INFO:cf:unknown level"])
+        finally:
+            logger.set_debug(False)
+        self.assertFalse(logger.is_enabled(logging.INFO))
+
+    def test_arg_checks(self):
+        cf = self.make_cfa(None)
+        cf.ledger[2] = Register(datetime.datetime(2021, 1, 1), 0.0, "Opening Balance")
+
+        self.assertTrue(CfAnalysis.check_args)
+        with self.assertRaises(TypeError):
+            cf.credit(2, 10, datetime.datetime(2021, 2, 1), "int amount")
+        with self.assertRaises(TypeError):
+            CfAnalysis.get_next_date(datetime.date(2021, 2, 1), 1)
+
+        CfAnalysis.set_arg_checks(False)
+        try:
+            cf.credit(2, 10, datetime.datetime(2021, 2, 1), "int amount")
+            self.assertEqual(cf.get_register(2)[-1][2], 10)
+        finally:
+            CfAnalysis.set_arg_checks(True)
+
+        # the snapshot is checked once per restart, whatever the setting
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            cf.fm.create_db(os.path.join(tmp_dir, "test.db"))
+            self.add_account(cf, "acc0")
+            cf.new_db_rec('fund', dict(account_name="acc0", symbol="F", date="2022-03-03",
+                                       balance=1000.0, est_roi=0.0))
+            snapshot = cf.dao.load_snapshot()
+            check_snapshot(snapshot)
+            bad_fund = dict(snapshot.funds[0], balance="1000")
+            with self.assertRaisesRegex(TypeError, "funds rec_id 1: balance"):
+                check_snapshot(snapshot._replace(funds=(bad_fund,)))
+            CfAnalysis.set_arg_checks(False)
+            try:
+                with self.assertRaises(TypeError):
+                    cf.restart(12, snapshot._replace(funds=(bad_fund,)))
+            finally:
+                CfAnalysis.set_arg_checks(True)
+            cf.fm.db_conn.close()
+
+    def test_startup_imports(self):
+        try:
+            import tkinter
+        except ImportError:
+            self.skipTest("tkinter is not available")
+
+        # windows opened from the menus are imported on first use
+        deferred = ('help', 'settings_win', 'account_edit_win', 'import_win', 'import_support',
+                    'db_export')
+        code = "import sys, cf, cf_gui; print(' '.join(m for m in {!r} if m in sys.modules))".format(deferred)
+        result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)))
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertEqual(result.stdout.strip(), "")
+
+    def test_import_timer(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            with open(os.path.join(tmp_dir, "timed_outer.py"), "w") as f:
+                f.write("import timed_inner\nVALUE = timed_inner.VALUE + 1\n")
+            with open(os.path.join(tmp_dir, "timed_inner.py"), "w") as f:
+                f.write("VALUE = 1\n")
+            sys.path.insert(0, tmp_dir)
+            try:
+                with ImportTimer() as timer:
+                    import timed_outer
+            finally:
+                sys.path.remove(tmp_dir)
+                sys.modules.pop("timed_outer", None)
+                sys.modules.pop("timed_inner", None)
+
+        self.assertEqual(timed_outer.VALUE, 2)
+        self.assertNotIn(timer, sys.meta_path)
+        # the real loader is left on the module
+        self.assertNotIn("Timed", type(timed_outer.__loader__).__name__)
+
+        records = {name: (depth, self_time, cumulative) for depth, name, self_time, cumulative in timer.records}
+        self.assertEqual(records["timed_outer"][0], 0)
+        self.assertEqual(records["timed_inner"][0], 1)
+        self.assertGreaterEqual(records["timed_outer"][2], records["timed_inner"][2])
+        self.assertEqual(timer.total(), records["timed_outer"][2])
+        self.assertTrue(timer.report()[-1].endswith(" timed_outer"))
+
 
 # the following allows for simpler run syntax
 # This didn't work.  The run is looking for command line args to cf.py